@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Benchmark the client side of containerized callables against local stand-in servers.
+
+The stand-ins (see processor_zoo.standins) replace the model containers, so
+this runs without Docker or models. The reported overhead is the per-frame
+latency minus the simulated model latency, i.e. the cost of encoding,
+transferring, and parsing frames and results (including the stand-in's own
+decoding, which a real server also pays).
+
+    ./benchmark_containerized.py --processor tfserving --width 1280 --height 720 --latency 0.01
+
+Usage: ./benchmark_containerized.py -h
+"""
+
+import os
+import tempfile
+import time
+
+import fire
+import numpy as np
+
+from gabrieltool.statemachine.callable_zoo.processor_zoo import containerized, standins
+
+
+def benchmark(processor='fasterrcnn', width=640, height=480, iterations=100, warmup=5, latency=0.0):
+    """Measure the per-frame latency of a containerized callable.
+
+    Arguments:
+        processor {string} -- 'fasterrcnn' (FasterRCNNContainerCallable) or
+            'tfserving' (TFServingContainerCallable).
+        width {int} -- Frame width.
+        height {int} -- Frame height.
+        iterations {int} -- Number of timed frames.
+        warmup {int} -- Number of untimed frames.
+        latency {float} -- Simulated model latency of the stand-in in seconds.
+    """
+    standins.LocalContainerManager.latency = latency
+    containerized.FasterRCNNContainerCallable.CONTAINER_MANAGER_CLASS = standins.LocalContainerManager
+    containerized.TFServingContainerCallable.CONTAINER_MANAGER_CLASS = standins.LocalContainerManager
+    if processor == 'fasterrcnn':
+        proc = containerized.FasterRCNNContainerCallable('standin', conf_threshold=0.5)
+    elif processor == 'tfserving':
+        # TFServingContainerCallable writes models.config to the working directory
+        os.chdir(tempfile.mkdtemp())
+        proc = containerized.TFServingContainerCallable('standin', os.getcwd(), conf_threshold=0.5)
+        proc.prepare()
+    else:
+        raise ValueError('Unsupported processor {}.'.format(processor))
+    frame = np.random.randint(0, 255, (height, width, 3), dtype=np.uint8)
+    try:
+        for _ in range(warmup):
+            proc(frame)
+        latencies = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            proc(frame)
+            latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        proc.clean()
+    overheads = np.array(latencies) - latency * 1000
+    print('{:>12} {:>10} {:>10} {:>10} {:>10}'.format('processor', 'frame', 'mean(ms)', 'p50(ms)', 'p90(ms)'))
+    print('{:>12} {:>10} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+        processor, '{}x{}'.format(width, height), np.mean(overheads),
+        np.percentile(overheads, 50), np.percentile(overheads, 90)))
+
+
+if __name__ == '__main__':
+    fire.Fire(benchmark)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""Benchmark FasterRCNNOpenCVCallable with different OpenCV DNN settings.
+
+Compares the per-frame latency of the preferable backends and targets supported
+by FasterRCNNOpenCVCallable, and of OpenCV thread counts, to help pick the
+settings for a CPU-only edge machine. The thread count is process-wide (see
+opencv_num_threads of BasicCognitiveEngineRunner and gbt run). Settings that are not available in the installed OpenCV
+fall back to the default backend on CPU (a warning is logged).
+
+The sandwich model used by sandwich.py can be used here, e.g.
+
+    ./benchmark_opencv_dnn.py --data_dir sandwich-model --image sandwich-model/test.jpg \
+        --backends default,openvino --targets cpu,cpu_fp16 --num_threads 1,2,4
+
+Usage: ./benchmark_opencv_dnn.py -h
+"""
+
+import os
+import time
+
+import cv2
+import fire
+import numpy as np
+
+from gabrieltool.statemachine import processor_zoo
+
+
+def _as_list(value):
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [item for item in str(value).split(',') if item]
+
+
+def benchmark(data_dir='sandwich-model', image=None, backends='default', targets='cpu',
+              num_threads='None', iterations=20, warmup=3):
+    """Measure the per-frame latency of each backend, target and thread setting.
+
+    Arguments:
+        data_dir {string} -- Directory with faster_rcnn_test.pt and model.caffemodel.
+        image {string} -- Test image. A random image is used if not given.
+        backends {string} -- Comma separated backends (see processor_zoo.base.DNN_BACKENDS).
+        targets {string} -- Comma separated targets (see processor_zoo.base.DNN_TARGETS).
+        num_threads {string} -- Comma separated OpenCV thread counts. None uses OpenCV's setting.
+        iterations {int} -- Number of timed frames per setting.
+        warmup {int} -- Number of untimed frames per setting.
+    """
+    if image is not None:
+        frame = cv2.imread(image)
+    else:
+        frame = np.random.randint(0, 255, (480, 640, 3), dtype=np.uint8)
+    print('{:>10} {:>12} {:>8} {:>10} {:>10} {:>10}'.format(
+        'backend', 'target', 'threads', 'mean(ms)', 'p50(ms)', 'p90(ms)'))
+    default_num_threads = cv2.getNumThreads()
+    for backend in _as_list(backends):
+        for target in _as_list(targets):
+            for threads in _as_list(num_threads):
+                threads = None if threads == 'None' else int(threads)
+                cv2.setNumThreads(default_num_threads if threads is None else threads)
+                proc = processor_zoo.FasterRCNNOpenCVCallable(
+                    proto_path=os.path.join(data_dir, 'faster_rcnn_test.pt'),
+                    model_path=os.path.join(data_dir, 'model.caffemodel'),
+                    labels=None,
+                    backend=backend,
+                    target=target)
+                for _ in range(warmup):
+                    proc(frame)
+                latencies = []
+                for _ in range(iterations):
+                    start = time.perf_counter()
+                    proc(frame)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                print('{:>10} {:>12} {:>8} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+                    backend, target, str(threads), np.mean(latencies),
+                    np.percentile(latencies, 50), np.percentile(latencies, 90)))
+
+
+if __name__ == '__main__':
+    fire.Fire(benchmark)
@@ -1,5 +1,8 @@
 """A collection of Callable classes to be used by Processors and TransitionPredicates.
 """
 from gabrieltool.statemachine.callable_zoo.base import record_kwargs, CallableBase, Null  # noqa: F401
+from gabrieltool.statemachine.callable_zoo.base import current_session, session_scope  # noqa: F401
+from gabrieltool.statemachine.callable_zoo.frame import FrameContext  # noqa: F401
+from gabrieltool.statemachine.callable_zoo.detections import Detections, LabelDetections  # noqa: F401
 from gabrieltool.statemachine.callable_zoo import processor_zoo  # noqa: F401
 from gabrieltool.statemachine.callable_zoo import predicate_zoo  # noqa: F401
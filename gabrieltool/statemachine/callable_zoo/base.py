@@ -1,8 +1,12 @@
 """Base class and helper functions for callable classes.
 """
+import contextlib
 import inspect
+import threading
 from functools import wraps
 
+_session_local = threading.local()
+
 
 def record_kwargs(func):
     """
@@ -33,6 +37,34 @@ def record_kwargs(func):
     return wrapper
 
 
+def current_session():
+    """Return the storage of the FSM session that is running in this thread.
+
+    Returns:
+        dict: Per-session storage, or None when no session is active.
+    """
+    return getattr(_session_local, 'storage', None)
+
+
+@contextlib.contextmanager
+def session_scope(storage):
+    """Context manager to activate a session's storage in the current thread.
+
+    Runners enter a session scope while feeding inputs, so that stateful
+    callables shared by many sessions can keep their mutable state per session
+    (see CallableBase.session_state).
+
+    Args:
+        storage (dict): The storage of the session.
+    """
+    previous = current_session()
+    _session_local.storage = storage
+    try:
+        yield storage
+    finally:
+        _session_local.storage = previous
+
+
 class CallableBase():
     """Base class for Callables used in FSMs.
 
@@ -40,6 +72,10 @@ class CallableBase():
     should add decorator @record_kwargs to their constructors for serialization.
     """
 
+    # Processors pass a FrameContext instead of the image to callables that
+    # set this (see callable_zoo.FrameContext).
+    accepts_frame_context = False
+
     def __init__(self):
         super().__init__()
         setattr(self, 'kwargs', {})
@@ -53,6 +89,22 @@ class CallableBase():
         """
         return cls(**json_obj)
 
+    def session_state(self):
+        """Mutable state of this callable in the active session.
+
+        Callables are shared by all sessions running the same FSM. Stateful
+        callables should keep their mutable state (e.g. timers) in the returned
+        dictionary instead of instance variables. When there is no active
+        session, the state is kept on the instance.
+
+        Returns:
+            dict: The state of this callable.
+        """
+        storage = current_session()
+        if storage is None:
+            storage = self.__dict__.setdefault('_default_session_storage', {})
+        return storage.setdefault(id(self), {})
+
     def __eq__(self, other):
         if isinstance(other, CallableBase):
             return self.kwargs == other.kwargs
@@ -0,0 +1,199 @@
+"""Object detections of a frame backed by NumPy arrays.
+"""
+import collections.abc
+
+import numpy as np
+
+
+class LabelDetections(collections.abc.Sequence):
+    """The detections of one label, as a lazy view on a Detections object.
+
+    Vectorized code uses the arrays boxes, scores and class_ids. For
+    compatibility, it is also a sequence of [x1, y1, x2, y2, confidence,
+    label] entries that compares equal to the list of these entries.
+    """
+
+    def __init__(self, detections, label, indices):
+        super(LabelDetections, self).__init__()
+        self._detections = detections
+        self.label = label
+        self._indices = indices
+
+    @property
+    def boxes(self):
+        """2d array of [x1, y1, x2, y2]."""
+        return self._detections.boxes[self._indices]
+
+    @property
+    def scores(self):
+        """1d array of confidences."""
+        return self._detections.scores[self._indices]
+
+    @property
+    def class_ids(self):
+        """1d array of class ids."""
+        return self._detections.class_ids[self._indices]
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return self._detections.entry(self._indices[idx])
+
+    def __iter__(self):
+        return iter(self._detections.entries(self._indices))
+
+    def __eq__(self, other):
+        if isinstance(other, (LabelDetections, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class Detections(collections.abc.Mapping):
+    """Object detections of a frame, grouped by label.
+
+    Detections are stored as arrays of boxes, scores and class ids, and class
+    ids index a vocabulary of labels. The arrays are used as given, so that
+    model outputs are not copied.
+
+    For compatibility with processors that return a dictionary of label ->
+    [[x1, y1, x2, y2, confidence, label], ...], it is a read-only mapping from
+    labels to LabelDetections views (e.g. `label in detections`,
+    `detections[label]`, and `app_state.update(detections)` work), and it
+    compares equal to the equivalent dictionary.
+    """
+
+    def __init__(self, boxes, scores, class_ids, labels=None, entry_class_ids=False, keep_labels=False):
+        """Constructor.
+
+        Args:
+            boxes (numpy array): 2d array of [x1, y1, x2, y2] in pixels.
+            scores (numpy array): 1d array of confidences.
+            class_ids (numpy array): 1d array of integer class ids.
+            labels (list, optional): Label of each class id. Defaults to None,
+                which uses class ids as labels.
+            entry_class_ids (bool, optional): End the entries of the
+                dictionary view with the class id instead of the label.
+                Defaults to False.
+            keep_labels (bool, optional): Have every label of labels in the
+                dictionary view, including labels without detections (as
+                empty LabelDetections). Defaults to False, which has only
+                the labels that are detected.
+        """
+        super(Detections, self).__init__()
+        self.boxes = np.asarray(boxes).reshape(-1, 4)
+        self.scores = np.asarray(scores).reshape(-1)
+        self.class_ids = np.asarray(class_ids).reshape(-1)
+        if not len(self.boxes) == len(self.scores) == len(self.class_ids):
+            raise ValueError('boxes, scores and class_ids have different lengths ({}, {}, {}).'.format(
+                len(self.boxes), len(self.scores), len(self.class_ids)))
+        self.labels = labels
+        self.entry_class_ids = entry_class_ids
+        self.keep_labels = keep_labels and labels is not None
+        # label -> class id, for labels that are not class ids
+        self._label_ids = {label: idx for (idx, label) in enumerate(labels)} if labels is not None else None
+        # class ids that have detections, computed on first use
+        self._present_ids = None
+        self._views = {}
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros((0, 4), dtype=np.int64), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64))
+
+    @classmethod
+    def from_dict(cls, results):
+        """Create Detections from a dictionary of label -> [[x1, y1, x2, y2, confidence, label], ...].
+
+        Labels with an empty list are kept, so the Detections compare equal to the dictionary.
+        """
+        labels = list(results.keys())
+        entries = [(entry, idx) for (idx, label) in enumerate(labels) for entry in results[label]]
+        if not entries:
+            return cls(np.zeros((0, 4), dtype=np.int64), np.zeros(0, dtype=np.float32),
+                       np.zeros(0, dtype=np.int64), labels=labels, keep_labels=True)
+        boxes = np.array([entry[:4] for (entry, _) in entries])
+        scores = np.array([entry[4] for (entry, _) in entries], dtype=np.float64)
+        class_ids = np.array([idx for (_, idx) in entries], dtype=np.int64)
+        return cls(boxes, scores, class_ids, labels=labels, keep_labels=True)
+
+    @classmethod
+    def of(cls, results):
+        """Return results if it is Detections, or Detections of a dictionary of results."""
+        if isinstance(results, cls):
+            return results
+        return cls.from_dict(results)
+
+    @property
+    def num_detections(self):
+        return len(self.scores)
+
+    def label_of(self, class_id):
+        """Label of a class id."""
+        return self.labels[class_id] if self.labels is not None else class_id
+
+    def class_id_of(self, label):
+        """Class id of a label, or None if the label is unknown."""
+        if self._label_ids is not None:
+            return self._label_ids.get(label)
+        if isinstance(label, (int, np.integer)):
+            return int(label)
+        return None
+
+    def entry(self, idx):
+        """The [x1, y1, x2, y2, confidence, label] entry of a detection."""
+        return self.entries([idx])[0]
+
+    def entries(self, indices=None):
+        """The [x1, y1, x2, y2, confidence, label] entries of detections.
+
+        Args:
+            indices (array, optional): Indices of the detections. Defaults to None (all).
+        """
+        if indices is None:
+            indices = slice(None)
+        class_ids = self.class_ids[indices].tolist()
+        tags = class_ids if self.entry_class_ids else [self.label_of(class_id) for class_id in class_ids]
+        return [[*box, score, tag] for (box, score, tag) in
+                zip(self.boxes[indices].tolist(), self.scores[indices].tolist(), tags)]
+
+    def to_dict(self):
+        """The detections as a dictionary of label -> [[x1, y1, x2, y2, confidence, label], ...]."""
+        return {label: list(view) for (label, view) in self.items()}
+
+    def _get_present_ids(self):
+        if self._present_ids is None:
+            if self.keep_labels:
+                self._present_ids = dict.fromkeys(range(len(self.labels)))
+            else:
+                self._present_ids = dict.fromkeys(np.unique(self.class_ids).tolist())
+        return self._present_ids
+
+    def __getitem__(self, label):
+        view = self._views.get(label)
+        if view is None:
+            class_id = self.class_id_of(label)
+            if class_id is None or class_id not in self._get_present_ids():
+                raise KeyError(label)
+            indices = np.flatnonzero(self.class_ids == class_id)
+            view = self._views[label] = LabelDetections(self, label, indices)
+        return view
+
+    def __contains__(self, label):
+        class_id = self.class_id_of(label)
+        return class_id is not None and class_id in self._get_present_ids()
+
+    def __iter__(self):
+        return iter([self.label_of(class_id) for class_id in self._get_present_ids()])
+
+    def __len__(self):
+        return len(self._get_present_ids())
+
+    def __repr__(self):
+        return 'Detections({!r})'.format(self.to_dict())
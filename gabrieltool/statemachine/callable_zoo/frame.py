@@ -0,0 +1,91 @@
+"""Per-frame context shared by the processors of a state.
+"""
+import cv2
+
+
+class FrameContext(object):
+    """An input frame with lazily computed and cached derived views.
+
+    Processors of a state often transform the same frame in the same way (e.g.
+    BGR to RGB, or JPEG encoding). States give a FrameContext to processors
+    whose callables set accepts_frame_context, so that each transformation is
+    computed once per frame. Views are cached for the lifetime of the context
+    and should be treated as read-only.
+    """
+
+    def __init__(self, image, payload=None):
+        """Constructor.
+
+        Args:
+            image (numpy array): The frame as a BGR image (OpenCV's format).
+            payload (bytes, optional): The encoded frame as received from the
+                client (e.g. JPEG). Defaults to None.
+        """
+        super(FrameContext, self).__init__()
+        self._image = image
+        self._payload = payload
+        self._cache = {}
+
+    @classmethod
+    def of(cls, frame):
+        """Return frame if it is a FrameContext, or a new FrameContext of the image."""
+        if isinstance(frame, cls):
+            return frame
+        return cls(frame)
+
+    @property
+    def image(self):
+        """The BGR image."""
+        return self._image
+
+    @property
+    def payload(self):
+        """The encoded frame as received from the client, or None."""
+        return self._payload
+
+    @property
+    def shape(self):
+        return self._image.shape
+
+    def memoize(self, key, compute):
+        """Return the cached view of a key, computing it on first use.
+
+        Custom callables can use this to share their own derived views.
+
+        Args:
+            key (hashable): Identifies the view, including its parameters.
+            compute (callable): Called without arguments to compute the view.
+        """
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    @property
+    def rgb(self):
+        """The image in RGB."""
+        return self.memoize('rgb', lambda: cv2.cvtColor(self._image, cv2.COLOR_BGR2RGB))
+
+    @property
+    def gray(self):
+        """The image in grayscale."""
+        return self.memoize('gray', lambda: cv2.cvtColor(self._image, cv2.COLOR_BGR2GRAY))
+
+    def resized(self, dsize=None, fx=0, fy=0, interpolation=cv2.INTER_LINEAR):
+        """The BGR image resized. The arguments are the same as cv2.resize's."""
+        dsize = tuple(dsize) if dsize is not None else None
+        return self.memoize(
+            ('resized', dsize, fx, fy, interpolation),
+            lambda: cv2.resize(self._image, dsize, None, fx=fx, fy=fy, interpolation=interpolation))
+
+    def jpeg(self, quality=95):
+        """The image encoded as JPEG.
+
+        Args:
+            quality (int, optional): JPEG quality (0-100). Defaults to 95.
+
+        Returns:
+            numpy array: The encoded bytes as a 1-d uint8 array.
+        """
+        return self.memoize(
+            ('jpeg', quality),
+            lambda: cv2.imencode('.jpg', self._image, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])[1])
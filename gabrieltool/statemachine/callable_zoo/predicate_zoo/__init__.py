@@ -1 +1,4 @@
 from .base import HasObjectClass, Always, HasObjectClassWhileNotOthers, Wait  # noqa: F401
+from .quantitative import HasObjectArea, HasObjectAspectRatio, HasObjectConfidence, HasObjectCount  # noqa: F401
+from .spatial import HasObjectInside, HasObjectOverlap, HasObjectPosition  # noqa: F401
+from .temporal import HasNoObjectForDuration, HasObjectForDuration, HasObjectInRecentFrames  # noqa: F401
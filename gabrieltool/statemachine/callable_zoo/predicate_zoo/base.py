@@ -67,6 +67,10 @@ class HasObjectClassWhileNotOthers(CallableBase):
 
 class Wait(CallableBase):
     """Wait for some time before turning true.
+
+    Runners start the timer when a state is entered. Transitions that only
+    have Wait predicates are taken by the runner at their deadline, without
+    running the state's processors.
     """
 
     @record_kwargs
@@ -78,17 +82,32 @@ class Wait(CallableBase):
         """
         super().__init__()
         self.wait_time = wait_time if wait_time is not None else 0
-        # set when this predicate this first called
-        # or returned True in the last call.
-        self._start_time = None
+
+    @property
+    def timer_duration(self):
+        """Seconds to wait before turning true."""
+        return self.wait_time
+
+    def start_timer(self, start_time=None):
+        """Start waiting in the active session.
+
+        Args:
+            start_time (float, optional): Start time as returned by
+                time.time(). Defaults to now.
+        """
+        self.session_state()['start_time'] = start_time if start_time is not None else time.time()
 
     def __call__(self, app_state):
-        if self._start_time is None:
-            self._start_time = time.time()
+        # start_time is kept per session. It is set when this predicate is
+        # first called or returned True in the last call.
+        state = self.session_state()
+        start_time = state.get('start_time')
+        if start_time is None:
+            state['start_time'] = time.time()
         else:
             cur_time = time.time()
-            if (cur_time - self._start_time) > self.wait_time:
+            if (cur_time - start_time) > self.wait_time:
                 # reset
-                self._start_time = None
+                state['start_time'] = None
                 return True
         return False
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""Callable classes for Transition Predicates on quantities of detected objects.
+
+The predicates check all the detections of a class at once with NumPy, e.g.
+"at least 3 bolts with confidence above 0.7" or "a board that covers more
+than 10% of the frame". Detections are read from the app_state, as
+Detections views or as lists of [x1, y1, x2, y2, confidence, label].
+"""
+import copy
+
+import numpy as np
+
+from gabrieltool.statemachine.callable_zoo import record_kwargs
+from gabrieltool.statemachine.callable_zoo import CallableBase
+from gabrieltool.statemachine.callable_zoo import LabelDetections
+
+_NO_BOXES = np.zeros((0, 4))
+_NO_SCORES = np.zeros(0)
+
+
+def select_detections(app_state, class_name, min_confidence=0.0):
+    """Boxes and confidences of the detections of a class.
+
+    Args:
+        app_state (dict): Outputs of the processors.
+        class_name (string): Class name or id.
+        min_confidence (float, optional): Only detections with at least this
+            confidence are selected. Defaults to 0.
+
+    Returns:
+        tuple: 2d array of [x1, y1, x2, y2] and 1d array of confidences.
+    """
+    detections = app_state.get(class_name)
+    if detections is None or len(detections) == 0:
+        return _NO_BOXES, _NO_SCORES
+    if isinstance(detections, LabelDetections):
+        boxes, scores = detections.boxes, detections.scores
+    else:
+        entries = np.array([entry[:5] for entry in detections], dtype=np.float64)
+        boxes, scores = entries[:, :4], entries[:, 4]
+    if min_confidence:
+        selected = scores >= min_confidence
+        boxes, scores = boxes[selected], scores[selected]
+    return boxes, scores
+
+
+def _from_json(cls, json_obj, converters):
+    """Deserialize a predicate whose arguments are converted by converters (name -> function)."""
+    try:
+        kwargs = copy.copy(json_obj)
+        for name, convert in converters.items():
+            if json_obj.get(name) in (None, '', 'None'):
+                kwargs.pop(name, None)
+            else:
+                kwargs[name] = convert(json_obj[name])
+    except ValueError as e:
+        raise ValueError(
+            'Failed to convert json object to {} instance. '
+            'The input json object is {}. ({})'.format(cls.__name__,
+                                                       json_obj, e))
+    return cls(**kwargs)
+
+
+class HasObjectCount(CallableBase):
+    """Check if the number of detected objects of a class is within a range.
+    """
+
+    @record_kwargs
+    def __init__(self, class_name, min_count=1, max_count=None, min_confidence=0.0):
+        """Constructor.
+
+        Args:
+            class_name (string): Class name or id.
+            min_count (int, optional): Minimum number of objects. Defaults to 1.
+            max_count (int, optional): Maximum number of objects. Defaults to None (no maximum).
+            min_confidence (float, optional): Only objects detected with at
+                least this confidence are counted. Defaults to 0.
+        """
+        super().__init__()
+        self.class_name = class_name
+        self.min_count = min_count
+        self.max_count = max_count
+        self.min_confidence = min_confidence
+
+    @classmethod
+    def from_json(cls, json_obj):
+        """Deserialize."""
+        return _from_json(cls, json_obj, {'min_count': int, 'max_count': int, 'min_confidence': float})
+
+    def __call__(self, app_state):
+        _, scores = select_detections(app_state, self.class_name, self.min_confidence)
+        count = len(scores)
+        return count >= self.min_count and (self.max_count is None or count <= self.max_count)
+
+
+class HasObjectConfidence(CallableBase):
+    """Check if an object of a class is detected with a confidence within a range.
+    """
+
+    @record_kwargs
+    def __init__(self, class_name, min_confidence=0.0, max_confidence=1.0):
+        """Constructor.
+
+        Args:
+            class_name (string): Class name or id.
+            min_confidence (float, optional): Minimum confidence. Defaults to 0.
+            max_confidence (float, optional): Maximum confidence. Defaults to 1.
+        """
+        super().__init__()
+        self.class_name = class_name
+        self.min_confidence = min_confidence
+        self.max_confidence = max_confidence
+
+    @classmethod
+    def from_json(cls, json_obj):
+        """Deserialize."""
+        return _from_json(cls, json_obj, {'min_confidence': float, 'max_confidence': float})
+
+    def __call__(self, app_state):
+        _, scores = select_detections(app_state, self.class_name)
+        return bool(np.any((scores >= self.min_confidence) & (scores <= self.max_confidence)))
+
+
+class HasObjectArea(CallableBase):
+    """Check if objects of a class cover a fraction of the frame within a range.
+
+    The fraction is the area of an object's box divided by the area of the
+    frame (app_state['raw']). It tells e.g. whether an object is close enough
+    to the camera.
+    """
+
+    @record_kwargs
+    def __init__(self, class_name, min_area_ratio=0.0, max_area_ratio=1.0, min_count=1, min_confidence=0.0):
+        """Constructor.
+
+        Args:
+            class_name (string): Class name or id.
+            min_area_ratio (float, optional): Minimum fraction of the frame. Defaults to 0.
+            max_area_ratio (float, optional): Maximum fraction of the frame. Defaults to 1.
+            min_count (int, optional): Minimum number of objects in the range. Defaults to 1.
+            min_confidence (float, optional): Only objects detected with at
+                least this confidence are considered. Defaults to 0.
+        """
+        super().__init__()
+        self.class_name = class_name
+        self.min_area_ratio = min_area_ratio
+        self.max_area_ratio = max_area_ratio
+        self.min_count = min_count
+        self.min_confidence = min_confidence
+
+    @classmethod
+    def from_json(cls, json_obj):
+        """Deserialize."""
+        return _from_json(cls, json_obj, {'min_area_ratio': float, 'max_area_ratio': float,
+                                          'min_count': int, 'min_confidence': float})
+
+    def __call__(self, app_state):
+        boxes, _ = select_detections(app_state, self.class_name, self.min_confidence)
+        raw = app_state.get('raw')
+        if len(boxes) < self.min_count or raw is None:
+            return False
+        frame_area = float(raw.shape[0] * raw.shape[1])
+        ratios = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]) / frame_area
+        in_range = (ratios >= self.min_area_ratio) & (ratios <= self.max_area_ratio)
+        return int(np.count_nonzero(in_range)) >= self.min_count
+
+
+class HasObjectAspectRatio(CallableBase):
+    """Check if objects of a class have a box aspect ratio (width / height) within a range.
+
+    The aspect ratio tells e.g. whether an object is upright or lying down.
+    """
+
+    @record_kwargs
+    def __init__(self, class_name, min_aspect_ratio=0.0, max_aspect_ratio=None, min_count=1,
+                 min_confidence=0.0):
+        """Constructor.
+
+        Args:
+            class_name (string): Class name or id.
+            min_aspect_ratio (float, optional): Minimum width / height. Defaults to 0.
+            max_aspect_ratio (float, optional): Maximum width / height. Defaults to None (no maximum).
+            min_count (int, optional): Minimum number of objects in the range. Defaults to 1.
+            min_confidence (float, optional): Only objects detected with at
+                least this confidence are considered. Defaults to 0.
+        """
+        super().__init__()
+        self.class_name = class_name
+        self.min_aspect_ratio = min_aspect_ratio
+        self.max_aspect_ratio = max_aspect_ratio
+        self.min_count = min_count
+        self.min_confidence = min_confidence
+
+    @classmethod
+    def from_json(cls, json_obj):
+        """Deserialize."""
+        return _from_json(cls, json_obj, {'min_aspect_ratio': float, 'max_aspect_ratio': float,
+                                          'min_count': int, 'min_confidence': float})
+
+    def __call__(self, app_state):
+        boxes, _ = select_detections(app_state, self.class_name, self.min_confidence)
+        if len(boxes) < self.min_count:
+            return False
+        widths = (boxes[:, 2] - boxes[:, 0]).astype(np.float64)
+        heights = (boxes[:, 3] - boxes[:, 1]).astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios = widths / heights
+        in_range = ratios >= self.min_aspect_ratio
+        if self.max_aspect_ratio is not None:
+            in_range &= ratios <= self.max_aspect_ratio
+        return int(np.count_nonzero(in_range)) >= self.min_count
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Callable classes for Transition Predicates on spatial relations between detected objects.
+
+The predicates compare every box of one class with every box of another class
+at once by broadcasting, e.g. "a screw inside the bracket" or "the cap above
+the bottle". They are true when at least one pair of objects is in the
+relation. When both classes are the same, objects are not paired with
+themselves.
+"""
+import numpy as np
+
+from gabrieltool.statemachine.callable_zoo import record_kwargs
+from gabrieltool.statemachine.callable_zoo import CallableBase
+from gabrieltool.statemachine.callable_zoo.predicate_zoo.quantitative import _from_json, select_detections
+
+
+def box_areas(boxes):
+    """Areas of boxes of [x1, y1, x2, y2]."""
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+
+def pairwise_intersections(boxes_a, boxes_b):
+    """Intersection areas of every pair of boxes, as an array of [a_idx, b_idx]."""
+    top_left = np.maximum(boxes_a[:, np.newaxis, :2], boxes_b[np.newaxis, :, :2])
+    bottom_right = np.minimum(boxes_a[:, np.newaxis, 2:], boxes_b[np.newaxis, :, 2:])
+    sizes = np.clip(bottom_right - top_left, 0, None)
+    return sizes[..., 0] * sizes[..., 1]
+
+
+def pairwise_iou(boxes_a, boxes_b):
+    """Intersection over union of every pair of boxes, as an array of [a_idx, b_idx]."""
+    intersections = pairwise_intersections(boxes_a, boxes_b)
+    unions = box_areas(boxes_a)[:, np.newaxis] + box_areas(boxes_b)[np.newaxis, :] - intersections
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(unions > 0, intersections / unions, 0.0)
+
+
+def pairwise_containment(boxes_a, boxes_b):
+    """Fraction of each box of a that is inside each box of b, as an array of [a_idx, b_idx]."""
+    intersections = pairwise_intersections(boxes_a, boxes_b)
+    areas = box_areas(boxes_a)[:, np.newaxis]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(areas > 0, intersections / areas, 0.0)
+
+
+def _select_pair(app_state, class_a, class_b, min_confidence):
+    """Boxes of two classes as float arrays, or None if one has no detections."""
+    boxes_a, _ = select_detections(app_state, class_a, min_confidence)
+    boxes_b, _ = select_detections(app_state, class_b, min_confidence)
+    if len(boxes_a) == 0 or len(boxes_b) == 0:
+        return None
+    return boxes_a.astype(np.float64), boxes_b.astype(np.float64)
+
+
+def _any_pair(matches, same_class):
+    """Whether any pair matches. Objects are not paired with themselves when the classes are the same."""
+    if same_class:
+        np.fill_diagonal(matches, False)
+    return bool(matches.any())
+
+
+class HasObjectOverlap(CallableBase):
+    """Check if an object of a class overlaps an object of another class.
+
+    Objects overlap when the intersection over union (IoU) of their boxes is
+    at least min_iou.
+    """
+
+    @record_kwargs
+    def __init__(self, class_a, class_b, min_iou=0.1, min_confidence=0.0):
+        """Constructor.
+
+        Args:
+            class_a (string): Class name or id.
+            class_b (string): Class name or id of the other objects.
+            min_iou (float, optional): Minimum IoU of the boxes. Defaults to 0.1.
+            min_confidence (float, optional): Only objects detected with at
+                least this confidence are considered. Defaults to 0.
+        """
+        super().__init__()
+        self.class_a = class_a
+        self.class_b = class_b
+        self.min_iou = min_iou
+        self.min_confidence = min_confidence
+
+    @classmethod
+    def from_json(cls, json_obj):
+        """Deserialize."""
+        return _from_json(cls, json_obj, {'min_iou': float, 'min_confidence': float})
+
+    def __call__(self, app_state):
+        pair = _select_pair(app_state, self.class_a, self.class_b, self.min_confidence)
+        if pair is None:
+            return False
+        return _any_pair(pairwise_iou(*pair) >= self.min_iou, self.class_a == self.class_b)
+
+
+class HasObjectInside(CallableBase):
+    """Check if an object of a class is inside an object of another class.
+
+    An object is inside another when at least min_containment of its box is
+    inside the other's box.
+    """
+
+    @record_kwargs
+    def __init__(self, inner_class, outer_class, min_containment=0.9, min_confidence=0.0):
+        """Constructor.
+
+        Args:
+            inner_class (string): Class name or id of the inner objects.
+            outer_class (string): Class name or id of the outer objects.
+            min_containment (float, optional): Minimum fraction of the inner
+                box inside the outer box. Defaults to 0.9.
+            min_confidence (float, optional): Only objects detected with at
+                least this confidence are considered. Defaults to 0.
+        """
+        super().__init__()
+        self.inner_class = inner_class
+        self.outer_class = outer_class
+        self.min_containment = min_containment
+        self.min_confidence = min_confidence
+
+    @classmethod
+    def from_json(cls, json_obj):
+        """Deserialize."""
+        return _from_json(cls, json_obj, {'min_containment': float, 'min_confidence': float})
+
+    def __call__(self, app_state):
+        pair = _select_pair(app_state, self.inner_class, self.outer_class, self.min_confidence)
+        if pair is None:
+            return False
+        return _any_pair(pairwise_containment(*pair) >= self.min_containment,
+                         self.inner_class == self.outer_class)
+
+
+class HasObjectPosition(CallableBase):
+    """Check if an object of a class is left of, right of, above, or below an object of another class.
+
+    An object is e.g. above another when the center of its box is above the
+    top edge of the other's box. Image coordinates are used, so 'above' is
+    towards the top of the frame.
+    """
+
+    RELATIONS = ('left_of', 'right_of', 'above', 'below')
+
+    @record_kwargs
+    def __init__(self, class_a, class_b, relation, min_confidence=0.0):
+        """Constructor.
+
+        Args:
+            class_a (string): Class name or id.
+            class_b (string): Class name or id of the reference objects.
+            relation (string): One of RELATIONS. The relation of class_a to class_b.
+            min_confidence (float, optional): Only objects detected with at
+                least this confidence are considered. Defaults to 0.
+
+        Raises:
+            ValueError: when relation is not one of RELATIONS.
+        """
+        super().__init__()
+        if relation not in self.RELATIONS:
+            raise ValueError('Unsupported relation {}. Valid options are {}.'.format(relation, self.RELATIONS))
+        self.class_a = class_a
+        self.class_b = class_b
+        self.relation = relation
+        self.min_confidence = min_confidence
+
+    @classmethod
+    def from_json(cls, json_obj):
+        """Deserialize."""
+        return _from_json(cls, json_obj, {'min_confidence': float})
+
+    def __call__(self, app_state):
+        pair = _select_pair(app_state, self.class_a, self.class_b, self.min_confidence)
+        if pair is None:
+            return False
+        boxes_a, boxes_b = pair
+        # [a_idx, 1] centers against [1, b_idx] edges
+        centers_x = ((boxes_a[:, 0] + boxes_a[:, 2]) / 2)[:, np.newaxis]
+        centers_y = ((boxes_a[:, 1] + boxes_a[:, 3]) / 2)[:, np.newaxis]
+        if self.relation == 'left_of':
+            matches = centers_x < boxes_b[np.newaxis, :, 0]
+        elif self.relation == 'right_of':
+            matches = centers_x > boxes_b[np.newaxis, :, 2]
+        elif self.relation == 'above':
+            matches = centers_y < boxes_b[np.newaxis, :, 1]
+        else:
+            matches = centers_y > boxes_b[np.newaxis, :, 3]
+        return _any_pair(matches, self.class_a == self.class_b)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Callable classes for Transition Predicates over recent frames.
+
+A single noisy detection should not trigger a transition. These predicates
+debounce detections over a sliding window of frames or time, e.g. "a bolt in 4
+of the last 5 frames" or "no hand for 2 seconds".
+
+States call the observe method of their transition predicates with the
+app_state of every frame, before any predicate is evaluated, so that the
+window is updated even when an earlier predicate of a transition is false.
+Each observation updates counters in constant time, and no frames or
+detections are kept. Windows are kept per session and are reset when the
+state is entered (see start_timer).
+"""
+import abc
+import time
+
+from gabrieltool.statemachine.callable_zoo import record_kwargs
+from gabrieltool.statemachine.callable_zoo import CallableBase
+from gabrieltool.statemachine.callable_zoo.predicate_zoo.quantitative import _from_json, select_detections
+
+
+class _TemporalPredicate(CallableBase, metaclass=abc.ABCMeta):
+    """Base class of predicates that observe whether an object class is present in each frame."""
+
+    def __init__(self, class_name, min_confidence=0.0):
+        super().__init__()
+        self.class_name = class_name
+        self.min_confidence = min_confidence
+
+    def _is_present(self, app_state):
+        if self.min_confidence:
+            _, scores = select_detections(app_state, self.class_name, self.min_confidence)
+            return len(scores) > 0
+        detections = app_state.get(self.class_name)
+        return detections is not None and len(detections) > 0
+
+    def start_timer(self, start_time=None):
+        """Forget the frames observed in the active session. Called when the state is entered."""
+        self.session_state().clear()
+
+    @abc.abstractmethod
+    def observe(self, app_state):
+        """Record whether the object class is present in a frame.
+
+        Args:
+            app_state (dict): The app_state of the frame.
+        """
+
+
+class HasObjectInRecentFrames(_TemporalPredicate):
+    """Check if an object class is present in at least min_frames of the last num_frames frames.
+    """
+
+    @record_kwargs
+    def __init__(self, class_name, min_frames=3, num_frames=5, min_confidence=0.0):
+        """Constructor.
+
+        Args:
+            class_name (string): Class name or id.
+            min_frames (int, optional): Minimum number of frames with the
+                object. Defaults to 3.
+            num_frames (int, optional): Number of recent frames to consider. Defaults to 5.
+            min_confidence (float, optional): Only objects detected with at
+                least this confidence are considered. Defaults to 0.
+        """
+        super().__init__(class_name, min_confidence=min_confidence)
+        if not 0 < min_frames <= num_frames:
+            raise ValueError('min_frames must be in (0, num_frames]. Got {} and {}.'.format(min_frames, num_frames))
+        self.min_frames = min_frames
+        self.num_frames = num_frames
+
+    @classmethod
+    def from_json(cls, json_obj):
+        """Deserialize."""
+        return _from_json(cls, json_obj, {'min_frames': int, 'num_frames': int, 'min_confidence': float})
+
+    def observe(self, app_state):
+        state = self.session_state()
+        if 'window' not in state:
+            # ring buffer of presence in the last num_frames frames
+            state['window'] = bytearray(self.num_frames)
+            state['pos'] = 0
+            state['count'] = 0
+        present = 1 if self._is_present(app_state) else 0
+        window, pos = state['window'], state['pos']
+        state['count'] += present - window[pos]
+        window[pos] = present
+        state['pos'] = (pos + 1) % self.num_frames
+
+    def __call__(self, app_state):
+        return self.session_state().get('count', 0) >= self.min_frames
+
+
+class HasObjectForDuration(_TemporalPredicate):
+    """Check if an object class has been present in every frame for some time.
+    """
+
+    @record_kwargs
+    def __init__(self, class_name, duration=1.0, min_confidence=0.0):
+        """Constructor.
+
+        Args:
+            class_name (string): Class name or id.
+            duration (float, optional): Seconds the object must be present. Defaults to 1.
+            min_confidence (float, optional): Only objects detected with at
+                least this confidence are considered. Defaults to 0.
+        """
+        super().__init__(class_name, min_confidence=min_confidence)
+        self.duration = duration
+
+    @classmethod
+    def from_json(cls, json_obj):
+        """Deserialize."""
+        return _from_json(cls, json_obj, {'duration': float, 'min_confidence': float})
+
+    def _observed_state(self, app_state):
+        return self._is_present(app_state)
+
+    def observe(self, app_state):
+        state = self.session_state()
+        if self._observed_state(app_state):
+            # start of the current streak of frames in the observed state
+            if state.get('since') is None:
+                state['since'] = time.time()
+        else:
+            state['since'] = None
+
+    def __call__(self, app_state):
+        since = self.session_state().get('since')
+        return since is not None and time.time() - since >= self.duration
+
+
+class HasNoObjectForDuration(HasObjectForDuration):
+    """Check if an object class has been absent in every frame for some time.
+
+    The time starts at the first frame without the object after the state is
+    entered.
+    """
+
+    @record_kwargs
+    def __init__(self, class_name, duration=1.0, min_confidence=0.0):
+        """Constructor.
+
+        Args:
+            class_name (string): Class name or id.
+            duration (float, optional): Seconds the object must be absent. Defaults to 1.
+            min_confidence (float, optional): Objects detected with a lower
+                confidence count as absent. Defaults to 0.
+        """
+        super().__init__(class_name, duration=duration, min_confidence=min_confidence)
+
+    def _observed_state(self, app_state):
+        return not self._is_present(app_state)
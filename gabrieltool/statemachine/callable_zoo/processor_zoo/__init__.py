@@ -3,3 +3,5 @@
 from .base import DummyCallable, FasterRCNNOpenCVCallable  # noqa: F401
 from .containerized import FasterRCNNContainerCallable  # noqa: F401
 from .containerized import TFServingContainerCallable  # noqa: F401
+from .inprocess import ONNXRuntimeCallable, SavedModelCallable  # noqa: F401
+from .wrappers import CachedCallable, CascadeCallable, TrackingCallable  # noqa: F401
@@ -2,13 +2,17 @@
 """Basic callable classes for Processor.
 """
 import copy
+import logging
 
 import cv2
 import numpy as np
 from logzero import logger
 
+from gabrieltool.statemachine import logutils
 from gabrieltool.statemachine.callable_zoo import record_kwargs
 from gabrieltool.statemachine.callable_zoo import CallableBase
+from gabrieltool.statemachine.callable_zoo import Detections
+from gabrieltool.statemachine.callable_zoo import FrameContext
 
 
 def visualize_detections(img, results):
@@ -19,20 +23,18 @@ def visualize_detections(img, results):
 
     Arguments:
         img {OpenCV Image}
-        results {Dictionary} -- a dictionary of class_idx -> [[x1, y1, x2, y2, confidence, cls_idx],...]
+        results {Detections or Dictionary} -- a dictionary of class_idx -> [[x1, y1, x2, y2, confidence, cls_idx],...]
 
     Returns:
         OpenCV Image -- Image with detected objects annotated
     """
     img_detections = img.copy()
-    for _, dets in results.items():
-        for i in range(len(dets)):
-            cls_name = str(dets[i][-1])
-            bbox = dets[i][:4]
-            score = dets[i][-2]
-            text = "%s : %f" % (cls_name, score)
-            cv2.rectangle(img_detections, (int(bbox[0]), int(bbox[1])), (int(bbox[2]), int(bbox[3])), (0, 0, 255), 8)
-            cv2.putText(img_detections, text, (int(bbox[0]), int(bbox[1])), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+    detections = Detections.of(results)
+    boxes = detections.boxes.astype(np.int64).tolist()
+    for (x1, y1, x2, y2), score, class_id in zip(boxes, detections.scores.tolist(), detections.class_ids.tolist()):
+        text = "%s : %f" % (detections.label_of(class_id), score)
+        cv2.rectangle(img_detections, (x1, y1), (x2, y2), (0, 0, 255), 8)
+        cv2.putText(img_detections, text, (x1, y1), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
     return img_detections
 
 
@@ -48,12 +50,68 @@ class DummyCallable(CallableBase):
         return {'dummy_key': 'dummy_value'}
 
 
+# Names of OpenCV DNN backends and targets that can be used by callables.
+# Values are attribute names in cv2.dnn, as not every OpenCV build has all of them.
+DNN_BACKENDS = {
+    'default': 'DNN_BACKEND_DEFAULT',
+    'opencv': 'DNN_BACKEND_OPENCV',
+    'openvino': 'DNN_BACKEND_INFERENCE_ENGINE',
+}
+DNN_TARGETS = {
+    'cpu': 'DNN_TARGET_CPU',
+    'cpu_fp16': 'DNN_TARGET_CPU_FP16',
+    'opencl': 'DNN_TARGET_OPENCL',
+    'opencl_fp16': 'DNN_TARGET_OPENCL_FP16',
+}
+
+
+def _get_dnn_constant(options, name, fallback):
+    if name not in options:
+        raise ValueError('Unsupported option {}. Valid options are {}.'.format(name, sorted(options)))
+    value = getattr(cv2.dnn, options[name], None)
+    if value is None:
+        logger.warning('{} is not available in OpenCV {}. Using {} instead.'.format(
+            name, cv2.__version__, fallback))
+        value = getattr(cv2.dnn, options[fallback])
+    return value
+
+
+def configure_dnn(net, backend='default', target='cpu'):
+    """Set the preferable backend and target of an OpenCV DNN.
+
+    Backends and targets that are not available in the installed OpenCV fall
+    back to OpenCV's default backend on CPU.
+
+    Args:
+        net (cv2.dnn.Net): The DNN.
+        backend (string, optional): One of DNN_BACKENDS. 'openvino' requires an
+            OpenCV build with Intel's Inference Engine. Defaults to 'default'.
+        target (string, optional): One of DNN_TARGETS. The fp16 targets run
+            with half precision where supported. Defaults to 'cpu'.
+
+    Raises:
+        ValueError: when backend or target is not a known option.
+    """
+    backend_id = _get_dnn_constant(DNN_BACKENDS, backend, 'default')
+    target_id = _get_dnn_constant(DNN_TARGETS, target, 'cpu')
+    get_available_targets = getattr(cv2.dnn, 'getAvailableTargets', None)
+    if callable(get_available_targets) and target_id not in get_available_targets(backend_id):
+        logger.warning('Target {} is not available for backend {}. Using default backend on CPU instead.'.format(
+            target, backend))
+        backend_id, target_id = cv2.dnn.DNN_BACKEND_DEFAULT, cv2.dnn.DNN_TARGET_CPU
+    net.setPreferableBackend(backend_id)
+    net.setPreferableTarget(target_id)
+
+
 class FasterRCNNOpenCVCallable(CallableBase):
     """A callable class that executes a FasterRCNN object detection model using OpenCV.
     """
 
+    accepts_frame_context = True
+
     @record_kwargs
-    def __init__(self, proto_path, model_path, labels=None, conf_threshold=0.8):
+    def __init__(self, proto_path, model_path, labels=None, conf_threshold=0.8,
+                 backend='default', target='cpu'):
         """Constructor.
 
         Args:
@@ -61,6 +119,8 @@ class FasterRCNNOpenCVCallable(CallableBase):
             model_path (string): Path to the model weights file.
             labels (list of string, optional): List of labels. Defaults to None.
             conf_threshold (float, optional): Confidence threshold for a detection. Defaults to 0.8.
+            backend (string, optional): OpenCV DNN backend. See DNN_BACKENDS. Defaults to 'default'.
+            target (string, optional): OpenCV DNN target. See DNN_TARGETS. Defaults to 'cpu'.
         """
         # For default parameter settings,
         # see:
@@ -75,11 +135,15 @@ class FasterRCNNOpenCVCallable(CallableBase):
         self._nms_threshold = 0.3
         self._labels = labels
         self._net = cv2.dnn.readNetFromCaffe(proto_path, model_path)
+        configure_dnn(self._net, backend=backend, target=target)
+        self._output_names = self._getOutputsNames(self._net)
         self._conf_threshold = conf_threshold
         logger.debug(
             'Created a FasterRCNNOpenCVProcessor:\nDNN proto definition is at {}\n'
-            'model weight is at {}\nlabels are {}\nconf_threshold is {}'.format(
-                proto_path, model_path, self._labels, self._conf_threshold))
+            'model weight is at {}\nlabels are {}\nconf_threshold is {}\n'
+            'backend is {}, target is {}'.format(
+                proto_path, model_path, self._labels, self._conf_threshold,
+                backend, target))
 
     @classmethod
     def from_json(cls, json_obj):
@@ -97,20 +161,32 @@ class FasterRCNNOpenCVCallable(CallableBase):
         """
         try:
             kwargs = copy.copy(json_obj)
-            kwargs['labels'] = json_obj['labels']
-            kwargs['_conf_threshold'] = float(json_obj['conf_threshold'])
+            if json_obj.get('labels') in ('', 'None'):
+                kwargs['labels'] = None
+            if 'conf_threshold' in json_obj:
+                kwargs['conf_threshold'] = float(json_obj['conf_threshold'])
+            kwargs['backend'] = json_obj.get('backend') or 'default'
+            kwargs['target'] = json_obj.get('target') or 'cpu'
+            # OpenCV's number of threads is process-wide. It is an option of
+            # the runner (see BasicCognitiveEngineRunner) instead.
+            if kwargs.pop('num_threads', None) not in (None, '', 'None'):
+                logger.warning('Ignored num_threads of {}. Set opencv_num_threads of the runner '
+                               'instead.'.format(cls.__name__))
         except ValueError as e:
             raise ValueError(
                 'Failed to convert json object to {} instance. '
                 'The input json object is {}. ({})'.format(cls.__name__,
                                                            json_obj, e))
-        return cls(**json_obj)
+        return cls(**kwargs)
 
     def _getOutputsNames(self, net):
         layersNames = net.getLayerNames()
-        return [layersNames[i[0] - 1] for i in net.getUnconnectedOutLayers()]
+        # OpenCV < 4.5.4 returns a Nx1 array of layer ids, newer versions a flat one
+        return [layersNames[i - 1] for i in np.asarray(net.getUnconnectedOutLayers()).reshape(-1)]
 
     def __call__(self, image):
+        frame = FrameContext.of(image)
+        image = frame.image
         height, width = image.shape[:2]
 
         # resize image to correct size
@@ -120,52 +196,48 @@ class FasterRCNNOpenCVCallable(CallableBase):
         # Prevent the biggest axis from being more than MAX_SIZE
         if np.round(im_scale * im_size_max) > self._max_size:
             im_scale = float(self._max_size) / float(im_size_max)
-        im = cv2.resize(image, None, None, fx=im_scale, fy=im_scale,
-                        interpolation=cv2.INTER_LINEAR)
-        # create input data
-        blob = cv2.dnn.blobFromImage(im, 1, (width, height), self._pixel_means,
-                                     swapRB=False, crop=False)
+        im = frame.resized(fx=im_scale, fy=im_scale, interpolation=cv2.INTER_LINEAR)
+        # create input data. Models with the same preprocessing share the blob.
+        blob = frame.memoize(
+            ('caffe_blob', im_scale, tuple(self._pixel_means)),
+            lambda: cv2.dnn.blobFromImage(im, 1, (width, height), self._pixel_means,
+                                          swapRB=False, crop=False))
         imInfo = np.array([height, width, im_scale], dtype=np.float32)
         self._net.setInput(blob, 'data')
         self._net.setInput(imInfo, 'im_info')
 
         # infer
-        outs = self._net.forward(self._getOutputsNames(self._net))
-        t, _ = self._net.getPerfProfile()
-        logger.debug('Inference time: %.2f ms' % (t * 1000.0 / cv2.getTickFrequency()))
-
-        # postprocess
-        classIds = []
-        confidences = []
-        boxes = []
-        for out in outs:
-            for detection in out[0, 0]:
-                confidence = detection[2]
-                if confidence > self._conf_threshold:
-                    left = int(detection[3])
-                    top = int(detection[4])
-                    right = int(detection[5])
-                    bottom = int(detection[6])
-                    width = right - left + 1
-                    height = bottom - top + 1
-                    classIds.append(int(detection[1]) - 1)  # Skip background label
-                    confidences.append(float(confidence))
-                    boxes.append([left, top, width, height])
-
-        indices = cv2.dnn.NMSBoxes(boxes, confidences, self._conf_threshold, self._nms_threshold)
-        results = {}
-        for i in indices:
-            i = i[0]
-            box = boxes[i]
-            left = box[0]
-            top = box[1]
-            width = box[2]
-            height = box[3]
-            classId = int(classIds[i])
-            confidence = confidences[i]
-            if self._labels[classId] not in results:
-                results[self._labels[classId]] = []
-            results[self._labels[classId]].append([left, top, left+width, top+height, confidence, classId])
-
-        logger.debug('results: {}'.format(results))
+        outs = self._net.forward(self._output_names)
+        if logger.isEnabledFor(logging.DEBUG):
+            t, _ = self._net.getPerfProfile()
+            logger.debug('Inference time: %.2f ms', t * 1000.0 / cv2.getTickFrequency())
+
+        results = self._postprocess(outs)
+        logger.debug('results: %s', logutils.Truncated(results))
         return results
+
+    def _postprocess(self, outs):
+        """Threshold, NMS and group detections by label.
+
+        Each output has shape (1, 1, N, 7), in which a detection is [batch_id,
+        class_id, confidence, left, top, right, bottom].
+        """
+        detections = np.concatenate([out.reshape(-1, 7) for out in outs])
+        detections = detections[detections[:, 2] > self._conf_threshold]
+        if len(detections) == 0:
+            return Detections.empty()
+        # [left, top, right, bottom]
+        corners = detections[:, 3:7].astype(np.int32)
+        # [left, top, width, height]
+        boxes = np.concatenate([corners[:, :2], corners[:, 2:] - corners[:, :2] + 1], axis=1)
+        confidences = detections[:, 2]
+        class_ids = detections[:, 1].astype(np.int32) - 1  # Skip background label
+
+        indices = np.asarray(
+            cv2.dnn.NMSBoxes(boxes, confidences, self._conf_threshold, self._nms_threshold),
+            dtype=np.int64).reshape(-1)
+        # [left, top, left + width, top + height]
+        boxes = np.concatenate([boxes[indices, :2], boxes[indices, :2] + boxes[indices, 2:]], axis=1)
+        # entries end with the class id, and are keyed by its label
+        return Detections(boxes, confidences[indices], class_ids[indices], labels=self._labels,
+                          entry_class_ids=True)
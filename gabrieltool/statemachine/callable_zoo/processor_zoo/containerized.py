@@ -9,33 +9,62 @@ by this module.
 """
 import ast
 import copy
-import io
+import json
 import os
+import socket
+import threading
 import time
 
 import cv2
 import docker
+import numpy as np
 import requests
 from logzero import logger
 
+from gabrieltool.statemachine import logutils
 from gabrieltool.statemachine.callable_zoo import record_kwargs
 from gabrieltool.statemachine.callable_zoo import CallableBase
-from gabrieltool.statemachine.callable_zoo.processor_zoo import tfutils
+from gabrieltool.statemachine.callable_zoo import Detections
+from gabrieltool.statemachine.callable_zoo import FrameContext
+from gabrieltool.statemachine.callable_zoo.processor_zoo import shmutils
 
-docker_client = docker.from_env()
+_docker_client = None
+
+
+def get_docker_client():
+    """Docker client of the process, connected on first use."""
+    global _docker_client
+    if _docker_client is None:
+        _docker_client = docker.from_env()
+    return _docker_client
 
 
 class SingletonContainerManager():
-    """Helper class to start, get, and remove a container identified by a name."""
+    """Helper class to start, get, and remove a container identified by a name.
+
+    Managers of the same container name share a lock, so that callables
+    prepared concurrently start the container only once.
+    """
+
+    # container name -> lock
+    _LOCKS = {}
+    _LOCKS_LOCK = threading.Lock()
 
     def __init__(self, container_name):
         self._container_name = container_name
         self._container = None
+        with SingletonContainerManager._LOCKS_LOCK:
+            self._lock = SingletonContainerManager._LOCKS.setdefault(container_name, threading.RLock())
 
     @property
     def container_name(self):
         return self._container_name
 
+    @property
+    def lock(self):
+        """Lock held while the container is being started."""
+        return self._lock
+
     @property
     def container(self):
         if self._container is None:
@@ -52,7 +81,7 @@ class SingletonContainerManager():
         logger.info(
             'Checking if the container image is available locally... (image: {})'.format(image_url))
         try:
-            docker_client.images.get(image_url)
+            get_docker_client().images.get(image_url)
             logger.info(
                 'Found local image (image: {})!'.format(image_url))
         except docker.errors.ImageNotFound:
@@ -60,20 +89,33 @@ class SingletonContainerManager():
             logger.info('Downloading image: {}...'.format(image_url))
             repo = image_url.split(':')[0]
             tag = image_url.split(':')[-1]
-            docker_client.images.pull(repo, tag=tag)
+            get_docker_client().images.pull(repo, tag=tag)
             logger.info('Download finished!')
 
-    def start_container(self, image_url, command, **kwargs):
-        """Start a container
+    def start_container(self, image_url, command, ready_check=None, ready_timeout=120.0, **kwargs):
+        """Start a container and wait until it is ready to serve.
 
         Args:
             image_url (string): Container Image URL.
             command (string): Container command.
+            ready_check (function, optional): Called with the container to
+                probe whether it is ready, e.g. whether its server responds.
+                Defaults to None, which waits only until the container is running.
+            ready_timeout (float, optional): Seconds to wait for the container
+                to become ready. Defaults to 120.
             kwargs (dictionary): Extra arguments to pass to Docker client.
 
+        Raises:
+            RuntimeError: when the container fails to start, exits, or is not
+                ready within ready_timeout.
+
         Returns:
             Container: A container
         """
+        with self._lock:
+            return self._start_container(image_url, command, ready_check, ready_timeout, **kwargs)
+
+    def _start_container(self, image_url, command, ready_check, ready_timeout, **kwargs):
         image_url = self._add_image_tag_if_not_available(image_url)
         if self.container is None or self.container.status != 'running':
             self._make_image_available(image_url)
@@ -86,7 +128,7 @@ class SingletonContainerManager():
                     str(kwargs)
                 ))
             try:
-                container = docker_client.containers.run(
+                container = get_docker_client().containers.run(
                     image_url,
                     command=command,
                     name=self.container_name,
@@ -94,16 +136,64 @@ class SingletonContainerManager():
                     detach=True,
                     **kwargs
                 )
-                container.reload()
-                # sleep here to give some time for container to start
-                time.sleep(10)
-                self._container = container
             except Exception as e:
                 logger.error('Error starting container: {}'.format(e))
+                raise RuntimeError('Failed to start container {} (image: {}). ({})'.format(
+                    self.container_name, image_url, e))
+            self.wait_until_ready(container, ready_check=ready_check, timeout=ready_timeout)
+            self._container = container
         return self._container
 
+    def wait_until_ready(self, container, ready_check=None, timeout=120.0, initial_interval=0.1,
+                         max_interval=2.0):
+        """Poll a container with exponential backoff until it is ready.
+
+        Args:
+            container (Container): The container.
+            ready_check (function, optional): Called with the container (after
+                reload) to probe whether it is ready. Exceptions count as not
+                ready. Defaults to None, which checks only that it is running.
+            timeout (float, optional): Seconds to wait. Defaults to 120.
+            initial_interval (float, optional): Seconds between the first two
+                probes. Defaults to 0.1.
+            max_interval (float, optional): Maximum seconds between probes. Defaults to 2.
+
+        Raises:
+            RuntimeError: when the container exits or is not ready in time.
+        """
+        start_time = time.monotonic()
+        deadline = start_time + timeout
+        interval = initial_interval
+        while True:
+            container.reload()
+            if container.status in ('exited', 'dead', 'removing'):
+                raise RuntimeError('Container {} stopped before it was ready. Last logs:\n{}'.format(
+                    self.container_name, self._get_logs(container)))
+            if container.status == 'running':
+                try:
+                    ready = ready_check is None or ready_check(container)
+                except Exception as e:
+                    logger.debug('Container {} is not ready yet. ({})'.format(self.container_name, e))
+                    ready = False
+                if ready:
+                    logger.info('Container {} is ready after {:.1f} seconds.'.format(
+                        self.container_name, time.monotonic() - start_time))
+                    return
+            now = time.monotonic()
+            if now >= deadline:
+                raise RuntimeError('Container {} is not ready after {} seconds. Last logs:\n{}'.format(
+                    self.container_name, timeout, self._get_logs(container)))
+            time.sleep(min(interval, deadline - now))
+            interval = min(interval * 2, max_interval)
+
+    def _get_logs(self, container, tail=20):
+        try:
+            return container.logs(tail=tail).decode('utf-8', 'replace')
+        except Exception as e:
+            return '(logs are not available: {})'.format(e)
+
     def _get_container_obj(self):
-        containers = docker_client.containers.list(filters={'name': self.container_name})
+        containers = get_docker_client().containers.list(filters={'name': self.container_name})
         if len(containers) > 0:
             return containers[0]
         return None
@@ -115,6 +205,54 @@ class SingletonContainerManager():
             container.remove(force=True)
 
 
+def get_host_port(container, container_port):
+    """Host port that a container port is published to."""
+    return int(container.ports[container_port][0]['HostPort'])
+
+
+def is_port_open(host, port, timeout=1.0):
+    """Whether a TCP connection can be made to host:port."""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def get_shm_volumes():
+    """Docker volumes that share the frame rings of this process with a container."""
+    shm_dir = shmutils.get_shm_dir()
+    os.makedirs(shm_dir, exist_ok=True)
+    return {shm_dir: {'bind': shm_dir, 'mode': 'ro'}}
+
+
+def parse_bool(value):
+    """Parse a boolean from its JSON or string representation."""
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1', 'yes')
+    return bool(value)
+
+
+def decode_detections(text):
+    """Decode the detections returned by a TPOD v1 container.
+
+    The response is a list of (label, [x1, y1, x2, y2], confidence). It is
+    parsed as JSON when possible, which is much faster than evaluating it as a
+    Python literal. Responses with Python-only syntax (e.g. quoted with ' or
+    with tuples) fall back to ast.literal_eval.
+
+    Args:
+        text (string): Response body.
+
+    Returns:
+        list: The detections.
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        return ast.literal_eval(text)
+
+
 class FasterRCNNContainerCallable(CallableBase):
     """A callable class to execute containerized FasterRCNN model in Caffe.
 
@@ -123,14 +261,25 @@ class FasterRCNNContainerCallable(CallableBase):
     """
     # UNIQUE to each python process
     CONTAINER_NAME = 'GABRIELTOOL-FasterRCNNContainerCallable-{}'.format(os.getpid())
+    # replaceable for testing (see standins.LocalContainerManager)
+    CONTAINER_MANAGER_CLASS = SingletonContainerManager
+    accepts_frame_context = True
 
     @record_kwargs
-    def __init__(self, container_image_url, conf_threshold=0.5):
+    def __init__(self, container_image_url, conf_threshold=0.5, jpeg_quality=95, shared_memory=False):
         """Constructor.
 
         Args:
             container_image_url (string): URL to the container image.
             conf_threshold (float, optional): Cutoff threshold for detection. Defaults to 0.5.
+            jpeg_quality (int, optional): JPEG quality (0-100) of frames sent
+                to the container. Lower values are faster to encode and upload.
+                None sends the frame as received from the client without
+                re-encoding it, if it is available. Defaults to 95.
+            shared_memory (bool, optional): Pass frames to the container in
+                shared memory instead of uploading them (see shmutils). The
+                server in the container must support it, as
+                standins.DetectHTTPServer does. Defaults to False.
         """
         # For default parameter settings,
         # see:
@@ -138,14 +287,30 @@ class FasterRCNNContainerCallable(CallableBase):
         super(FasterRCNNContainerCallable, self).__init__()
         self.container_image_url = container_image_url
         self.conf_threshold = conf_threshold
-        self.container_manager = SingletonContainerManager(self.CONTAINER_NAME)
+        self.jpeg_quality = jpeg_quality
+        self.shared_memory = shared_memory
+        self.container_manager = self.CONTAINER_MANAGER_CLASS(self.CONTAINER_NAME)
+        # keep-alive connections to the container, created on first use
+        self._http_session = None
+        self._frame_writer = shmutils.SharedFrameWriter() if shared_memory else None
 
         # start container
         # port number inside the container that is open
         self.container_port = '8000/tcp'
         ports = {self.container_port: None}   # map container 8000 to a random host port
         command = '/bin/bash run_server.sh',
-        self.container_manager.start_container(self.container_image_url, command, ports=ports)
+        kwargs = {'volumes': get_shm_volumes()} if shared_memory else {}
+        self.container_manager.start_container(self.container_image_url, command,
+                                               ready_check=self._is_server_ready, ports=ports, **kwargs)
+
+    def _is_server_ready(self, container):
+        """The container is ready when its HTTP server answers."""
+        port = get_host_port(container, self.container_port)
+        if not is_port_open('localhost', port):
+            return False
+        # any HTTP response means that the server has loaded the model and is listening
+        response = requests.get('http://localhost:{}/'.format(port), timeout=1.0)
+        return response.status_code < 500
 
     @property
     def container_server_url(self):
@@ -154,6 +319,13 @@ class FasterRCNNContainerCallable(CallableBase):
                 self.container_manager.container.ports[self.container_port][0]['HostPort'])
         return None
 
+    @property
+    def http_session(self):
+        """HTTP session that reuses connections to the container across frames."""
+        if self._http_session is None:
+            self._http_session = requests.Session()
+        return self._http_session
+
     @classmethod
     def from_json(cls, json_obj):
         """Deserialize."""
@@ -161,6 +333,11 @@ class FasterRCNNContainerCallable(CallableBase):
             kwargs = copy.copy(json_obj)
             kwargs['container_image_url'] = json_obj['container_image_url']
             kwargs['conf_threshold'] = float(json_obj['conf_threshold'])
+            if json_obj.get('jpeg_quality') in (None, 'None'):
+                kwargs['jpeg_quality'] = None
+            else:
+                kwargs['jpeg_quality'] = int(json_obj['jpeg_quality'])
+            kwargs['shared_memory'] = parse_bool(json_obj.get('shared_memory', False))
         except ValueError as e:
             raise ValueError(
                 'Failed to convert json object to {} instance. '
@@ -169,34 +346,62 @@ class FasterRCNNContainerCallable(CallableBase):
         return cls(**kwargs)
 
     def __call__(self, image):
-        fp = io.BytesIO()
-        fp.write(cv2.imencode('.jpg', image)[1].tostring())
-        fp.seek(0, 0)
-
-        response = requests.post(self.container_server_url, data={
+        frame = FrameContext.of(image)
+        data = {
             'confidence': self.conf_threshold,
             'format': 'box'
-        }, files={
-            'picture': fp
-        })
-        detections = ast.literal_eval(response.text)
-        result = {}
-        for detection in detections:
-            logger.info(detection)
-            label = detection[0]
-            bbox = detection[1]
-            confidence = detection[2]
-            if label not in result:
-                result[label] = []
-            result[label].append(
-                [*bbox, confidence, label]
-            )
-        return result
+        }
+        if self.shared_memory:
+            # only the reference to the frame is sent
+            slot = self._frame_writer.write(frame.image)
+            try:
+                data['frame_ref'] = json.dumps(slot.ref)
+                response = self.http_session.post(self.container_server_url, data=data)
+            finally:
+                slot.release()
+        else:
+            if self.jpeg_quality is None and frame.payload is not None:
+                jpeg = frame.payload
+            else:
+                # the encoded buffer is given to the multipart encoder as is,
+                # without copying it to an intermediate file object
+                jpeg = frame.jpeg(95 if self.jpeg_quality is None else self.jpeg_quality).data
+            response = self.http_session.post(self.container_server_url, data=data, files={
+                'picture': ('frame.jpg', jpeg, 'image/jpeg')
+            })
+        detections = decode_detections(response.text)
+        logger.debug('detections: %s', logutils.Truncated(detections))
+        if not detections:
+            return Detections.empty()
+        # detections are (label, [x1, y1, x2, y2], confidence)
+        label_ids = {}
+        class_ids = [label_ids.setdefault(detection[0], len(label_ids)) for detection in detections]
+        return Detections([detection[1] for detection in detections],
+                          [detection[2] for detection in detections],
+                          class_ids, labels=list(label_ids))
 
     def clean(self):
+        if self._http_session is not None:
+            self._http_session.close()
+            self._http_session = None
+        if self._frame_writer is not None:
+            self._frame_writer.close()
         self.container_manager.clean()
 
 
+class _FirstResultFuture(object):
+    """Future of the result of the first image in a batch request."""
+
+    def __init__(self, batch_future):
+        self._batch_future = batch_future
+
+    def done(self):
+        return self._batch_future.done()
+
+    def result(self, timeout=None):
+        return self._batch_future.result(timeout)[0]
+
+
 class TFServingContainerCallable(CallableBase):
     """A callable class to execute frozen tensorflow models using TF serving container images.
 
@@ -209,10 +414,15 @@ class TFServingContainerCallable(CallableBase):
     CONTAINER_NAME = 'GABRIELTOOL-TFServingContainerCallable-{}'.format(os.getpid())
     # TF Serving image by default listens on 8500 for GRPC
     TFSERVING_GRPC_PORT = 8500
+    # replaceable for testing (see standins.LocalContainerManager)
+    CONTAINER_MANAGER_CLASS = SingletonContainerManager
     SERVED_DIRS = {}
+    # whether the container needs the frame rings of this process
+    SHARED_MEMORY = False
+    accepts_frame_context = True
 
     @record_kwargs
-    def __init__(self, model_name, serving_dir, conf_threshold=0.5):
+    def __init__(self, model_name, serving_dir, conf_threshold=0.5, timeout=10.0, shared_memory=False):
         """Constructor.
 
         Args:
@@ -221,13 +431,23 @@ class TFServingContainerCallable(CallableBase):
             serving_dir (string): Path to the TF saved_model. This should refers
                 to the 'saved_model' directory of the downloaded OpenTPOD model.
             conf_threshold (float, optional): Cutoff threshold for detection. Defaults to 0.5.
+            timeout (float, optional): Deadline of a request to TF serving in seconds. Defaults to 10.
+            shared_memory (bool, optional): Pass frames to the server in shared
+                memory instead of in the gRPC request (see shmutils). The
+                server must support it, as standins.TFServingServer does;
+                stock TF serving does not. Defaults to False.
         """
         super(TFServingContainerCallable, self).__init__()
         self.serving_dir = serving_dir
         self.model_name = model_name
         self.conf_threshold = conf_threshold
+        self.timeout = timeout
+        self.shared_memory = shared_memory
+        self._frame_writer = shmutils.SharedFrameWriter() if shared_memory else None
         TFServingContainerCallable.SERVED_DIRS[model_name] = os.path.abspath(serving_dir)
-        self.container_manager = SingletonContainerManager(TFServingContainerCallable.CONTAINER_NAME)
+        if shared_memory:
+            TFServingContainerCallable.SHARED_MEMORY = True
+        self.container_manager = self.CONTAINER_MANAGER_CLASS(TFServingContainerCallable.CONTAINER_NAME)
         self.container_internal_port = '{}/tcp'.format(TFServingContainerCallable.TFSERVING_GRPC_PORT)
         self.predictor = None
 
@@ -239,9 +459,15 @@ class TFServingContainerCallable(CallableBase):
         """
         # launch container
         self._start_container()
+        self._get_predictor()
 
     def _start_container(self):
         """Launch TF serving container image to serve all entries in SERVED_DIRS."""
+        # models.config is shared by all models
+        with self.container_manager.lock:
+            self._start_container_locked()
+
+    def _start_container_locked(self):
         ports = {self.container_internal_port: ('127.0.0.1', None)}
         container_image_url = 'tensorflow/serving:2.1.0'
         # geerate model config
@@ -261,9 +487,21 @@ class TFServingContainerCallable(CallableBase):
         }
         for model_name, model_dir in TFServingContainerCallable.SERVED_DIRS.items():
             volumes[model_dir] = {'bind': '/models/{}'.format(model_name), 'mode': 'ro'}
+        if TFServingContainerCallable.SHARED_MEMORY:
+            volumes.update(get_shm_volumes())
         logger.debug('volumes: {}'.format(volumes))
         cmd = '--model_config_file=/models/models.config'
-        self.container_manager.start_container(container_image_url, cmd, ports=ports, volumes=volumes)
+        self.container_manager.start_container(container_image_url, cmd, ready_check=self._are_models_ready,
+                                               ports=ports, volumes=volumes)
+
+    def _are_models_ready(self, container):
+        """The container is ready when TF serving reports all models as available."""
+        from gabrieltool.statemachine.callable_zoo.processor_zoo import tfutils
+        port = get_host_port(container, self.container_internal_port)
+        if not is_port_open('localhost', port):
+            return False
+        return all(tfutils.is_model_available('localhost', port, model_name)
+                   for model_name in TFServingContainerCallable.SERVED_DIRS)
 
     @property
     def container_external_port(self):
@@ -280,6 +518,9 @@ class TFServingContainerCallable(CallableBase):
             kwargs['model_name'] = json_obj['model_name']
             kwargs['serving_dir'] = json_obj['serving_dir']
             kwargs['conf_threshold'] = float(json_obj['conf_threshold'])
+            if 'timeout' in json_obj:
+                kwargs['timeout'] = float(json_obj['timeout'])
+            kwargs['shared_memory'] = parse_bool(json_obj.get('shared_memory', False))
         except ValueError as e:
             raise ValueError(
                 'Failed to convert json object to {} instance. '
@@ -287,11 +528,42 @@ class TFServingContainerCallable(CallableBase):
                                                            json_obj, e))
         return cls(**kwargs)
 
-    def __call__(self, image):
+    def _get_predictor(self):
         if not self.predictor:
-            self.predictor = tfutils.TFServingPredictor('localhost', self.container_external_port)
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        results = self.predictor.infer_one(self.model_name, rgb_image, conf_threshold=self.conf_threshold)
+            # imported here as tensorflow-serving-api loads tensorflow
+            from gabrieltool.statemachine.callable_zoo.processor_zoo import tfutils
+            self.predictor = tfutils.TFServingPredictor('localhost', self.container_external_port,
+                                                        timeout=self.timeout)
+        return self.predictor
+
+    def submit(self, image):
+        """Send an image to TF serving without waiting for the detections.
+
+        FSM states submit images to all processors that support it before
+        waiting for any result, so that requests of several models are in
+        flight at once.
+
+        Returns:
+            A future whose result() returns the same detections as __call__.
+        """
+        rgb_image = FrameContext.of(image).rgb
+        if self.shared_memory:
+            slot = self._frame_writer.write(rgb_image, timeout=self.timeout)
+            try:
+                future = self._get_predictor().infer_shared_future(
+                    self.model_name, [slot.ref], conf_threshold=self.conf_threshold)
+            except Exception:
+                slot.release()
+                raise
+            # the slot is reused once the server has answered
+            future.add_done_callback(lambda _: slot.release())
+        else:
+            future = self._get_predictor().infer_future(
+                self.model_name, rgb_image[np.newaxis], conf_threshold=self.conf_threshold)
+        return _FirstResultFuture(future)
+
+    def __call__(self, image):
+        results = self.submit(image).result()
 
         # # debug
         # debug_image = visualize_detections(image, results)
@@ -300,6 +572,8 @@ class TFServingContainerCallable(CallableBase):
         return results
 
     def clean(self):
+        if self._frame_writer is not None:
+            self._frame_writer.close()
         self.container_manager.clean()
 
 
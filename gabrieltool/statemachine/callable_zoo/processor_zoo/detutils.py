@@ -0,0 +1,69 @@
+"""Utilities for parsing outputs of object detection models.
+"""
+import numpy as np
+
+from gabrieltool.statemachine.callable_zoo import Detections
+
+
+def parse_tf_detection_batch(detection_boxes, detection_scores, detection_classes, image_shapes,
+                             conf_threshold=0.5):
+    """Parse a batch of detections in the format of TensorFlow Object Detection API models.
+
+    Thresholding and box conversion are done on the whole batch at once.
+
+    Args:
+        detection_boxes (numpy array): 3d array, [image_idx, bbx_idx, (ymin,xmin,ymax,xmax)].
+            Coordinates are normalized to [0, 1].
+        detection_scores (numpy array): 2d array of confidence, [image_idx, bbx_idx].
+        detection_classes (numpy array): 2d array of class ids, [image_idx, bbx_idx].
+        image_shapes (list of tuple): Shape of each image, (height, width, ...).
+        conf_threshold (float, optional): Cut-off threshold for detection. Defaults to 0.5.
+
+    Returns:
+        list of Detections: results of each image (see parse_tf_detections).
+    """
+    detection_scores = np.asarray(detection_scores)
+    image_indices, detection_indices = np.nonzero(detection_scores >= conf_threshold)
+    # pixels per normalized unit of (xmin, ymin, xmax, ymax) for each image
+    scales = np.array([[shape[1], shape[0], shape[1], shape[0]] for shape in image_shapes])
+    norm_boxes = np.asarray(detection_boxes)[image_indices, detection_indices][:, [1, 0, 3, 2]]
+    boxes = (norm_boxes * scales[image_indices]).astype(np.int64)
+    confidences = detection_scores[image_indices, detection_indices]
+    # labels are the class ids as strings. The batch shares a vocabulary of the detected classes.
+    class_ids, vocabulary_ids = np.unique(
+        np.asarray(detection_classes)[image_indices, detection_indices].astype(np.int64), return_inverse=True)
+    labels = [str(class_id) for class_id in class_ids.tolist()]
+
+    if len(image_shapes) == 1:
+        return [Detections(boxes, confidences, vocabulary_ids, labels=labels)]
+    batch_results = []
+    for image_idx in range(len(image_shapes)):
+        mask = image_indices == image_idx
+        batch_results.append(Detections(boxes[mask], confidences[mask], vocabulary_ids[mask], labels=labels))
+    return batch_results
+
+
+def parse_tf_detections(detection_boxes, detection_scores, detection_classes, image_shape,
+                        conf_threshold=0.5, image_idx=0):
+    """Parse detections in the format of TensorFlow Object Detection API models.
+
+    Args:
+        detection_boxes (numpy array): 3d array, [image_idx, bbx_idx, (ymin,xmin,ymax,xmax)].
+            Coordinates are normalized to [0, 1].
+        detection_scores (numpy array): 2d array of confidence, [image_idx, bbx_idx].
+        detection_classes (numpy array): 2d array of class ids, [image_idx, bbx_idx].
+        image_shape (tuple): Shape of the image, (height, width, ...).
+        conf_threshold (float, optional): Cut-off threshold for detection. Defaults to 0.5.
+        image_idx (int, optional): Index of the image in the batch. Defaults to 0.
+
+    Returns:
+        Detections: keys are class ids, values are list of [x1, y1, x2,
+        y2, confidence, label_idx]. e.g {'1': [[0, 0, 100, 100, 0.7, '1']]}
+    """
+    batch = slice(image_idx, image_idx + 1)
+    return parse_tf_detection_batch(
+        np.asarray(detection_boxes)[batch],
+        np.asarray(detection_scores)[batch],
+        np.asarray(detection_classes)[batch],
+        [image_shape],
+        conf_threshold=conf_threshold)[0]
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""Callable classes that run DNN models in the engine process.
+
+Unlike the containerized callables, models here are executed without Docker
+and without serializing frames to another process. The runtimes are optional
+dependencies that are imported when a callable is created.
+"""
+import copy
+import os
+import threading
+
+import cv2
+import numpy as np
+from logzero import logger
+
+from gabrieltool.statemachine.callable_zoo import record_kwargs
+from gabrieltool.statemachine.callable_zoo import CallableBase
+from gabrieltool.statemachine.callable_zoo import FrameContext
+from gabrieltool.statemachine.callable_zoo.processor_zoo import detutils
+
+
+class ONNXRuntimeCallable(CallableBase):
+    """A callable class to execute an object detector exported to ONNX using ONNX Runtime on CPU.
+
+    The model should follow the conventions of the TensorFlow Object Detection
+    API (e.g. a model converted by tf2onnx): it takes a batch of RGB images in
+    NHWC layout and outputs normalized detection boxes, scores, and classes.
+    The outputs are parsed the same way as TFServingContainerCallable's.
+
+    Requires the onnxruntime package.
+    """
+
+    accepts_frame_context = True
+
+    @record_kwargs
+    def __init__(self, model_path, conf_threshold=0.5, intra_op_num_threads=1, inter_op_num_threads=1,
+                 boxes_output='detection_boxes', scores_output='detection_scores',
+                 classes_output='detection_classes'):
+        """Constructor.
+
+        Args:
+            model_path (string): Path to the ONNX model file.
+            conf_threshold (float, optional): Cutoff threshold for detection. Defaults to 0.5.
+            intra_op_num_threads (int, optional): Number of threads used to
+                parallelize an operator. 0 lets ONNX Runtime decide. Defaults to 1.
+            inter_op_num_threads (int, optional): Number of threads used to run
+                operators in parallel. 0 lets ONNX Runtime decide. Defaults to 1.
+            boxes_output (string, optional): Name of the output with detection
+                boxes. Defaults to 'detection_boxes'.
+            scores_output (string, optional): Name of the output with detection
+                scores. Defaults to 'detection_scores'.
+            classes_output (string, optional): Name of the output with detection
+                classes. Defaults to 'detection_classes'.
+        """
+        super(ONNXRuntimeCallable, self).__init__()
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError('{} requires the onnxruntime package. ({})'.format(
+                self.__class__.__name__, e))
+        self.model_path = model_path
+        self.conf_threshold = conf_threshold
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = int(intra_op_num_threads)
+        options.inter_op_num_threads = int(inter_op_num_threads)
+        self._session = onnxruntime.InferenceSession(
+            model_path, sess_options=options, providers=['CPUExecutionProvider'])
+        model_input = self._session.get_inputs()[0]
+        self._input_name = model_input.name
+        self._input_dtype = np.uint8 if model_input.type == 'tensor(uint8)' else np.float32
+        # (height, width) if the model requires a fixed input size
+        input_size = model_input.shape[1:3]
+        self._input_size = tuple(input_size) if all(isinstance(dim, int) for dim in input_size) else None
+        self._output_names = [boxes_output, scores_output, classes_output]
+        logger.debug('Created an ONNXRuntimeCallable: model is at {}, input is {} {} {}'.format(
+            model_path, self._input_name, model_input.type, model_input.shape))
+
+    @property
+    def warmup_input_shape(self):
+        """Shape of images that the model takes without resizing, if it has a fixed input size."""
+        if self._input_size is not None:
+            return (self._input_size[0], self._input_size[1], 3)
+        return None
+
+    @classmethod
+    def from_json(cls, json_obj):
+        """Deserialize."""
+        try:
+            kwargs = copy.copy(json_obj)
+            kwargs['conf_threshold'] = float(json_obj.get('conf_threshold', 0.5))
+            kwargs['intra_op_num_threads'] = int(json_obj.get('intra_op_num_threads', 1))
+            kwargs['inter_op_num_threads'] = int(json_obj.get('inter_op_num_threads', 1))
+        except ValueError as e:
+            raise ValueError(
+                'Failed to convert json object to {} instance. '
+                'The input json object is {}. ({})'.format(cls.__name__,
+                                                           json_obj, e))
+        return cls(**kwargs)
+
+    def __call__(self, image):
+        frame = FrameContext.of(image)
+        image = frame.image
+        rgb_image = frame.rgb
+        if self._input_size is not None and rgb_image.shape[:2] != self._input_size:
+            # boxes are normalized, so they are scaled back with the original image shape
+            dsize = (self._input_size[1], self._input_size[0])
+            rgb_image = frame.memoize(('rgb_resized', dsize), lambda: cv2.resize(frame.rgb, dsize))
+        images = rgb_image[np.newaxis].astype(self._input_dtype, copy=False)
+        detection_boxes, detection_scores, detection_classes = self._session.run(
+            self._output_names, {self._input_name: images})
+        return detutils.parse_tf_detections(
+            detection_boxes,
+            detection_scores,
+            detection_classes.astype(np.int64),
+            image.shape,
+            conf_threshold=self.conf_threshold)
+
+
+class _SavedModel(object):
+    """A loaded TF SavedModel that runs the 'serving_default' signature.
+
+    Supports TensorFlow 1.x (graph mode) and 2.x (eager mode).
+    """
+
+    def __init__(self, export_dir):
+        import tensorflow as tf
+        self._tf = tf
+        if tf.executing_eagerly():
+            model = tf.saved_model.load(export_dir)
+            self._model = model
+            self._signature = model.signatures['serving_default']
+            self._input_name = list(self._signature.structured_input_signature[1].keys())[0]
+        else:
+            self._session = tf.compat.v1.Session(graph=tf.Graph())
+            meta_graph = tf.compat.v1.saved_model.loader.load(
+                self._session, [tf.compat.v1.saved_model.tag_constants.SERVING], export_dir)
+            signature = meta_graph.signature_def['serving_default']
+            self._input_name = list(signature.inputs.values())[0].name
+            self._fetches = {key: value.name for (key, value) in signature.outputs.items()}
+
+    def __call__(self, images):
+        """Run the model on a batch of images. Returns a dictionary of output name -> numpy array."""
+        if self._tf.executing_eagerly():
+            outputs = self._signature(**{self._input_name: self._tf.constant(images)})
+            return {key: value.numpy() for (key, value) in outputs.items()}
+        return self._session.run(self._fetches, feed_dict={self._input_name: images})
+
+
+class SavedModelCallable(CallableBase):
+    """A callable class to execute a TF SavedModel object detector in process.
+
+    This is a drop-in replacement of TFServingContainerCallable for
+    single-node deployments: it takes the same arguments and returns the same
+    detections, but loads the model into the engine process instead of
+    launching a TF serving container. Callables with the same serving_dir share
+    one loaded model.
+
+    Requires the tensorflow package.
+    """
+
+    accepts_frame_context = True
+
+    # abspath of serving_dir -> _SavedModel
+    LOADED_MODELS = {}
+    # abspath of serving_dir -> lock held while the model is loaded
+    _LOADING_LOCKS = {}
+    _LOADED_MODELS_LOCK = threading.Lock()
+
+    @record_kwargs
+    def __init__(self, model_name, serving_dir, conf_threshold=0.5):
+        """Constructor.
+
+        Args:
+            model_name (string): Arbitrary Name of the Model.
+            serving_dir (string): Path to the TF saved_model. This should refers
+                to the 'saved_model' directory of the downloaded OpenTPOD model,
+                which has numbered version sub-directories. The latest version
+                is loaded.
+            conf_threshold (float, optional): Cutoff threshold for detection. Defaults to 0.5.
+        """
+        super(SavedModelCallable, self).__init__()
+        self.model_name = model_name
+        self.serving_dir = serving_dir
+        self.conf_threshold = conf_threshold
+        self.model = None
+
+    def prepare(self):
+        """Load the model. Do not call this method directly unless debugging.
+
+        This function is called when an FSM runner starts.
+        """
+        self._load_model()
+
+    @classmethod
+    def _get_export_dir(cls, serving_dir):
+        """Return the latest version directory, as TF serving would serve."""
+        if os.path.exists(os.path.join(serving_dir, 'saved_model.pb')):
+            return serving_dir
+        versions = [entry for entry in os.listdir(serving_dir)
+                    if entry.isdigit() and os.path.isdir(os.path.join(serving_dir, entry))]
+        if not versions:
+            raise ValueError('No SavedModel is found in {}.'.format(serving_dir))
+        return os.path.join(serving_dir, max(versions, key=int))
+
+    def _load_model(self):
+        if self.model is None:
+            serving_dir = os.path.abspath(self.serving_dir)
+            with SavedModelCallable._LOADED_MODELS_LOCK:
+                loading_lock = SavedModelCallable._LOADING_LOCKS.setdefault(serving_dir, threading.Lock())
+            # different models are loaded concurrently
+            with loading_lock:
+                if serving_dir not in SavedModelCallable.LOADED_MODELS:
+                    export_dir = self._get_export_dir(serving_dir)
+                    logger.info('Loading SavedModel {} from {}...'.format(self.model_name, export_dir))
+                    SavedModelCallable.LOADED_MODELS[serving_dir] = _SavedModel(export_dir)
+            self.model = SavedModelCallable.LOADED_MODELS[serving_dir]
+        return self.model
+
+    @classmethod
+    def from_json(cls, json_obj):
+        """Deserialize."""
+        try:
+            kwargs = copy.copy(json_obj)
+            kwargs['model_name'] = json_obj['model_name']
+            kwargs['serving_dir'] = json_obj['serving_dir']
+            kwargs['conf_threshold'] = float(json_obj['conf_threshold'])
+        except ValueError as e:
+            raise ValueError(
+                'Failed to convert json object to {} instance. '
+                'The input json object is {}. ({})'.format(cls.__name__,
+                                                           json_obj, e))
+        return cls(**kwargs)
+
+    def __call__(self, image):
+        model = self._load_model()
+        frame = FrameContext.of(image)
+        image = frame.image
+        outputs = model(frame.rgb[np.newaxis])
+        return detutils.parse_tf_detections(
+            outputs['detection_boxes'],
+            outputs['detection_scores'],
+            outputs['detection_classes'].astype(np.int64),
+            image.shape,
+            conf_threshold=self.conf_threshold)
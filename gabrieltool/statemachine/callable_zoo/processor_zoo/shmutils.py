@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""Shared-memory transport of frames to model servers on the same host.
+
+Instead of encoding a frame and sending it through a socket, the client
+copies it into a slot of a ring of fixed-size slots in a memory-mapped file
+(under /dev/shm when available) and sends the server only a reference to the
+slot. The server maps the same file and reads the frame in place.
+
+A frame reference is a JSON-serializable dictionary:
+
+    {'path': '/dev/shm/gabrieltool-123/ring-0', 'offset': 0,
+     'shape': [1080, 1920, 3], 'dtype': 'uint8'}
+
+A slot is not reused until the client releases it, i.e. until the server has
+answered the request that references it.
+"""
+import collections
+import itertools
+import json
+import mmap
+import os
+import tempfile
+import threading
+
+import numpy as np
+from logzero import logger
+
+_ring_ids = itertools.count()
+
+
+def get_shm_dir():
+    """Directory of the frame rings of this process.
+
+    Model servers in containers need this directory mounted at the same path.
+    """
+    root = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(root, 'gabrieltool-{}'.format(os.getpid()))
+
+
+class FrameSlot(object):
+    """A slot of a SharedFrameRing holding a frame."""
+
+    def __init__(self, ring, index, ref):
+        super(FrameSlot, self).__init__()
+        self._ring = ring
+        self._index = index
+        self._released = False
+        self.ref = ref
+
+    def release(self):
+        """Let the ring reuse the slot. Releasing a slot more than once has no effect."""
+        if not self._released:
+            self._released = True
+            self._ring._release(self._index)
+
+
+class SharedFrameRing(object):
+    """A ring of fixed-size frame slots in a memory-mapped file."""
+
+    def __init__(self, slot_size, num_slots=4, directory=None):
+        """Constructor.
+
+        Args:
+            slot_size (int): Size of a slot in bytes.
+            num_slots (int, optional): Number of slots, i.e. the number of
+                frames that can be in flight at once. Defaults to 4.
+            directory (string, optional): Directory of the ring file. Defaults to get_shm_dir().
+        """
+        super(SharedFrameRing, self).__init__()
+        if slot_size <= 0 or num_slots <= 0:
+            raise ValueError('slot_size and num_slots must be positive. Got {} and {}.'.format(
+                slot_size, num_slots))
+        # align slots to pages
+        self.slot_size = -(-int(slot_size) // mmap.PAGESIZE) * mmap.PAGESIZE
+        self.num_slots = int(num_slots)
+        directory = directory or get_shm_dir()
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, 'ring-{}'.format(next(_ring_ids)))
+        with open(self.path, 'w+b') as f:
+            f.truncate(self.slot_size * self.num_slots)
+            self._mmap = mmap.mmap(f.fileno(), self.slot_size * self.num_slots)
+        self._buffer = np.frombuffer(self._mmap, dtype=np.uint8)
+        self._cond = threading.Condition()
+        self._free = collections.deque(range(self.num_slots))
+        self._closing = False
+
+    def fits(self, array):
+        return array.nbytes <= self.slot_size
+
+    def write(self, array, timeout=None):
+        """Copy an array into a free slot.
+
+        Args:
+            array (numpy array): The frame.
+            timeout (float, optional): Seconds to wait for a free slot. Defaults to None (forever).
+
+        Raises:
+            ValueError: when the array is larger than a slot.
+            TimeoutError: when no slot is released in time.
+
+        Returns:
+            FrameSlot: The slot. Release it when the server has read the frame.
+        """
+        if not self.fits(array):
+            raise ValueError('Array of {} bytes does not fit in slots of {} bytes.'.format(
+                array.nbytes, self.slot_size))
+        with self._cond:
+            if self._closing:
+                raise ValueError('Ring {} is closed.'.format(self.path))
+            if not self._cond.wait_for(lambda: self._free, timeout):
+                raise TimeoutError('No free slot in ring {} after {} seconds.'.format(self.path, timeout))
+            index = self._free.popleft()
+        offset = index * self.slot_size
+        slot = self._buffer[offset:offset + array.nbytes].view(array.dtype).reshape(array.shape)
+        np.copyto(slot, array)
+        ref = {'path': self.path, 'offset': offset, 'shape': list(array.shape), 'dtype': array.dtype.str}
+        return FrameSlot(self, index, ref)
+
+    def _release(self, index):
+        with self._cond:
+            self._free.append(index)
+            self._cond.notify()
+            if self._closing and len(self._free) == self.num_slots:
+                self._unlink()
+
+    def close(self):
+        """Remove the ring file once all slots are released."""
+        with self._cond:
+            self._closing = True
+            if len(self._free) == self.num_slots:
+                self._unlink()
+
+    def _unlink(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class SharedFrameWriter(object):
+    """Writes frames of any size to a SharedFrameRing.
+
+    The ring is created for the first frame and replaced by a larger one when
+    a frame does not fit. Replaced rings are removed when their slots are released.
+    """
+
+    def __init__(self, num_slots=4, directory=None):
+        super(SharedFrameWriter, self).__init__()
+        self.num_slots = num_slots
+        self.directory = directory
+        self._ring = None
+        self._lock = threading.Lock()
+
+    def write(self, array, timeout=None):
+        """Copy an array into a free slot. See SharedFrameRing.write."""
+        array = np.ascontiguousarray(array)
+        with self._lock:
+            if self._ring is None or not self._ring.fits(array):
+                if self._ring is not None:
+                    self._ring.close()
+                self._ring = SharedFrameRing(array.nbytes, num_slots=self.num_slots, directory=self.directory)
+                logger.debug('Created frame ring {} with slots of {} bytes.'.format(
+                    self._ring.path, self._ring.slot_size))
+            ring = self._ring
+        return ring.write(array, timeout=timeout)
+
+    def close(self):
+        with self._lock:
+            if self._ring is not None:
+                self._ring.close()
+                self._ring = None
+
+
+# path -> mmap of the ring files read by this process
+_MAPS = collections.OrderedDict()
+_MAPS_LOCK = threading.Lock()
+_MAX_MAPS = 16
+
+
+def _get_map(path):
+    with _MAPS_LOCK:
+        if path in _MAPS:
+            _MAPS.move_to_end(path)
+            return _MAPS[path]
+        with open(path, 'rb') as f:
+            _MAPS[path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(_MAPS) > _MAX_MAPS:
+            # mappings of evicted rings stay valid for arrays still referencing them
+            _MAPS.popitem(last=False)
+        return _MAPS[path]
+
+
+def read_frame(ref):
+    """Read a frame written by a SharedFrameRing, as used by model servers.
+
+    Args:
+        ref (dictionary or string): The frame reference, or its JSON.
+
+    Returns:
+        numpy array: A read-only view of the frame in shared memory. It is
+        valid until the client releases the slot, i.e. until the request is answered.
+    """
+    if isinstance(ref, (str, bytes)):
+        ref = json.loads(ref)
+    dtype = np.dtype(ref['dtype'])
+    shape = tuple(ref['shape'])
+    count = int(np.prod(shape))
+    return np.frombuffer(_get_map(ref['path']), dtype=dtype, count=count, offset=ref['offset']).reshape(shape)
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""Local stand-ins of the model servers used by containerized callables.
+
+The stand-ins speak the same protocols as the real containers but return
+scripted detections after a configurable latency, so the client side of
+FasterRCNNContainerCallable and TFServingContainerCallable can be tested and
+benchmarked without Docker, network access, or models.
+
+    * DetectHTTPServer: the HTTP /detect server of TPOD v1 containers.
+    * TFServingServer: TF serving's gRPC PredictionService and ModelService.
+    * LocalContainerManager: a drop-in replacement of SingletonContainerManager
+      that launches the stand-ins as local processes.
+
+To use the stand-ins instead of containers, replace the container manager of
+the callables before creating them:
+
+    containerized.FasterRCNNContainerCallable.CONTAINER_MANAGER_CLASS = standins.LocalContainerManager
+    containerized.TFServingContainerCallable.CONTAINER_MANAGER_CLASS = standins.LocalContainerManager
+
+A stand-in can also be run directly, e.g.
+
+    $ python -m gabrieltool.statemachine.callable_zoo.processor_zoo.standins detect --port 8000 --latency 0.05
+"""
+import email.parser
+import email.policy
+import http.server
+import itertools
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent import futures
+
+import cv2
+import grpc
+import numpy as np
+from logzero import logger
+from tensorflow_serving.apis import (get_model_status_pb2, model_service_pb2_grpc, predict_pb2,
+                                     prediction_service_pb2_grpc)
+
+import gabrieltool
+from gabrieltool.statemachine.callable_zoo.processor_zoo import shmutils, tfutils
+from gabrieltool.statemachine.callable_zoo.processor_zoo.containerized import SingletonContainerManager
+
+MODULE_NAME = 'gabrieltool.statemachine.callable_zoo.processor_zoo.standins'
+
+# One person-like detection on every image.
+# Boxes are [x1, y1, x2, y2] normalized to [0, 1].
+DEFAULT_SCRIPT = [[{'label': '1', 'box': [0.1, 0.2, 0.5, 0.6], 'confidence': 0.9}]]
+
+
+class DetectionScript(object):
+    """Detections returned by a stand-in server, request after request.
+
+    Args:
+        script (list, optional): Detections of consecutive images, cycled
+            through. Each entry is a list of detections, which are dictionaries
+            with 'label', 'box' ([x1, y1, x2, y2] normalized to [0, 1]), and
+            'confidence'. For TF serving stand-ins, labels are class ids.
+            Defaults to DEFAULT_SCRIPT.
+    """
+
+    def __init__(self, script=None):
+        super(DetectionScript, self).__init__()
+        self._script = script or DEFAULT_SCRIPT
+        self._cycle = itertools.cycle(self._script)
+        self._lock = threading.Lock()
+
+    def next(self):
+        """Detections of the next image."""
+        with self._lock:
+            return next(self._cycle)
+
+
+def _parse_form(content_type, body):
+    """Fields of a multipart/form-data or urlencoded body, as name -> bytes. The first value of a name is kept."""
+    if content_type.startswith('application/x-www-form-urlencoded'):
+        fields = {}
+        for name, value in urllib.parse.parse_qsl(body.decode('latin-1'), encoding='latin-1'):
+            fields.setdefault(name, value.encode('latin-1'))
+        return fields
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+    fields = {}
+    if message.is_multipart():
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            if name is not None and name not in fields:
+                fields[name] = part.get_payload(decode=True)
+    return fields
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class _DetectHandler(http.server.BaseHTTPRequestHandler):
+    # keep connections alive as the real server does
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately; don't delay the body until the headers are acked
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._reply(200, b'ok', 'text/plain')
+
+    def do_POST(self):
+        if self.path != '/detect':
+            self._reply(404, b'not found', 'text/plain')
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        form = _parse_form(self.headers.get('Content-Type', ''), body)
+        if 'frame_ref' in form:
+            image = shmutils.read_frame(form['frame_ref'])
+        else:
+            image = cv2.imdecode(np.frombuffer(form['picture'], dtype=np.uint8), cv2.IMREAD_COLOR)
+        conf_threshold = float(form.get('confidence', 0))
+        height, width = image.shape[:2]
+        time.sleep(self.server.latency)
+        detections = [
+            [det['label'],
+             [int(det['box'][0] * width), int(det['box'][1] * height),
+              int(det['box'][2] * width), int(det['box'][3] * height)],
+             det['confidence']]
+            for det in self.server.script.next() if det['confidence'] >= conf_threshold]
+        self._reply(200, json.dumps(detections).encode('utf-8'), 'application/json')
+
+    def _reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+
+class DetectHTTPServer(object):
+    """A stand-in of the HTTP server in TPOD v1 containers (see FasterRCNNContainerCallable).
+
+    POST /detect takes a multipart form with a JPEG 'picture' and a
+    'confidence' threshold, and returns a JSON list of [label, [x1, y1, x2,
+    y2], confidence]. Instead of a 'picture', the form can have a 'frame_ref'
+    to a frame in shared memory (see shmutils). GET on any path answers 200
+    for readiness checks.
+    """
+
+    def __init__(self, port=0, host='127.0.0.1', script=None, latency=0.0):
+        """Constructor.
+
+        Args:
+            port (int, optional): Port to listen on. Defaults to 0 (any free port).
+            host (string, optional): Address to listen on. Defaults to '127.0.0.1'.
+            script (list, optional): Detections to return. See DetectionScript.
+            latency (float, optional): Seconds to wait before replying, as if
+                running a model. Defaults to 0.
+        """
+        super(DetectHTTPServer, self).__init__()
+        self._server = _ThreadingHTTPServer((host, port), _DetectHandler)
+        self._server.script = DetectionScript(script)
+        self._server.latency = latency
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        """Serve on a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name='DetectHTTPServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class TFServingServer(object):
+    """A stand-in of TF serving's gRPC server (see TFServingContainerCallable).
+
+    Predict returns the outputs of a TensorFlow Object Detection API model for
+    every image of the request's 'inputs' batch, or of its 'frame_refs' to
+    images in shared memory (see shmutils). GetModelStatus reports any model
+    as available.
+    """
+
+    def __init__(self, port=0, host='127.0.0.1', script=None, latency=0.0, max_workers=4):
+        """Constructor.
+
+        Args:
+            port (int, optional): Port to listen on. Defaults to 0 (any free port).
+            host (string, optional): Address to listen on. Defaults to '127.0.0.1'.
+            script (list, optional): Detections to return. See DetectionScript.
+            latency (float, optional): Seconds to wait before replying, as if
+                running a model. Defaults to 0.
+            max_workers (int, optional): Number of requests served at once. Defaults to 4.
+        """
+        super(TFServingServer, self).__init__()
+        options = [
+            ('grpc.max_send_message_length', 500 * 1024 * 1024),
+            ('grpc.max_receive_message_length', 500 * 1024 * 1024),
+        ]
+        self._server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers), options=options)
+        prediction_service_pb2_grpc.add_PredictionServiceServicer_to_server(
+            _PredictionServicer(DetectionScript(script), latency), self._server)
+        model_service_pb2_grpc.add_ModelServiceServicer_to_server(_ModelServicer(), self._server)
+        self._port = self._server.add_insecure_port('{}:{}'.format(host, port))
+        self._stopped = threading.Event()
+
+    @property
+    def port(self):
+        return self._port
+
+    def serve_forever(self):
+        self.start()
+        self._stopped.wait()
+
+    def start(self):
+        """Serve on background threads."""
+        self._server.start()
+        return self
+
+    def stop(self):
+        self._server.stop(None)
+        self._stopped.set()
+
+
+class _PredictionServicer(prediction_service_pb2_grpc.PredictionServiceServicer):
+
+    def __init__(self, script, latency):
+        super(_PredictionServicer, self).__init__()
+        self._script = script
+        self._latency = latency
+
+    def Predict(self, request, context):
+        if 'frame_refs' in request.inputs:
+            images = [shmutils.read_frame(ref) for ref in tfutils.make_ndarray(request.inputs['frame_refs'])]
+        else:
+            images = tfutils.make_ndarray(request.inputs['inputs'])
+        time.sleep(self._latency)
+        batch = [self._script.next() for _ in range(len(images))]
+        # detections are padded to the same number as real models do
+        max_detections = max(1, max(len(detections) for detections in batch))
+        boxes = np.zeros((len(batch), max_detections, 4), dtype=np.float32)
+        scores = np.zeros((len(batch), max_detections), dtype=np.float32)
+        classes = np.zeros((len(batch), max_detections), dtype=np.float32)
+        for image_idx, detections in enumerate(batch):
+            for det_idx, det in enumerate(detections):
+                x1, y1, x2, y2 = det['box']
+                boxes[image_idx, det_idx] = [y1, x1, y2, x2]
+                scores[image_idx, det_idx] = det['confidence']
+                classes[image_idx, det_idx] = float(det['label'])
+        response = predict_pb2.PredictResponse()
+        response.model_spec.name = request.model_spec.name
+        tfutils.make_tensor_proto(boxes, response.outputs['detection_boxes'])
+        tfutils.make_tensor_proto(scores, response.outputs['detection_scores'])
+        tfutils.make_tensor_proto(classes, response.outputs['detection_classes'])
+        tfutils.make_tensor_proto(np.array([len(detections) for detections in batch], dtype=np.float32),
+                                  response.outputs['num_detections'])
+        return response
+
+
+class _ModelServicer(model_service_pb2_grpc.ModelServiceServicer):
+
+    def GetModelStatus(self, request, context):
+        response = get_model_status_pb2.GetModelStatusResponse()
+        version_status = response.model_version_status.add()
+        version_status.version = 1
+        version_status.state = get_model_status_pb2.ModelVersionStatus.AVAILABLE
+        return response
+
+
+def _get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class _LocalContainer(object):
+    """A stand-in server process with the parts of docker's Container API used by gabrieltool."""
+
+    def __init__(self, name, args, ports):
+        super(_LocalContainer, self).__init__()
+        self.name = name
+        # container port -> host port, in the format of docker's Container.ports
+        self.ports = {container_port: [{'HostIp': '127.0.0.1', 'HostPort': str(host_port)}]
+                      for (container_port, host_port) in ports.items()}
+        self._log_file = tempfile.TemporaryFile()
+        env = dict(os.environ)
+        # the stand-in imports gabrieltool from where this process does
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(gabrieltool.__file__)))
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_root, env.get('PYTHONPATH')]))
+        self._process = subprocess.Popen(args, stdout=self._log_file, stderr=subprocess.STDOUT, env=env)
+
+    @property
+    def status(self):
+        return 'running' if self._process.poll() is None else 'exited'
+
+    def reload(self):
+        pass
+
+    def logs(self, tail='all'):
+        self._log_file.seek(0)
+        lines = self._log_file.read().splitlines(True)
+        if tail != 'all':
+            lines = lines[-tail:]
+        return b''.join(lines)
+
+    def remove(self, force=False):
+        if self._process.poll() is None:
+            self._process.terminate()
+            self._process.wait()
+        self._log_file.close()
+
+
+class LocalContainerManager(SingletonContainerManager):
+    """A container manager that launches stand-in servers as local processes instead of Docker containers.
+
+    Images of tensorflow/serving run a TFServingServer. Other images run a
+    DetectHTTPServer. Container ports are published to free ports on
+    localhost. Set the class attributes script and latency to configure the
+    stand-ins.
+    """
+
+    # Detections returned by the stand-ins. See DetectionScript.
+    script = None
+    # Seconds the stand-ins wait before replying.
+    latency = 0.0
+    # container name -> _LocalContainer
+    CONTAINERS = {}
+
+    def _start_container(self, image_url, command, ready_check, ready_timeout, **kwargs):
+        if self.container is None or self.container.status != 'running':
+            kind = 'tfserving' if image_url.startswith('tensorflow/serving') else 'detect'
+            ports = {container_port: _get_free_port() for container_port in kwargs.get('ports', {})}
+            if len(ports) != 1:
+                raise ValueError('Stand-in servers listen on one port. Got ports {}.'.format(ports))
+            args = [sys.executable, '-m', MODULE_NAME, kind,
+                    '--port', str(list(ports.values())[0]), '--latency', str(self.latency)]
+            if self.script is not None:
+                args += ['--script', json.dumps(self.script)]
+            logger.info('launching stand-in {} server (name: {}, image: {}, ports: {})'.format(
+                kind, self.container_name, image_url, ports))
+            container = _LocalContainer(self.container_name, args, ports)
+            LocalContainerManager.CONTAINERS[self.container_name] = container
+            self.wait_until_ready(container, ready_check=ready_check, timeout=ready_timeout)
+            self._container = container
+        return self._container
+
+    def _get_container_obj(self):
+        return LocalContainerManager.CONTAINERS.get(self.container_name)
+
+    def clean(self):
+        """Stop the stand-in server if it exists."""
+        container = LocalContainerManager.CONTAINERS.pop(self.container_name, None)
+        if container:
+            container.remove(force=True)
+        self._container = None
+
+
+def serve(kind, port, host='127.0.0.1', script=None, latency=0.0):
+    """Run a stand-in server until it is killed.
+
+    Args:
+        kind (string): 'detect' for DetectHTTPServer or 'tfserving' for TFServingServer.
+        port (int): Port to listen on.
+        host (string, optional): Address to listen on. Defaults to '127.0.0.1'.
+        script (string or list, optional): Detections to return, as JSON or a
+            list. See DetectionScript.
+        latency (float, optional): Seconds to wait before replying. Defaults to 0.
+    """
+    servers = {'detect': DetectHTTPServer, 'tfserving': TFServingServer}
+    if kind not in servers:
+        raise ValueError('Unsupported stand-in {}. Valid options are {}.'.format(kind, sorted(servers)))
+    if isinstance(script, str):
+        script = json.loads(script)
+    server = servers[kind](port=int(port), host=host, script=script, latency=float(latency))
+    logger.info('Stand-in {} server is listening on {}:{}'.format(kind, host, server.port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run a stand-in model server.')
+    parser.add_argument('kind', choices=['detect', 'tfserving'])
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--script', help='Detections to return as JSON. See DetectionScript.')
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+    serve(args.kind, args.port, host=args.host, script=args.script, latency=args.latency)
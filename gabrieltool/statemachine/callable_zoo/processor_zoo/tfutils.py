@@ -1,87 +1,292 @@
 """Utilities for using Tensorflow models.
+
+Tensors are converted between numpy arrays and TensorProto messages without
+using the tensorflow python API.
 """
+import json
+import threading
+
 import numpy as np
-import tensorflow as tf
 import grpc
-from tensorflow_serving.apis import predict_pb2, prediction_service_pb2_grpc
+from tensorflow.core.framework import types_pb2
+from tensorflow_serving.apis import (get_model_status_pb2, model_service_pb2_grpc, predict_pb2,
+                                     prediction_service_pb2_grpc)
+
+from gabrieltool.statemachine.callable_zoo.processor_zoo import detutils
+
+# numpy dtype -> (TensorProto dtype, name of the TensorProto field for typed values)
+_NUMPY_TO_TF_DTYPES = {
+    np.dtype(np.float16): (types_pb2.DT_HALF, 'half_val'),
+    np.dtype(np.float32): (types_pb2.DT_FLOAT, 'float_val'),
+    np.dtype(np.float64): (types_pb2.DT_DOUBLE, 'double_val'),
+    np.dtype(np.int8): (types_pb2.DT_INT8, 'int_val'),
+    np.dtype(np.int16): (types_pb2.DT_INT16, 'int_val'),
+    np.dtype(np.int32): (types_pb2.DT_INT32, 'int_val'),
+    np.dtype(np.int64): (types_pb2.DT_INT64, 'int64_val'),
+    np.dtype(np.uint8): (types_pb2.DT_UINT8, 'int_val'),
+    np.dtype(np.uint16): (types_pb2.DT_UINT16, 'int_val'),
+    np.dtype(np.bool_): (types_pb2.DT_BOOL, 'bool_val'),
+}
+_TF_TO_NUMPY_DTYPES = {tf_dtype: (np_dtype, field)
+                       for (np_dtype, (tf_dtype, field)) in _NUMPY_TO_TF_DTYPES.items()}
+
+
+def make_tensor_proto(array, tensor_proto):
+    """Fill a TensorProto with a numpy array.
+
+    The array data is copied once into the tensor_content bytes. The
+    TensorProto is filled in place (e.g. an entry of PredictRequest.inputs) to
+    avoid copying it again.
+
+    Arrays of bytes or strings are filled as DT_STRING tensors.
+
+    Args:
+        array (numpy array): Array of a numeric dtype, or of bytes or strings.
+        tensor_proto (TensorProto): Message to fill.
+
+    Returns:
+        TensorProto: tensor_proto.
+    """
+    if array.dtype.kind in ('S', 'U', 'O'):
+        tensor_proto.dtype = types_pb2.DT_STRING
+        for size in array.shape:
+            tensor_proto.tensor_shape.dim.add(size=size)
+        tensor_proto.string_val.extend(
+            value.encode('utf-8') if isinstance(value, str) else bytes(value) for value in array.flat)
+        return tensor_proto
+    if array.dtype not in _NUMPY_TO_TF_DTYPES:
+        raise TypeError('Unsupported dtype {}.'.format(array.dtype))
+    tensor_proto.dtype = _NUMPY_TO_TF_DTYPES[array.dtype][0]
+    for size in array.shape:
+        tensor_proto.tensor_shape.dim.add(size=size)
+    tensor_proto.tensor_content = np.ascontiguousarray(array).tobytes()
+    return tensor_proto
+
+
+def make_ndarray(tensor_proto):
+    """Convert a TensorProto to a numpy array.
+
+    Arrays of tensor_content are read-only views on the message's bytes.
+
+    Args:
+        tensor_proto (TensorProto): The tensor.
+
+    Returns:
+        numpy array: The tensor as an array. DT_STRING tensors are arrays of bytes objects.
+    """
+    if tensor_proto.dtype == types_pb2.DT_STRING:
+        shape = [dim.size for dim in tensor_proto.tensor_shape.dim]
+        values = np.empty(len(tensor_proto.string_val), dtype=object)
+        values[:] = list(tensor_proto.string_val)
+        return values.reshape(shape)
+    if tensor_proto.dtype not in _TF_TO_NUMPY_DTYPES:
+        raise TypeError('Unsupported dtype {}.'.format(types_pb2.DataType.Name(tensor_proto.dtype)))
+    dtype, field = _TF_TO_NUMPY_DTYPES[tensor_proto.dtype]
+    shape = [dim.size for dim in tensor_proto.tensor_shape.dim]
+    if tensor_proto.tensor_content:
+        return np.frombuffer(tensor_proto.tensor_content, dtype=dtype).reshape(shape)
+    values = getattr(tensor_proto, field)
+    if dtype == np.float16:
+        # half_val holds the bits of float16 values
+        values = np.array(values, dtype=np.uint16).view(np.float16)
+    else:
+        values = np.array(values, dtype=dtype)
+    num_elements = int(np.prod(shape))
+    if values.size == 1 and num_elements != 1:
+        # a single value is repeated to fill the tensor
+        return np.full(shape, values[0], dtype=dtype)
+    return values.reshape(shape)
+
+
+# "host:port" -> gRPC channel shared by all predictors of this process
+_CHANNELS = {}
+_CHANNELS_LOCK = threading.Lock()
+
+
+def get_channel(host, port):
+    """Get the process-wide gRPC channel to a TF serving server.
+
+    Channels are created once per host:port and shared, so that connection
+    setup is not repeated by every predictor.
+
+    Args:
+        host (string): TF serving server hostname or IP address.
+        port (int): TF serving server port number.
+
+    Returns:
+        grpc.Channel: The channel.
+    """
+    target = '{}:{}'.format(host, int(port))
+    with _CHANNELS_LOCK:
+        if target not in _CHANNELS:
+            options = [
+                ('grpc.max_message_length', 500 * 1024 * 1024),
+                ('grpc.max_send_message_length', 500 * 1024 * 1024),
+                ('grpc.max_receive_message_length', 500 * 1024 * 1024),
+            ]
+            _CHANNELS[target] = grpc.insecure_channel(target, options=options)
+        return _CHANNELS[target]
+
+
+def is_model_available(host, port, model_name, timeout=1.0):
+    """Whether a TF serving server has loaded a model and can serve it.
+
+    Args:
+        host (string): TF serving server hostname or IP address.
+        port (int): TF serving server port number.
+        model_name (string): Name of the Model.
+        timeout (float, optional): Deadline of the status request in seconds. Defaults to 1.
+
+    Returns:
+        bool: True if a version of the model is AVAILABLE.
+    """
+    stub = model_service_pb2_grpc.ModelServiceStub(get_channel(host, port))
+    request = get_model_status_pb2.GetModelStatusRequest()
+    request.model_spec.name = model_name
+    try:
+        response = stub.GetModelStatus(request, timeout)
+    except grpc.RpcError:
+        return False
+    return any(version_status.state == get_model_status_pb2.ModelVersionStatus.AVAILABLE
+               for version_status in response.model_version_status)
+
+
+class DetectionFuture(object):
+    """Detection results of an in-flight request to a TF serving server."""
+
+    def __init__(self, response_future, image_shapes, conf_threshold):
+        super(DetectionFuture, self).__init__()
+        self._response_future = response_future
+        self._image_shapes = image_shapes
+        self._conf_threshold = conf_threshold
+
+    def done(self):
+        """Whether the response has arrived."""
+        return self._response_future.done()
+
+    def add_done_callback(self, fn):
+        """Call fn with this future when the response arrives, or at once if it has."""
+        self._response_future.add_done_callback(lambda _: fn(self))
+
+    def result(self, timeout=None):
+        """Wait for the response and parse it.
+
+        Args:
+            timeout (float, optional): Seconds to wait. Defaults to None (the
+                request's deadline).
+
+        Returns:
+            list of Dictionary: Results of each image. See TFServingPredictor.infer_one.
+        """
+        response = self._response_future.result(timeout)
+        # outputs have
+        # num_detections: number of detections
+        # detection_scores: 2d array of confidence, [image_idx, bbx_idx]
+        # detection_classes: 2d array, [image_idx, bbx_idx]
+        # detection_boxes: 3d array, [image_idx, bbx_idx, (ymin,xmin,ymax,xmax)]
+        parsed_results = {k: make_ndarray(v) for (k, v) in response.outputs.items()}
+        return detutils.parse_tf_detection_batch(
+            parsed_results['detection_boxes'],
+            parsed_results['detection_scores'],
+            parsed_results['detection_classes'],
+            self._image_shapes,
+            conf_threshold=self._conf_threshold)
 
 
 class TFServingPredictor(object):
     """An agent that makes request to a TF serving server to get object detection results.
 
     This agent communicates with the TF serving server (often a container at
-    localhost) through gRPC.
+    localhost) through gRPC. Predictors of the same server share one channel
+    (see get_channel), and requests can be issued as futures to have several
+    of them in flight at once.
     """
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, timeout=10.0):
         """Constructor.
 
         Args:
             host (string): TF serving server hostname or IP address.
             port (int): TF serving server port number.
+            timeout (float, optional): Default deadline of a request in seconds. Defaults to 10.
         """
-        options = [
-            ('grpc.max_message_length', 500 * 1024 * 1024),
-            ('grpc.max_send_message_length', 500 * 1024 * 1024),
-            ('grpc.max_receive_message_length', 500 * 1024 * 1024),
-        ]
-        self.channel = grpc.insecure_channel('{}:{}'.format(host, int(port)), options=options)
+        self.channel = get_channel(host, port)
         self.stub = prediction_service_pb2_grpc.PredictionServiceStub(self.channel)
+        self.timeout = timeout
 
-    def infer_one(self, model_name, rgb_image, conf_threshold=0.5):
+    def infer_one(self, model_name, rgb_image, conf_threshold=0.5, timeout=None):
         """Infer one image by sending a request to TF serving server.
 
         Args:
             model_name (string): Name of the Model
             rgb_image (numpy array): Image in RGB format
             conf_threshold (float, optional): Cut-off threshold for detection. Defaults to 0.5.
+            timeout (float, optional): Deadline in seconds. Defaults to the predictor's timeout.
 
         Returns:
             Dictionary: keys are class ids, values are list of [x1, y1, x2,
             y2, confidence, label_idx]. e.g {'cat': [[0, 0, 100, 100, 0.6, 'cat']],
             1: [[0, 0, 100, 100, 0.7, 1]]}
         """
-        parsed_results = self._infer(model_name, np.stack([rgb_image.astype(dtype=np.uint8)], axis=0))
-        results = {}
-        # parsed_results has
-        # num_detections: number of detections
-        # detection_scores: 2d array of confidence, [image_idx, bbx_idx]
-        # detection_classes: 2d array, [image_idx, bbx_idx]
-        # detection_boxes: 3d array, [image_idx, bbx_idx, (ymin,xmin,ymax,xmax)]
-        # for each image, should only be 1 image here.
-        # num_detections = parsed_results['num_detections']
-        detection_scores = parsed_results['detection_scores']
-        detection_classes = parsed_results['detection_classes']
-        detection_boxes = parsed_results['detection_boxes']
-        h, w, _ = rgb_image.shape
-        image_idx = 0
-        for detection_idx in range(len(detection_classes[image_idx])):
-            label = str(detection_classes[image_idx][detection_idx])
-            confidence = detection_scores[image_idx][detection_idx]
-            if confidence < conf_threshold:
-                continue
-            norm_bbox = detection_boxes[image_idx][detection_idx]
-            bbox = [int(norm_bbox[1]*w), int(norm_bbox[0]*h),
-                    int(norm_bbox[3]*w), int(norm_bbox[2]*h)]
-            objs = results.setdefault(label, [])
-            objs.append([*bbox, confidence, label])
-        return results
-
-    def _infer(self, model_name, images):
+        return self.infer(model_name, rgb_image[np.newaxis], conf_threshold=conf_threshold, timeout=timeout)[0]
+
+    def infer(self, model_name, rgb_images, conf_threshold=0.5, timeout=None):
+        """Infer a batch of images with one request to TF serving server.
+
+        Args:
+            model_name (string): Name of the Model
+            rgb_images (numpy array): Images in RGB format of the same size, [image_idx, h, w, c].
+            conf_threshold (float, optional): Cut-off threshold for detection. Defaults to 0.5.
+            timeout (float, optional): Deadline in seconds. Defaults to the predictor's timeout.
+
+        Returns:
+            list of Dictionary: Results of each image. See infer_one.
+        """
+        return self.infer_future(model_name, rgb_images, conf_threshold=conf_threshold, timeout=timeout).result()
+
+    def infer_future(self, model_name, rgb_images, conf_threshold=0.5, timeout=None):
+        """Send a batch of images to TF serving server without waiting for the results.
+
+        Args:
+            model_name (string): Name of the Model
+            rgb_images (numpy array): Images in RGB format of the same size, [image_idx, h, w, c].
+            conf_threshold (float, optional): Cut-off threshold for detection. Defaults to 0.5.
+            timeout (float, optional): Deadline in seconds. Defaults to the predictor's timeout.
+
+        Returns:
+            DetectionFuture: Future of the results of each image.
+        """
+        rgb_images = np.asarray(rgb_images)
         # Create prediction request object
         request = predict_pb2.PredictRequest()
         # Specify model name (must be the same as when the TensorFlow serving serving was started)
         request.model_spec.name = model_name
         # Initalize prediction
-        request.inputs['inputs'].CopyFrom(
-            tf.make_tensor_proto(images))
+        make_tensor_proto(rgb_images.astype(np.uint8, copy=False), request.inputs['inputs'])
         # Call the prediction server
-        result = self.stub.Predict(request, 10.0)  # 10 secs timeout
-        # convert tensorProto to numpy array
-        parsed_results = {}
-        for k, v in result.outputs.items():
-            parsed_results[k] = tf.make_ndarray(v)
-        # fix output result types
-        if 'detection_classes' in parsed_results:
-            parsed_results['detection_classes'] = parsed_results['detection_classes'].astype(np.int64)
-        return parsed_results
+        response_future = self.stub.Predict.future(request, timeout if timeout is not None else self.timeout)
+        return DetectionFuture(response_future, [image.shape for image in rgb_images], conf_threshold)
+
+    def infer_shared_future(self, model_name, frame_refs, conf_threshold=0.5, timeout=None):
+        """Send references to images in shared memory without waiting for the results.
+
+        The images are not sent. The request's 'frame_refs' input holds their
+        references as JSON strings (see shmutils), so the server must run on
+        the same host and support shared-memory frames (e.g.
+        standins.TFServingServer). Stock TF serving does not.
+
+        Args:
+            model_name (string): Name of the Model
+            frame_refs (list of dictionary): References of RGB images written by shmutils.SharedFrameRing.
+            conf_threshold (float, optional): Cut-off threshold for detection. Defaults to 0.5.
+            timeout (float, optional): Deadline in seconds. Defaults to the predictor's timeout.
+
+        Returns:
+            DetectionFuture: Future of the results of each image.
+        """
+        request = predict_pb2.PredictRequest()
+        request.model_spec.name = model_name
+        make_tensor_proto(np.array([json.dumps(ref) for ref in frame_refs], dtype=object),
+                          request.inputs['frame_refs'])
+        response_future = self.stub.Predict.future(request, timeout if timeout is not None else self.timeout)
+        return DetectionFuture(response_future, [tuple(ref['shape']) for ref in frame_refs], conf_threshold)
@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+"""Callable classes that wrap other processor callables.
+
+Wrapped callables are specified by their class name in processor_zoo and
+their constructor arguments, the same way processors are serialized in
+pbfsm files, so that wrappers can be serialized like any other callable.
+"""
+import collections
+import copy
+import json
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from gabrieltool.statemachine.callable_zoo import record_kwargs
+from gabrieltool.statemachine.callable_zoo import CallableBase
+from gabrieltool.statemachine.callable_zoo import Detections
+from gabrieltool.statemachine.callable_zoo import FrameContext
+
+
+def create_callable(callable_name, callable_args):
+    """Create a processor callable from its serialized form.
+
+    Args:
+        callable_name (string): Class name of the callable in processor_zoo.
+        callable_args (dict or string): Constructor arguments, as a dictionary
+            or a JSON string.
+
+    Returns:
+        CallableBase: The callable.
+    """
+    from gabrieltool.statemachine.callable_zoo import processor_zoo
+    if isinstance(callable_args, str):
+        callable_args = json.loads(callable_args)
+    callable_class = getattr(processor_zoo, callable_name, None)
+    if callable_class is None:
+        raise ValueError('Unknown processor callable {}.'.format(callable_name))
+    return callable_class.from_json(copy.copy(callable_args))
+
+
+def call(callable_obj, frame):
+    """Call a processor callable with a FrameContext or its image, as it accepts."""
+    if getattr(callable_obj, 'accepts_frame_context', False):
+        return callable_obj(frame)
+    return callable_obj(frame.image)
+
+
+class _WrapperCallable(CallableBase):
+    """Base class of callables that wrap other processor callables."""
+
+    accepts_frame_context = True
+
+    def __init__(self):
+        super(_WrapperCallable, self).__init__()
+        self.wrapped_callables = []
+
+    def prepare(self):
+        """Prepare the wrapped callables."""
+        for callable_obj in self.wrapped_callables:
+            prepare_func = getattr(callable_obj, 'prepare', None)
+            if callable(prepare_func):
+                prepare_func()
+
+    @property
+    def warmup_input_shape(self):
+        for callable_obj in self.wrapped_callables:
+            shape = getattr(callable_obj, 'warmup_input_shape', None)
+            if shape is not None:
+                return shape
+        return None
+
+
+class TrackingCallable(_WrapperCallable):
+    """A callable class that runs an object detector every few frames and tracks its detections in between.
+
+    On frames without detection, each detected box is moved by the optical
+    flow (pyramidal Lucas-Kanade) of a grid of points inside it. The output
+    has the same format as the detector's. The detector runs again when
+    detect_every_n frames have passed, or earlier when boxes cannot be tracked
+    reliably. Tracking state is kept per session.
+    """
+
+    @record_kwargs
+    def __init__(self, callable_name, callable_args, detect_every_n=5, min_tracked_ratio=0.5,
+                 max_fb_error=1.0):
+        """Constructor.
+
+        Args:
+            callable_name (string): Class name of the detector callable in processor_zoo.
+            callable_args (dict or string): Constructor arguments of the detector.
+            detect_every_n (int, optional): Run the detector on one in every n frames. Defaults to 5.
+            min_tracked_ratio (float, optional): Run the detector when fewer
+                than this ratio of a box's points are tracked. Defaults to 0.5.
+            max_fb_error (float, optional): Maximum forward-backward error in
+                pixels of a tracked point. Defaults to 1.
+        """
+        super(TrackingCallable, self).__init__()
+        self.detector = create_callable(callable_name, callable_args)
+        self.wrapped_callables = [self.detector]
+        self.detect_every_n = detect_every_n
+        self.min_tracked_ratio = min_tracked_ratio
+        self.max_fb_error = max_fb_error
+        self._grid_size = 5
+        self._lk_params = dict(winSize=(15, 15), maxLevel=3,
+                               criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
+    @classmethod
+    def from_json(cls, json_obj):
+        """Deserialize."""
+        try:
+            kwargs = copy.copy(json_obj)
+            kwargs['detect_every_n'] = int(json_obj['detect_every_n'])
+            if 'min_tracked_ratio' in json_obj:
+                kwargs['min_tracked_ratio'] = float(json_obj['min_tracked_ratio'])
+            if 'max_fb_error' in json_obj:
+                kwargs['max_fb_error'] = float(json_obj['max_fb_error'])
+        except ValueError as e:
+            raise ValueError(
+                'Failed to convert json object to {} instance. '
+                'The input json object is {}. ({})'.format(cls.__name__,
+                                                           json_obj, e))
+        return cls(**kwargs)
+
+    def __call__(self, image):
+        frame = FrameContext.of(image)
+        state = self.session_state()
+        gray = frame.gray
+        results = None
+        if state.get('tracks') is not None and state['frames_since_detection'] < self.detect_every_n - 1:
+            results = self._track(state, gray)
+        if results is None:
+            results = call(self.detector, frame)
+            state['tracks'] = Detections.of(results)
+            state['frames_since_detection'] = 0
+        else:
+            state['frames_since_detection'] += 1
+        state['gray'] = gray
+        return results
+
+    def _grid_points(self, boxes):
+        """A grid of points inside each box. Returns the points and the index of their boxes."""
+        steps = (np.arange(self._grid_size) + 0.5) / self._grid_size
+        grid_x, grid_y = np.meshgrid(steps, steps)
+        grid = np.stack([grid_x.ravel(), grid_y.ravel()], axis=1)
+        # [box_idx, point_idx, (x, y)]
+        points = boxes[:, np.newaxis, :2] + grid[np.newaxis] * (boxes[:, np.newaxis, 2:] - boxes[:, np.newaxis, :2])
+        box_indices = np.repeat(np.arange(len(boxes)), len(grid))
+        return points.reshape(-1, 1, 2).astype(np.float32), box_indices
+
+    def _track(self, state, gray):
+        """Move the tracked boxes from the previous frame. Returns None if tracking is unreliable."""
+        tracks = state['tracks']
+        if tracks.num_detections == 0:
+            return tracks
+        if state['gray'].shape != gray.shape:
+            return None
+        boxes = tracks.boxes.astype(np.float32)
+        points, box_indices = self._grid_points(boxes)
+        new_points, status, _ = cv2.calcOpticalFlowPyrLK(state['gray'], gray, points, None, **self._lk_params)
+        back_points, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, state['gray'], new_points, None,
+                                                               **self._lk_params)
+        fb_errors = np.linalg.norm((back_points - points).reshape(-1, 2), axis=1)
+        valid = (status.ravel() == 1) & (back_status.ravel() == 1) & (fb_errors < self.max_fb_error)
+        num_points = np.bincount(box_indices, minlength=len(boxes))
+        num_valid = np.bincount(box_indices, weights=valid, minlength=len(boxes))
+        if np.any(num_valid < self.min_tracked_ratio * num_points):
+            return None
+
+        # median displacement of the valid points of each box, [box_idx, (dx, dy)]
+        displacements = (new_points - points).reshape(len(boxes), -1, 2)
+        valid = valid.reshape(len(boxes), -1)
+        displacements[~valid] = np.nan
+        medians = np.zeros((len(boxes), 2), dtype=np.float32)
+        has_valid = num_valid > 0
+        medians[has_valid] = np.nanmedian(displacements[has_valid], axis=1)
+        new_tracks = Detections(np.round(boxes + np.tile(medians, 2)).astype(np.int64),
+                                tracks.scores, tracks.class_ids, labels=tracks.labels,
+                                entry_class_ids=tracks.entry_class_ids, keep_labels=tracks.keep_labels)
+        state['tracks'] = new_tracks
+        return new_tracks
+
+
+class CascadeCallable(_WrapperCallable):
+    """A callable class that runs stages of processors from the cheapest and stops when a stage is confident.
+
+    Each stage is a processor callable with conditions that its output must
+    meet to be accepted:
+
+        * required_classes: all of these classes are detected.
+        * min_confidence: no detection has a lower confidence.
+
+    When the output of a stage is not accepted, the next (usually more
+    expensive) stage runs on the frame. The output of the last stage that ran
+    is returned, so expensive models only run on ambiguous frames.
+    """
+
+    @record_kwargs
+    def __init__(self, stages):
+        """Constructor.
+
+        Args:
+            stages (list of dict or string): Stages in the order to run, as a
+                list or a JSON string. Each stage is a dictionary with
+                'callable_name' and 'callable_args' of a processor callable
+                (see create_callable), and optionally 'required_classes' (list
+                of labels) and 'min_confidence' (float).
+                e.g. [{'callable_name': 'ONNXRuntimeCallable', 'callable_args':
+                {...}, 'min_confidence': 0.7}, {'callable_name':
+                'FasterRCNNOpenCVCallable', 'callable_args': {...}}]
+        """
+        super(CascadeCallable, self).__init__()
+        if isinstance(stages, str):
+            stages = json.loads(stages)
+        if not stages:
+            raise ValueError('CascadeCallable needs at least one stage.')
+        self.stages = stages
+        self.wrapped_callables = [create_callable(stage['callable_name'], stage['callable_args'])
+                                  for stage in stages]
+        self._required_classes = [[str(label) for label in stage.get('required_classes') or []]
+                                  for stage in stages]
+        self._min_confidences = [stage.get('min_confidence') for stage in stages]
+        # number of frames whose output came from each stage
+        self.stage_counts = [0] * len(stages)
+
+    def _is_accepted(self, stage_idx, results):
+        labels = set(str(label) for label in results)
+        if any(label not in labels for label in self._required_classes[stage_idx]):
+            return False
+        min_confidence = self._min_confidences[stage_idx]
+        if min_confidence is not None and isinstance(results, Detections):
+            return not np.any(results.scores < min_confidence)
+        if min_confidence is not None:
+            for entries in results.values():
+                if isinstance(entries, list) and any(
+                        isinstance(entry, (list, tuple)) and len(entry) > 4 and entry[4] < min_confidence
+                        for entry in entries):
+                    return False
+        return True
+
+    def __call__(self, image):
+        frame = FrameContext.of(image)
+        last_stage_idx = len(self.wrapped_callables) - 1
+        for stage_idx, callable_obj in enumerate(self.wrapped_callables):
+            results = call(callable_obj, frame)
+            if stage_idx == last_stage_idx or self._is_accepted(stage_idx, results):
+                self.stage_counts[stage_idx] += 1
+                return results
+
+
+_MISSING = object()
+
+
+def dhash(frame, hash_size=8):
+    """Difference hash of a frame, a perceptual hash that near-identical frames share.
+
+    The frame is downscaled to (hash_size + 1) x hash_size in grayscale, and
+    each bit tells whether a pixel is brighter than its right neighbor. To be
+    fast, the frame is first subsampled so that about 8 x 8 pixels are
+    averaged for each pixel of the hash.
+
+    Args:
+        frame (FrameContext): The frame.
+        hash_size (int, optional): The hash has hash_size ** 2 bits. Defaults to 8.
+
+    Returns:
+        bytes: The hash.
+    """
+    def compute():
+        small = thumbnail(frame, (hash_size + 1, hash_size))
+        return np.packbits(small[:, 1:] > small[:, :-1]).tobytes()
+    return frame.memoize(('dhash', hash_size), compute)
+
+
+def thumbnail(frame, size):
+    """Grayscale thumbnail of a frame as int16, for cheap comparisons of frames.
+
+    To be fast, the frame is first subsampled so that about 8 x 8 pixels are
+    averaged for each pixel of the thumbnail.
+
+    Args:
+        frame (FrameContext): The frame.
+        size (tuple): (width, height) of the thumbnail.
+    """
+    def compute():
+        height, width = frame.shape[:2]
+        step = max(1, min(height // (size[1] * 8), width // (size[0] * 8)))
+        small = cv2.resize(frame.image[::step, ::step], tuple(size), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small.astype(np.int16)
+    return frame.memoize(('thumbnail', tuple(size)), compute)
+
+
+class LRUCache(object):
+    """A thread-safe LRU cache whose entries expire after a time to live.
+
+    Hits and misses are counted for monitoring.
+    """
+
+    def __init__(self, max_size=128, ttl=None):
+        """Constructor.
+
+        Args:
+            max_size (int, optional): Maximum number of entries. Defaults to 128.
+            ttl (float, optional): Seconds an entry is valid for. Defaults to None (no expiry).
+        """
+        super(LRUCache, self).__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # key -> (insertion time, value)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        """Ratio of lookups that are hits."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key, default=None, validate=None):
+        """Look up a key.
+
+        Args:
+            key (hashable): The key.
+            default (any, optional): Returned on a miss. Defaults to None.
+            validate (callable, optional): Function of the cached value that
+                tells whether it can be used. Invalid entries are misses.
+                Defaults to None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is not None and validate is not None and not validate(entry[1]):
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class CachedCallable(_WrapperCallable):
+    """A callable class that caches the outputs of a processor callable by a perceptual hash of frames.
+
+    Near-identical frames (e.g. retransmitted frames, paused videos, or static
+    scenes) have the same difference hash (see dhash), so their outputs are
+    looked up instead of computed. Different frames can have the same hash
+    too, as it only encodes the direction of brightness changes. A hit is
+    therefore only used when a 32 x 24 thumbnail of the frame differs from the
+    cached frame's by at most max_pixel_diff on average. CachedCallables of the same wrapped
+    callable and cache settings share one cache (see CACHES), e.g. when the
+    same model is used in several states.
+    """
+
+    # (callable_name, callable_args, max_size, ttl, hash_size) -> LRUCache
+    CACHES = {}
+    _CACHES_LOCK = threading.Lock()
+
+    # (width, height) of the thumbnails that verify hits
+    THUMBNAIL_SIZE = (32, 24)
+
+    @record_kwargs
+    def __init__(self, callable_name, callable_args, max_size=128, ttl=10.0, hash_size=8, max_pixel_diff=5.0):
+        """Constructor.
+
+        Args:
+            callable_name (string): Class name of the callable in processor_zoo.
+            callable_args (dict or string): Constructor arguments of the callable.
+            max_size (int, optional): Maximum number of cached outputs. Defaults to 128.
+            ttl (float, optional): Seconds a cached output is valid for. None
+                keeps outputs until they are evicted. Defaults to 10.
+            hash_size (int, optional): Frames are hashed to hash_size ** 2
+                bits. Larger sizes tell more similar frames apart. Defaults to 8.
+            max_pixel_diff (float, optional): Maximum mean absolute difference
+                (0-255) between the thumbnails of a frame and of a cached frame
+                with the same hash for the cached output to be used. None uses
+                every hash match, which is approximate. Defaults to 5.
+        """
+        super(CachedCallable, self).__init__()
+        if isinstance(callable_args, str):
+            callable_args = json.loads(callable_args)
+        self.callable_obj = create_callable(callable_name, callable_args)
+        self.wrapped_callables = [self.callable_obj]
+        self.hash_size = hash_size
+        self.max_pixel_diff = max_pixel_diff
+        cache_key = (callable_name, json.dumps(callable_args, sort_keys=True), max_size, ttl, hash_size)
+        with CachedCallable._CACHES_LOCK:
+            if cache_key not in CachedCallable.CACHES:
+                CachedCallable.CACHES[cache_key] = LRUCache(max_size=max_size, ttl=ttl)
+            self.cache = CachedCallable.CACHES[cache_key]
+
+    @classmethod
+    def from_json(cls, json_obj):
+        """Deserialize."""
+        try:
+            kwargs = copy.copy(json_obj)
+            if 'max_size' in json_obj:
+                kwargs['max_size'] = int(json_obj['max_size'])
+            if 'ttl' in json_obj:
+                kwargs['ttl'] = None if json_obj['ttl'] in (None, 'None') else float(json_obj['ttl'])
+            if 'hash_size' in json_obj:
+                kwargs['hash_size'] = int(json_obj['hash_size'])
+            if 'max_pixel_diff' in json_obj:
+                kwargs['max_pixel_diff'] = (None if json_obj['max_pixel_diff'] in (None, 'None')
+                                            else float(json_obj['max_pixel_diff']))
+        except ValueError as e:
+            raise ValueError(
+                'Failed to convert json object to {} instance. '
+                'The input json object is {}. ({})'.format(cls.__name__,
+                                                           json_obj, e))
+        return cls(**kwargs)
+
+    def __call__(self, image):
+        frame = FrameContext.of(image)
+        # outputs (e.g. boxes) depend on the frame size
+        key = (frame.shape, dhash(frame, self.hash_size))
+        # entries are (thumbnail, results). Caches may be shared with callables
+        # of another max_pixel_diff, so thumbnails are always kept
+        small = thumbnail(frame, self.THUMBNAIL_SIZE)
+        validate = None
+        if self.max_pixel_diff is not None:
+            def validate(entry):
+                return float(np.mean(np.abs(small - entry[0]))) <= self.max_pixel_diff
+        entry = self.cache.get(key, _MISSING, validate=validate)
+        if entry is _MISSING:
+            entry = (small, call(self.callable_obj, frame))
+            self.cache.put(key, entry)
+        return entry[1]
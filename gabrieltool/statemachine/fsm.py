@@ -124,6 +124,19 @@ class _FSMCallable(_FSMObjBase):
         if callable(prepare_func):
             prepare_func()
 
+    @property
+    def supports_submit(self):
+        """Whether the callable_obj can start working on an input without waiting for the output.
+
+        Such callables implement a submit(input) method that returns a future
+        (an object with a result() method).
+        """
+        return callable(getattr(self._callable_obj, 'submit', None))
+
+    def submit(self, current_input):
+        """Start calling the callable_obj. Returns a future of its output."""
+        return self._callable_obj.submit(current_input)
+
     def __call__(self, current_input):
         return self._callable_obj(current_input)
 
@@ -155,6 +168,24 @@ class Processor(_FSMCallable):
         """
         super().__init__(name=name, callable_obj=callable_obj, zoo=processor_zoo)
 
+    def _get_input(self, frame):
+        frame = callable_zoo.FrameContext.of(frame)
+        if getattr(self._callable_obj, 'accepts_frame_context', False):
+            return frame
+        return frame.image
+
+    def submit(self, frame):
+        """Start processing a frame (an image or a callable_zoo.FrameContext). Returns a future of the output."""
+        return self._callable_obj.submit(self._get_input(frame))
+
+    def __call__(self, frame):
+        """Process a frame (an image or a callable_zoo.FrameContext).
+
+        The callable_obj is given the frame if it accepts frame contexts, or
+        the image otherwise.
+        """
+        return self._callable_obj(self._get_input(frame))
+
 
 class TransitionPredicate(_FSMCallable):
     """Condition for state transition.
@@ -241,6 +272,19 @@ class Transition(_FSMObjBase):
             raise TypeError("Predicates needs to be type list.")
         self._predicates = val
 
+    @property
+    def timer_duration(self):
+        """Seconds after which this transition is taken if it only depends on time.
+
+        A transition is time-based when all of its predicates are timers (e.g.
+        predicate_zoo.Wait). None if the transition depends on inputs.
+        """
+        durations = [getattr(predicate.callable_obj, 'timer_duration', None)
+                     for predicate in self._predicates]
+        if not durations or None in durations:
+            return None
+        return max(durations)
+
     def __call__(self, app_state):
         """Given the current app_state, check if a transition should be taken.
 
@@ -326,10 +370,65 @@ class State(_FSMObjBase):
             raise TypeError("Predicates needs to be type list.")
         self._transitions = val
 
+    @property
+    def timer_only(self):
+        """Whether all transitions of this state are time-based.
+
+        Processors do not need to run in such a state, as no transition depends
+        on their outputs.
+        """
+        return bool(self.transitions) and all(
+            tran.timer_duration is not None for tran in self.transitions)
+
+    def start_timers(self, start_time=None):
+        """Start the timers of transition predicates (e.g. predicate_zoo.Wait).
+
+        This method is called by FSM runners when the state is entered.
+
+        Args:
+            start_time (float, optional): Start time as returned by
+                time.time(). Defaults to now.
+        """
+        for tran in self.transitions:
+            for predicate in tran.predicates:
+                start_timer_func = getattr(predicate.callable_obj, 'start_timer', None)
+                if callable(start_timer_func):
+                    start_timer_func(start_time)
+
+    def observe(self, app_state):
+        """Let transition predicates observe the outputs of the processors on a frame.
+
+        Predicates that keep a window of recent frames (e.g.
+        predicate_zoo.HasObjectInRecentFrames) have an observe method. It is
+        called on every frame before any transition is evaluated, as
+        transitions stop evaluating their predicates at the first false one.
+        A predicate shared by several transitions observes each frame once.
+
+        Args:
+            app_state (dict): Outputs of the processors (see process).
+        """
+        observed = set()
+        for tran in self.transitions:
+            for predicate in tran.predicates:
+                callable_obj = predicate.callable_obj
+                observe_func = getattr(callable_obj, 'observe', None)
+                if callable(observe_func) and id(callable_obj) not in observed:
+                    observed.add(id(callable_obj))
+                    observe_func(app_state)
+
     def _run_processors(self, img):
-        app_state = {'raw': img}
-        for obj_processor in self.processors:
-            app_state.update(obj_processor(img))
+        # processors share the views of the frame (e.g. RGB) computed by each other
+        frame = callable_zoo.FrameContext.of(img)
+        app_state = {'raw': frame.image}
+        # processors that support submit (e.g. remote models) are started
+        # first, so that their requests are in flight while others run.
+        futures = {idx: obj_processor.submit(frame) for (idx, obj_processor) in enumerate(self.processors)
+                   if obj_processor.supports_submit}
+        for (idx, obj_processor) in enumerate(self.processors):
+            if idx in futures:
+                app_state.update(futures[idx].result())
+            else:
+                app_state.update(obj_processor(frame))
         return app_state
 
     def _get_one_satisfied_transition(self, app_state):
@@ -347,8 +446,32 @@ class State(_FSMObjBase):
         for obj_processor in self.processors:
             obj_processor.prepare()
 
-    def __call__(self, img):
-        app_state = self._run_processors(img)
+    def process(self, img):
+        """Run the processors of this state on an input.
+
+        Args:
+            img (any): The input, e.g. an image or a callable_zoo.FrameContext.
+
+        Returns:
+            dict: The app_state, which has the input image as 'raw' and the
+            outputs of all processors.
+        """
+        return self._run_processors(img)
+
+    def __call__(self, img, app_state=None):
+        """Process an input and find the transition to take.
+
+        Args:
+            img (any): The input, e.g. an image or a callable_zoo.FrameContext.
+            app_state (dict, optional): Outputs of the processors to use
+                instead of running them (see process). Defaults to None.
+
+        Returns:
+            tuple: The next state and the instruction of the transition.
+        """
+        if app_state is None:
+            app_state = self._run_processors(img)
+        self.observe(app_state)
         transition = self._get_one_satisfied_transition(app_state)
         if transition is None:
             return self, Instruction()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Utilities to keep logging cheap on the inference path.
+
+* FrameSampler: log only every n-th frame.
+* Truncated: size-capped representation of a payload that is only formatted
+  when a log record is emitted.
+* enable_async_logging: move formatting and I/O of a logger to a background
+  thread.
+"""
+import logging.handlers
+import queue
+
+from logzero import logger as default_logger
+
+
+def truncate(obj, max_length=256):
+    """Return a size-capped representation of an object.
+
+    Binary data (e.g. encoded images) is represented by its length only.
+
+    Args:
+        obj (any): Object to represent.
+        max_length (int, optional): Maximum number of characters to keep.
+            Defaults to 256.
+
+    Returns:
+        string: The representation.
+    """
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return '<{} bytes>'.format(len(obj))
+    if isinstance(obj, (list, tuple)):
+        text = '[{}]'.format(', '.join(truncate(item, max_length) for item in obj))
+    else:
+        text = str(obj)
+    if len(text) > max_length:
+        return '{}...<{} more chars>'.format(text[:max_length], len(text) - max_length)
+    return text
+
+
+class Truncated(object):
+    """Lazily formatted, size-capped representation of an object.
+
+    Pass objects of this class as logging arguments so that formatting only
+    happens when (and where) the record is emitted, e.g.
+
+        logger.debug('results: %s', Truncated(results))
+    """
+
+    def __init__(self, obj, max_length=256):
+        self.obj = obj
+        self.max_length = max_length
+
+    def __str__(self):
+        return truncate(self.obj, self.max_length)
+
+
+class FrameSampler(object):
+    """Decide whether to log a frame. Every n-th frame is sampled."""
+
+    def __init__(self, every_n_frames=1):
+        """Constructor.
+
+        Args:
+            every_n_frames (int, optional): Sample one in every n frames. 0
+                disables sampling. Defaults to 1 (sample all frames).
+        """
+        super(FrameSampler, self).__init__()
+        self.every_n_frames = every_n_frames
+        self._count = 0
+
+    def sample(self):
+        """Count a frame and return whether it should be logged."""
+        if self.every_n_frames <= 0:
+            return False
+        self._count += 1
+        if self._count >= self.every_n_frames:
+            self._count = 0
+            return True
+        return False
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The standard QueueHandler formats the message in the logging thread so
+    that records can be pickled. Records stay in process here, so formatting
+    is deferred to the handlers behind the QueueListener.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class _RestoringQueueListener(logging.handlers.QueueListener):
+    """QueueListener that gives the handlers back to the logger when stopped."""
+
+    def __init__(self, logger, queue_handler, record_queue, *handlers):
+        super(_RestoringQueueListener, self).__init__(record_queue, *handlers, respect_handler_level=True)
+        self._logger = logger
+        self._queue_handler = queue_handler
+
+    def stop(self):
+        super(_RestoringQueueListener, self).stop()
+        self._logger.removeHandler(self._queue_handler)
+        for handler in self.handlers:
+            self._logger.addHandler(handler)
+
+
+def enable_async_logging(logger=default_logger):
+    """Move formatting and I/O of a logger to a background thread.
+
+    The handlers of the logger are moved behind a queue. Arguments of log
+    records are formatted by the background thread, so objects passed as
+    logging arguments should not be modified after logging them.
+
+    Args:
+        logger (logging.Logger, optional): Logger to change. Defaults to
+            logzero's logger.
+
+    Returns:
+        logging.handlers.QueueListener: The started listener. Call its stop()
+        method to flush pending records and restore synchronous logging.
+    """
+    handlers = [handler for handler in logger.handlers
+                if not isinstance(handler, _DeferredQueueHandler)]
+    record_queue = queue.Queue(-1)
+    queue_handler = _DeferredQueueHandler(record_queue)
+    listener = _RestoringQueueListener(logger, queue_handler, record_queue, *handlers)
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    listener.start()
+    return listener
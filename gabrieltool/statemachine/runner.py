@@ -4,13 +4,287 @@
 Runner to run the cognitive assistants that are expressed as state machines.
 """
 
+import collections
+import heapq
+import importlib
+import itertools
+import threading
+import time
+from concurrent import futures
+
 import cv2
 import numpy as np
 from gabriel_protocol import gabriel_pb2
 from gabriel_server import cognitive_engine
 from logzero import logger
 
-from gabrieltool.statemachine import fsm, instruction_pb2
+from gabrieltool.statemachine import callable_zoo, fsm, instruction_pb2, logutils
+
+
+def _get_processor_callables(start_state):
+    """Distinct processor callables of a FSM, in BFS order."""
+    callables = collections.OrderedDict()
+    for state in fsm.StateMachine.bfs(start_state):
+        for obj_processor in state.processors:
+            callables.setdefault(id(obj_processor.callable_obj), obj_processor.callable_obj)
+    return list(callables.values())
+
+
+def _get_callables_to_prepare(start_state):
+    """Distinct processor callables of a FSM that have a prepare() method, in BFS order."""
+    return [callable_obj for callable_obj in _get_processor_callables(start_state)
+            if callable(getattr(callable_obj, 'prepare', None))]
+
+
+def warm_up(callable_obj, num_iterations=1, image_shape=(480, 640, 3)):
+    """Run inferences on a synthetic image to initialize a processor callable.
+
+    The first inference of many models is much slower than later ones (e.g.
+    lazy graph initialization and connection setup). Warming up moves that cost
+    from the first frame of a client to startup.
+
+    Wrappers of other callables (e.g. CachedCallable) are not called.
+    Their wrapped_callables are warmed up instead, so that the synthetic
+    image does not end up in caches, statistics or session state.
+
+    Args:
+        callable_obj (CallableBase): A processor callable.
+        num_iterations (int, optional): Number of inferences. Defaults to 1.
+        image_shape (tuple, optional): Shape of the synthetic BGR image, used
+            unless the callable has a warmup_input_shape attribute.
+            Defaults to (480, 640, 3).
+
+    Returns:
+        float: Latency of the last inference in seconds. For wrappers, the
+        sum of the latencies of the wrapped callables.
+    """
+    wrapped_callables = getattr(callable_obj, 'wrapped_callables', None)
+    if wrapped_callables:
+        return sum(warm_up(wrapped, num_iterations=num_iterations, image_shape=image_shape)
+                   for wrapped in wrapped_callables)
+    image_shape = getattr(callable_obj, 'warmup_input_shape', None) or image_shape
+    image = np.random.RandomState(0).randint(0, 256, size=image_shape, dtype=np.uint8)
+    latencies = []
+    for _ in range(num_iterations):
+        start_time = time.monotonic()
+        callable_obj(image)
+        latencies.append(time.monotonic() - start_time)
+    logger.info('Warmed up {} with {} inferences: first {:.1f} ms, warm {:.1f} ms.'.format(
+        callable_obj.__class__.__name__, num_iterations, latencies[0] * 1000, latencies[-1] * 1000))
+    return latencies[-1]
+
+
+def prepare(start_state, max_workers=None, timeout=None, warmup_iterations=0, warmup_image_shape=(480, 640, 3)):
+    """Prepare each state in the state machine to run.
+
+    This allows each state to load asset from disks, start container, etc.
+    Each callable's behavior should be implemented in its prepare function.
+
+    Callables are prepared concurrently, so that a FSM with several models is
+    ready in about the time of its slowest model. A callable shared by several
+    states is prepared once.
+
+    Args:
+        start_state (State): The start state of a FSM.
+        max_workers (int, optional): Maximum number of callables prepared at
+            once. Defaults to None (all of them).
+        timeout (float, optional): Seconds to wait for all callables. Defaults
+            to None (no limit).
+        warmup_iterations (int, optional): Number of warm-up inferences of each
+            processor after all callables are prepared (see warm_up). Warm-ups
+            run one processor at a time so that their latencies are not
+            affected by each other. Defaults to 0.
+        warmup_image_shape (tuple, optional): Shape of the warm-up images.
+            Defaults to (480, 640, 3).
+
+    Raises:
+        TimeoutError: when callables are not prepared within timeout.
+    """
+    callables = _get_callables_to_prepare(start_state)
+    if callables:
+        _prepare_callables(callables, max_workers, timeout)
+    if warmup_iterations > 0:
+        for callable_obj in _get_processor_callables(start_state):
+            warm_up(callable_obj, num_iterations=warmup_iterations, image_shape=warmup_image_shape)
+
+
+def _prepare_callables(callables, max_workers, timeout):
+    start_time = time.monotonic()
+    logger.info('Preparing {} callables...'.format(len(callables)))
+    executor = futures.ThreadPoolExecutor(max_workers=max_workers or len(callables),
+                                          thread_name_prefix='prepare')
+    pending = {executor.submit(callable_obj.prepare): callable_obj for callable_obj in callables}
+    num_done = 0
+    errors = []
+    try:
+        for future in futures.as_completed(pending, timeout=timeout):
+            name = pending[future].__class__.__name__
+            num_done += 1
+            if future.exception() is not None:
+                logger.error('Failed to prepare {}: {}'.format(name, future.exception()))
+                errors.append(future.exception())
+            else:
+                logger.info('Prepared {} ({}/{}) after {:.1f} seconds.'.format(
+                    name, num_done, len(callables), time.monotonic() - start_time))
+    except futures.TimeoutError:
+        not_done = [pending[future].__class__.__name__ for future in pending if not future.done()]
+        raise TimeoutError('Preparing callables did not finish in {} seconds. Still preparing: {}'.format(
+            timeout, ', '.join(not_done)))
+    finally:
+        # do not block on callables that are still preparing after a timeout
+        executor.shutdown(wait=False)
+    if errors:
+        raise errors[0]
+
+
+class TimerScheduler(object):
+    """Run callbacks at their deadlines on a background thread.
+
+    Runners use a scheduler to take time-based transitions when they are due,
+    independent of when inputs arrive. One scheduler can be shared by many
+    runners.
+    """
+
+    def __init__(self):
+        super(TimerScheduler, self).__init__()
+        self._cond = threading.Condition()
+        # heap of [deadline, sequence number, callback]
+        self._heap = []
+        self._counter = itertools.count()
+        self._thread = None
+
+    def schedule(self, deadline, callback):
+        """Schedule a callback.
+
+        Args:
+            deadline (float): Time as returned by time.time() to run the callback.
+            callback (callable): Called without arguments from the scheduler thread.
+
+        Returns:
+            A handle to cancel the callback.
+        """
+        entry = [deadline, next(self._counter), callback]
+        with self._cond:
+            heapq.heappush(self._heap, entry)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='TimerScheduler', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return entry
+
+    def cancel(self, handle):
+        """Cancel a scheduled callback."""
+        with self._cond:
+            handle[2] = None
+
+    def _next_due(self):
+        with self._cond:
+            while True:
+                while self._heap and self._heap[0][2] is None:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                timeout = self._heap[0][0] - time.time()
+                if timeout <= 0:
+                    return heapq.heappop(self._heap)[2]
+                self._cond.wait(timeout)
+
+    def _run(self):
+        while True:
+            callback = self._next_due()
+            try:
+                callback()
+            except Exception:
+                logger.exception('Timer callback failed.')
+
+
+class MotionGate(object):
+    """Reuse the outputs of processors for frames that barely change.
+
+    Each frame is compared to the last frame that processors ran on, using
+    the mean absolute difference of small grayscale thumbnails (0-255). When
+    the difference is below threshold, the last outputs are reused instead of
+    running the processors again, for at most max_reuse frames in a row so
+    that outputs are refreshed regularly. Transition predicates are still
+    evaluated on every frame.
+
+    A gate belongs to one session, as it keeps the session's last frame.
+    """
+
+    def __init__(self, threshold=2.0, max_reuse=5, size=(64, 48)):
+        """Constructor.
+
+        Args:
+            threshold (float, optional): Maximum mean absolute pixel
+                difference of a static frame. Defaults to 2.
+            max_reuse (int, optional): Maximum number of consecutive frames
+                that reuse outputs. Defaults to 5.
+            size (tuple, optional): (width, height) of the thumbnails. Defaults to (64, 48).
+        """
+        super(MotionGate, self).__init__()
+        self.threshold = threshold
+        self.max_reuse = max_reuse
+        self.size = tuple(size)
+        self.num_processed = 0
+        self.num_reused = 0
+        self._state = None
+        self._reference = None
+        self._app_state = None
+        self._num_consecutive_reused = 0
+
+    def _thumbnail(self, frame):
+        return frame.memoize(
+            ('motion_thumbnail', self.size),
+            lambda: cv2.resize(frame.gray, self.size, interpolation=cv2.INTER_AREA).astype(np.int16))
+
+    def change_score(self, frame):
+        """Mean absolute pixel difference between a frame and the last processed frame."""
+        if self._reference is None:
+            return float('inf')
+        return float(np.mean(np.abs(self._thumbnail(frame) - self._reference)))
+
+    def process(self, state, frame):
+        """Get the app_state of a state for a frame, reusing the last one if the frame is static.
+
+        Args:
+            state (State): The current state.
+            frame (FrameContext): The frame.
+
+        Returns:
+            dict: The app_state (see State.process).
+        """
+        if frame.image is None:
+            return state.process(frame)
+        if (state is self._state and self._num_consecutive_reused < self.max_reuse
+                and self.change_score(frame) < self.threshold):
+            self._num_consecutive_reused += 1
+            self.num_reused += 1
+            app_state = dict(self._app_state)
+            app_state['raw'] = frame.image
+            return app_state
+        app_state = state.process(frame)
+        self.num_processed += 1
+        self._state = state
+        self._reference = self._thumbnail(frame)
+        self._app_state = app_state
+        self._num_consecutive_reused = 0
+        return app_state
+
+
+def _merge_instructions(instructions):
+    """Combine instructions into one, e.g. those of several transitions taken between two inputs.
+
+    Verbal instructions are joined in order, and the last image and video are kept.
+    """
+    merged = fsm.Instruction()
+    merged.audio = ' '.join(inst.audio for inst in instructions if inst.audio)
+    for inst in instructions:
+        if inst.image:
+            merged.image = inst.image
+        if inst.video:
+            merged.video = inst.video
+    return merged
 
 
 class Runner(object):
@@ -18,9 +292,24 @@ class Runner(object):
 
     A basic finite state machine runner.
     Make sure the fsm is constructed fully before creating a runner.
+
+    A runner represents one session of the FSM. The FSM (states, transitions,
+    and callables) can be shared by many runners, as each runner keeps its own
+    current state and the per-session state of stateful callables.
+
+    Timers of transition predicates (e.g. predicate_zoo.Wait) start when a
+    state is entered. Transitions that only depend on time are taken when they
+    are due, and processors are skipped in states whose transitions are all
+    time-based.
     """
 
-    def __init__(self, start_state, prepare_to_run=True):
+    # maximum number of time-based transitions taken at once, and of their
+    # instructions kept until the next feed
+    MAX_TIMER_TRANSITIONS = 100
+    # seconds to wait before retrying a due timer while the runner is busy with an input
+    TIMER_RETRY_INTERVAL = 0.01
+
+    def __init__(self, start_state, prepare_to_run=True, scheduler=None, motion_gate=None):
         """Construct a FSM runner.
 
         Args:
@@ -28,39 +317,259 @@ class Runner(object):
             prepare_to_run (bool, optional): Whether to call prepare() functions
                 on all state before running. It should be set to true unless debugging.
                 Defaults to True.
+            scheduler (TimerScheduler, optional): Scheduler to take time-based
+                transitions at their deadlines. Their instructions are returned
+                with the output of the next feed(). Without a scheduler, time-based transitions
+                are taken when an input is fed after their deadline. Defaults
+                to None.
+            motion_gate (MotionGate, optional): Gate to reuse the outputs of
+                processors for static frames. Defaults to None (processors run
+                on every frame).
         """
         super(Runner, self).__init__()
+        # per-session state of callables. See callable_zoo.session_scope
+        self._session_storage = {}
+        self._scheduler = scheduler
+        self._lock = threading.RLock()
+        self._timer = None
+        self._closed = False
+        # (deadline, transition) of time-based transitions of the current state
+        self._timer_deadlines = []
+        # instructions of time-based transitions taken since the last feed, oldest first
+        self._pending_instructions = collections.deque(maxlen=self.MAX_TIMER_TRANSITIONS)
+        self._motion_gate = motion_gate
         self.current_state = start_state
         if prepare_to_run:
             self._prepare_to_run()
 
+    @property
+    def current_state(self):
+        """The current state of the FSM."""
+        return self._current_state
+
+    @current_state.setter
+    def current_state(self, state):
+        with self._lock:
+            self._enter_state(state)
+            self._schedule_timer()
+
     def feed(self, data, debug=False):
         """Feed the FSM an input to get an output.
 
         Args:
-            data (any): Input data.
+            data (any): Input data, e.g. an image or a callable_zoo.FrameContext.
             debug (bool, optional): Defaults to False.
 
         Raises:
             ValueError: when current state is None.
 
         Returns:
-            Instruction: Instruction from the FSM.
+            Instruction: Instruction from the FSM. Instructions of time-based
+            transitions taken since the last feed are merged with it, in the
+            order the transitions were taken (see _merge_instructions).
         """
-        if self.current_state is None:
-            raise ValueError('Current State is None! Did you forget to specify transition\'s next_state?')
-        next_state, instruction = self.current_state(data)
-        self.current_state = next_state
+        with self._lock, callable_zoo.session_scope(self._session_storage):
+            self._take_due_timer_transitions()
+            if self.current_state is None:
+                raise ValueError('Current State is None! Did you forget to specify transition\'s next_state?')
+            instruction = fsm.Instruction()
+            if not self.current_state.timer_only:
+                app_state = None
+                if self._motion_gate is not None:
+                    app_state = self._motion_gate.process(self.current_state, callable_zoo.FrameContext.of(data))
+                next_state, instruction = self.current_state(data, app_state=app_state)
+                if next_state is not self.current_state:
+                    self._enter_state(next_state)
+                    self._schedule_timer()
+            if self._pending_instructions:
+                instruction = _merge_instructions(list(self._pending_instructions) + [instruction])
+                self._pending_instructions.clear()
         return instruction
 
+    def close(self):
+        """Cancel the timers of this runner."""
+        with self._lock:
+            self._closed = True
+            self._cancel_timer()
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._scheduler.cancel(self._timer)
+            self._timer = None
+
+    def _enter_state(self, state, start_time=None):
+        self._cancel_timer()
+        self._current_state = state
+        self._timer_deadlines = []
+        if state is None:
+            return
+        start_time = start_time if start_time is not None else time.time()
+        with callable_zoo.session_scope(self._session_storage):
+            state.start_timers(start_time)
+        for tran in state.transitions:
+            duration = tran.timer_duration
+            if duration is not None:
+                self._timer_deadlines.append((start_time + duration, tran))
+
+    def _schedule_timer(self):
+        """Schedule the earliest time-based transition of the current state."""
+        self._cancel_timer()
+        if self._scheduler is not None and self._timer_deadlines and not self._closed:
+            deadline = min(deadline for (deadline, _) in self._timer_deadlines)
+            self._timer = self._scheduler.schedule(deadline, self._on_timer)
+
+    def _take_due_timer_transitions(self):
+        """Take all time-based transitions that are due, including chained ones.
+
+        The timers of a state entered by a time-based transition start at the
+        transition's deadline, so that chained timers do not drift with the
+        time it takes to notice them.
+        """
+        now = time.time()
+        # bounds chains of zero-duration timers that loop back to a state
+        for num_taken in range(self.MAX_TIMER_TRANSITIONS):
+            due = [(deadline, tran) for (deadline, tran) in self._timer_deadlines if deadline <= now]
+            if not due:
+                if num_taken:
+                    self._schedule_timer()
+                return
+            deadline, tran = min(due, key=lambda item: item[0])
+            self._pending_instructions.append(tran.instruction)
+            self._enter_state(tran.next_state, start_time=deadline)
+        # the timers are not scheduled again, so that a loop does not keep the
+        # scheduler busy. The next feed resumes it.
+        self._cancel_timer()
+        logger.warning('Took {} time-based transitions at once. The FSM may have a loop of '
+                       'zero-duration timers.'.format(self.MAX_TIMER_TRANSITIONS))
+
+    def _on_timer(self):
+        # the scheduler thread is shared by all runners, so it does not wait
+        # for a runner that is busy with an input
+        if not self._lock.acquire(blocking=False):
+            self._scheduler.schedule(time.time() + self.TIMER_RETRY_INTERVAL, self._on_timer)
+            return
+        try:
+            if not self._closed:
+                self._take_due_timer_transitions()
+        finally:
+            self._lock.release()
+
     def _prepare_to_run(self):
-        """Prepare each state in the state machine to run.
+        """Prepare each state in the state machine to run."""
+        prepare(self.current_state)
+
+
+class SessionTable(object):
+    """A bounded table of sessions keyed by client.
+
+    Sessions are evicted when they have been idle for longer than
+    idle_timeout, or in least-recently-used order when the table is full.
+    """
+
+    def __init__(self, session_factory, max_sessions=256, idle_timeout=600):
+        """Construct a session table.
 
-        This allows each state to load asset from disks, start container, etc.
-        Each state's behavior should be implemented in their prepare function.
+        Args:
+            session_factory (callable): Called without arguments to create a
+                new session (e.g. a Runner) for an unseen key.
+            max_sessions (int, optional): Maximum number of sessions to keep.
+                Defaults to 256.
+            idle_timeout (float, optional): Seconds after which an idle session
+                is evicted. None disables idle eviction. Defaults to 600.
+        """
+        super(SessionTable, self).__init__()
+        if max_sessions < 1:
+            raise ValueError('max_sessions needs to be at least 1.')
+        self._session_factory = session_factory
+        self._max_sessions = max_sessions
+        self._idle_timeout = idle_timeout
+        # key -> [session, last access time], in least-recently-used order
+        self._sessions = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, key):
+        return key in self._sessions
+
+    def get(self, key):
+        """Get the session of a key, creating it if necessary.
+
+        Args:
+            key (hashable): Session key (e.g. a client id).
+
+        Returns:
+            Session created by session_factory.
         """
-        for state in fsm.StateMachine.bfs(self.current_state):
-            state.prepare()
+        now = time.monotonic()
+        self._evict_idle(now)
+        entry = self._sessions.get(key)
+        if entry is None:
+            while len(self._sessions) >= self._max_sessions:
+                evicted_key, (evicted, _) = self._sessions.popitem(last=False)
+                self._close(evicted)
+                logger.info('Session table is full. Evicted session {}.'.format(evicted_key))
+            entry = [self._session_factory(), now]
+            self._sessions[key] = entry
+        else:
+            entry[1] = now
+            self._sessions.move_to_end(key)
+        return entry[0]
+
+    def remove(self, key):
+        """Remove the session of a key if it exists."""
+        entry = self._sessions.pop(key, None)
+        if entry is not None:
+            self._close(entry[0])
+
+    def _close(self, session):
+        close_func = getattr(session, 'close', None)
+        if callable(close_func):
+            close_func()
+
+    def _evict_idle(self, now):
+        if self._idle_timeout is None:
+            return
+        while self._sessions:
+            key, (session, last_access) = next(iter(self._sessions.items()))
+            if now - last_access <= self._idle_timeout:
+                break
+            del self._sessions[key]
+            self._close(session)
+            logger.info('Evicted idle session {}.'.format(key))
+
+
+def _default_session_key(from_client):
+    """Identify the client of an input.
+
+    Gabriel clients are told apart by their source name when the protocol
+    provides one. The FromClient messages of gabriel-server 0.1.x do not
+    identify the client, so all their inputs belong to one session (None).
+    """
+    return getattr(from_client, 'source_name', None)
+
+
+def load_session_key_fn(path):
+    """Import a session_key_fn of BasicCognitiveEngineRunner.
+
+    Args:
+        path (string): Import path of the function as 'module:function',
+            e.g. 'myapp.sessions:client_id'.
+
+    Raises:
+        ValueError: when the path is not of the form module:function or does
+            not name a callable.
+
+    Returns:
+        callable: The function.
+    """
+    module_name, _, func_name = path.partition(':')
+    if not module_name or not func_name:
+        raise ValueError('Invalid session key function {}. Expected module:function.'.format(path))
+    func = getattr(importlib.import_module(module_name), func_name, None)
+    if not callable(func):
+        raise ValueError('{} is not a callable.'.format(path))
+    return func
 
 
 class BasicCognitiveEngineRunner(cognitive_engine.Engine):
@@ -71,17 +580,76 @@ class BasicCognitiveEngineRunner(cognitive_engine.Engine):
     images and the instruction output to be audio or images.
     """
 
-    def __init__(self, engine_name, fsm):
+    def __init__(self, engine_name, fsm, max_sessions=256, session_idle_timeout=600,
+                 session_key_fn=_default_session_key, log_every_n_frames=1, log_max_length=256,
+                 async_logging=False, prepare_timeout=None, warmup_iterations=0, motion_threshold=None,
+                 motion_max_reuse=5, opencv_num_threads=None):
         """Construct a Gabriel Cognitive Engine Runner.
 
+        Each client gets its own session with its own current state. All
+        sessions share the FSM and its prepared callables.
+
         Args:
             engine_name (string): Name of the cognitive engine.
             fsm (State): The start state of an FSM.
+            max_sessions (int, optional): Maximum number of concurrent
+                sessions. Least recently used sessions are evicted beyond this.
+                Defaults to 256.
+            session_idle_timeout (float, optional): Seconds after which an idle
+                session is evicted. Defaults to 600.
+            session_key_fn (callable, optional): Function that maps a gabriel
+                FromClient message to a session key. The default uses the
+                client's source name, which gabriel-server 0.1.x does not
+                send, so all clients share one session unless a function that
+                tells them apart (e.g. by their engine fields) is given.
+            log_every_n_frames (int, optional): Log the current state and
+                instruction of one in every n frames. 0 disables the per-frame
+                log. Defaults to 1.
+            log_max_length (int, optional): Maximum number of characters logged
+                for each instruction field. Images are logged by size.
+                Defaults to 256.
+            async_logging (bool, optional): Format and write logs on a
+                background thread (see logutils.enable_async_logging).
+                Defaults to False.
+            prepare_timeout (float, optional): Seconds to wait for the FSM's
+                callables to be prepared (see prepare). Defaults to None (no limit).
+            warmup_iterations (int, optional): Number of warm-up inferences of
+                each processor at startup (see warm_up). Defaults to 0.
+            motion_threshold (float, optional): Reuse processor outputs for
+                frames whose change from the last processed frame is below
+                this (see MotionGate). Defaults to None (disabled).
+            motion_max_reuse (int, optional): Maximum number of consecutive
+                frames that reuse processor outputs. Defaults to 5.
+            opencv_num_threads (int, optional): Number of threads of OpenCV,
+                e.g. of FasterRCNNOpenCVCallable. This is a process-wide
+                setting shared by all processors. Defaults to None (OpenCV's
+                setting).
         """
         super(BasicCognitiveEngineRunner, self).__init__()
         self.engine_name = engine_name
         self._fsm = fsm
-        self._fsm_runner = Runner(self._fsm)
+        if async_logging:
+            self._log_listener = logutils.enable_async_logging(logger)
+        self._log_sampler = logutils.FrameSampler(log_every_n_frames)
+        self._log_max_length = log_max_length
+        if opencv_num_threads is not None:
+            cv2.setNumThreads(int(opencv_num_threads))
+        prepare(self._fsm, timeout=prepare_timeout, warmup_iterations=warmup_iterations)
+        self._session_key_fn = session_key_fn
+        self._warned_shared_session = False
+        self._timer_scheduler = TimerScheduler()
+        self._motion_threshold = motion_threshold
+        self._motion_max_reuse = motion_max_reuse
+        self._sessions = SessionTable(
+            self._create_session,
+            max_sessions=max_sessions,
+            idle_timeout=session_idle_timeout)
+
+    def _create_session(self):
+        motion_gate = None
+        if self._motion_threshold is not None:
+            motion_gate = MotionGate(threshold=self._motion_threshold, max_reuse=self._motion_max_reuse)
+        return Runner(self._fsm, prepare_to_run=False, scheduler=self._timer_scheduler, motion_gate=motion_gate)
 
     def handle(self, from_client):
         """Do not call directly.
@@ -96,8 +664,16 @@ class BasicCognitiveEngineRunner(cognitive_engine.Engine):
 
         img_array = np.asarray(bytearray(from_client.payload), dtype=np.int8)
         img = cv2.imdecode(img_array, -1)
+        # processors may reuse the client's encoded frame (e.g. to forward it)
+        frame = callable_zoo.FrameContext(img, payload=from_client.payload)
 
-        inst = self._fsm_runner.feed(img)
+        session_key = self._session_key_fn(from_client)
+        if session_key is None and not self._warned_shared_session:
+            self._warned_shared_session = True
+            logger.warning('The input does not identify its client. All such inputs share one session. '
+                           'Pass a session_key_fn to tell clients apart.')
+        fsm_runner = self._sessions.get(session_key)
+        inst = fsm_runner.feed(frame)
 
         result_wrapper = gabriel_pb2.ResultWrapper()
         engine_fields.update_count += 1
@@ -115,8 +691,11 @@ class BasicCognitiveEngineRunner(cognitive_engine.Engine):
             result.payload = inst.audio.encode(encoding="utf-8")
             result.engine_name = self.engine_name
 
-        logger.info('Current State: {}'.format(self._fsm_runner.current_state))
-        logger.info(result_wrapper.results)
+        if self._log_sampler.sample():
+            logger.info('Current State: %s', fsm_runner.current_state)
+            logger.info('Instruction: audio: %s, image: %s',
+                        logutils.Truncated(inst.audio, self._log_max_length),
+                        logutils.Truncated(inst.image, self._log_max_length))
 
         result_wrapper.frame_id = from_client.frame_id
         result_wrapper.status = gabriel_pb2.ResultWrapper.Status.Value('SUCCESS')
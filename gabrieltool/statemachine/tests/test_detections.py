@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `statemachine` array-backed detections."""
+
+import numpy as np
+import pytest
+
+from gabrieltool.statemachine import callable_zoo
+
+
+def make_detections():
+    boxes = np.array([[0, 0, 10, 10], [5, 5, 20, 20], [1, 2, 3, 4]])
+    scores = np.array([0.9, 0.6, 0.8])
+    return callable_zoo.Detections(boxes, scores, np.array([1, 0, 1]), labels=['bolt', 'nut'])
+
+
+def test_mapping_api():
+    dets = make_detections()
+    assert 'nut' in dets and 'bolt' in dets and 'screw' not in dets
+    assert sorted(dets) == ['bolt', 'nut'] and len(dets) == 2
+    assert dets.num_detections == 3
+    assert dets['nut'] == [[0, 0, 10, 10, 0.9, 'nut'], [1, 2, 3, 4, 0.8, 'nut']]
+    assert dets['nut'][1] == [1, 2, 3, 4, 0.8, 'nut']
+    np.testing.assert_array_equal(dets['nut'].scores, [0.9, 0.8])
+    np.testing.assert_array_equal(dets['bolt'].boxes, [[5, 5, 20, 20]])
+    with pytest.raises(KeyError):
+        dets['screw']
+    assert dets == {'bolt': [[5, 5, 20, 20, 0.6, 'bolt']],
+                    'nut': [[0, 0, 10, 10, 0.9, 'nut'], [1, 2, 3, 4, 0.8, 'nut']]}
+    app_state = {'raw': None}
+    app_state.update(dets)
+    assert app_state['bolt'] == [[5, 5, 20, 20, 0.6, 'bolt']]
+
+
+def test_class_ids_as_labels():
+    dets = callable_zoo.Detections([[0, 0, 1, 1]], [0.5], [3], entry_class_ids=True)
+    assert 3 in dets and '3' not in dets
+    assert dets.to_dict() == {3: [[0, 0, 1, 1, 0.5, 3]]}
+    assert callable_zoo.Detections.empty() == {}
+
+
+def test_from_dict_round_trip():
+    results = {'cat': [[0, 0, 10, 10, 0.9, 'cat']], 'dog': [[1, 1, 5, 5, 0.7, 'dog']]}
+    dets = callable_zoo.Detections.of(results)
+    assert dets == results
+    assert callable_zoo.Detections.of(dets) is dets
+    np.testing.assert_array_equal(dets.scores, [0.9, 0.7])
+
+
+def test_from_dict_keeps_empty_labels():
+    results = {'cat': [], 'dog': [[1, 1, 5, 5, 0.7, 'dog']]}
+    dets = callable_zoo.Detections.of(results)
+    assert 'cat' in dets
+    assert dets['cat'] == [] and len(dets['cat'].scores) == 0
+    assert list(dets) == ['cat', 'dog']
+    assert dets == results
+    assert dets.to_dict() == results
+    assert callable_zoo.Detections.of({'cat': []}) == {'cat': []}
+    # model outputs have only the detected labels of their vocabulary
+    assert 'cat' not in callable_zoo.Detections([[1, 1, 5, 5]], [0.7], [1], labels=['cat', 'dog'])
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `statemachine` frame contexts."""
+
+import cv2
+import numpy as np
+
+from gabrieltool.statemachine import callable_zoo, fsm
+
+
+def test_views_are_computed_once():
+    image = np.random.randint(0, 255, (20, 30, 3), dtype=np.uint8)
+    frame = callable_zoo.FrameContext(image, payload=b'jpeg')
+    assert frame.rgb is frame.rgb
+    np.testing.assert_array_equal(frame.rgb, cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    assert frame.gray.shape == (20, 30)
+    assert frame.resized((15, 10)).shape == (10, 15, 3)
+    assert frame.resized(fx=0.5, fy=0.5) is frame.resized(fx=0.5, fy=0.5)
+    assert frame.jpeg(80) is frame.jpeg(80)
+    assert frame.jpeg(80) is not frame.jpeg(90)
+    assert cv2.imdecode(frame.jpeg(), cv2.IMREAD_COLOR).shape == image.shape
+    assert frame.payload == b'jpeg'
+    assert callable_zoo.FrameContext.of(frame) is frame
+    assert callable_zoo.FrameContext.of(image).image is image
+
+
+class RGBCallable(callable_zoo.CallableBase):
+    accepts_frame_context = True
+
+    def __call__(self, frame):
+        return {'rgb_{}'.format(id(self)): frame.rgb}
+
+
+class ImageCallable(callable_zoo.CallableBase):
+
+    def __call__(self, image):
+        return {'image_type': type(image)}
+
+
+def test_processors_share_frame_context():
+    processors = [RGBCallable(), RGBCallable(), ImageCallable()]
+    st = fsm.State(name='start', processors=[fsm.Processor(callable_obj=proc) for proc in processors])
+    image = np.zeros((4, 4, 3), dtype=np.uint8)
+    app_state = st._run_processors(image)
+    assert app_state['raw'] is image
+    assert app_state['rgb_{}'.format(id(processors[0]))] is app_state['rgb_{}'.format(id(processors[1]))]
+    assert app_state['image_type'] is np.ndarray
+
+
+def test_processor_accepts_image():
+    image = np.zeros((4, 4, 3), dtype=np.uint8)
+    assert fsm.Processor(callable_obj=ImageCallable())(image) == {'image_type': np.ndarray}
+    rgb = fsm.Processor(callable_obj=RGBCallable())(image)
+    assert list(rgb.values())[0].shape == (4, 4, 3)
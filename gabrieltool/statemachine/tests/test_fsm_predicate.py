@@ -3,7 +3,11 @@
 """Tests for `statemachine` predicates."""
 
 import time
-from gabrieltool.statemachine import predicate_zoo
+
+import numpy as np
+import pytest
+
+from gabrieltool.statemachine import callable_zoo, predicate_zoo
 
 
 def test_HasObjectClassWhileNotOthers():
@@ -44,3 +48,99 @@ def test_Wait():
     assert not predicate_obj(app_state)
     time.sleep(1)
     assert not predicate_obj(app_state)
+
+
+def make_app_state():
+    boxes = np.array([[0, 0, 40, 20], [10, 10, 20, 40], [50, 50, 60, 60]])
+    detections = callable_zoo.Detections(boxes, [0.9, 0.8, 0.4], [0, 0, 1], labels=['bolt', 'nut'])
+    app_state = {'raw': np.zeros((100, 100, 3), dtype=np.uint8)}
+    app_state.update(detections)
+    return app_state
+
+
+def test_HasObjectCount():
+    app_state = make_app_state()
+    assert predicate_zoo.HasObjectCount('bolt', min_count=2)(app_state)
+    assert not predicate_zoo.HasObjectCount('bolt', min_count=2, min_confidence=0.85)(app_state)
+    assert not predicate_zoo.HasObjectCount('bolt', max_count=1)(app_state)
+    assert predicate_zoo.HasObjectCount('screw', min_count=0, max_count=0)(app_state)
+    # lists of entries work as well
+    assert predicate_zoo.HasObjectCount('bolt', min_count=2)({'bolt': list(app_state['bolt'])})
+    predicate_obj = predicate_zoo.HasObjectCount.from_json(
+        {'class_name': 'bolt', 'min_count': '2', 'max_count': '', 'min_confidence': '0.5'})
+    assert predicate_obj.min_count == 2 and predicate_obj.max_count is None
+    assert predicate_obj(app_state)
+
+
+def test_HasObjectConfidence():
+    app_state = make_app_state()
+    assert predicate_zoo.HasObjectConfidence('bolt', min_confidence=0.85)(app_state)
+    assert not predicate_zoo.HasObjectConfidence('nut', min_confidence=0.5)(app_state)
+    assert predicate_zoo.HasObjectConfidence('nut', max_confidence=0.5)(app_state)
+
+
+def test_HasObjectArea():
+    app_state = make_app_state()
+    # bolt boxes cover 8% and 3% of the frame
+    assert predicate_zoo.HasObjectArea('bolt', min_area_ratio=0.05)(app_state)
+    assert not predicate_zoo.HasObjectArea('bolt', min_area_ratio=0.05, min_count=2)(app_state)
+    assert predicate_zoo.HasObjectArea('bolt', max_area_ratio=0.05)(app_state)
+    assert not predicate_zoo.HasObjectArea('nut', min_area_ratio=0.05)(app_state)
+
+
+def test_HasObjectAspectRatio():
+    app_state = make_app_state()
+    assert predicate_zoo.HasObjectAspectRatio('bolt', min_aspect_ratio=1.5)(app_state)
+    assert predicate_zoo.HasObjectAspectRatio('bolt', max_aspect_ratio=0.5)(app_state)
+    assert not predicate_zoo.HasObjectAspectRatio('bolt', min_aspect_ratio=0.5, max_aspect_ratio=1.5)(app_state)
+
+
+def test_spatial_predicates():
+    boxes = np.array([[10, 10, 90, 90], [20, 20, 40, 40], [60, 0, 80, 5], [85, 85, 100, 100]])
+    detections = callable_zoo.Detections(boxes, [0.9, 0.9, 0.9, 0.3], [0, 1, 1, 1], labels=['bracket', 'screw'])
+    app_state = dict(detections)
+    assert predicate_zoo.HasObjectInside('screw', 'bracket')(app_state)
+    assert not predicate_zoo.HasObjectInside('bracket', 'screw')(app_state)
+    assert predicate_zoo.HasObjectOverlap('screw', 'bracket', min_iou=0.05)(app_state)
+    assert not predicate_zoo.HasObjectOverlap('screw', 'bracket', min_iou=0.5)(app_state)
+    assert predicate_zoo.HasObjectPosition('screw', 'bracket', 'above')(app_state)
+    assert not predicate_zoo.HasObjectPosition('screw', 'bracket', 'left_of')(app_state)
+    # the low-confidence screw is the only one below and right of the bracket
+    assert predicate_zoo.HasObjectPosition('screw', 'bracket', 'below')(app_state)
+    assert not predicate_zoo.HasObjectPosition('screw', 'bracket', 'below', min_confidence=0.5)(app_state)
+    # objects of the same class are not paired with themselves
+    assert not predicate_zoo.HasObjectOverlap('bracket', 'bracket')(app_state)
+    assert predicate_zoo.HasObjectPosition('screw', 'screw', 'left_of')(app_state)
+    assert not predicate_zoo.HasObjectInside('screw', 'nut')(app_state)
+    with pytest.raises(ValueError):
+        predicate_zoo.HasObjectPosition('screw', 'bracket', 'behind')
+
+
+def test_HasObjectInRecentFrames():
+    predicate_obj = predicate_zoo.HasObjectInRecentFrames('bolt', min_frames=2, num_frames=3)
+    for present, expected in [(True, False), (False, False), (True, True), (True, True),
+                              (False, True), (False, False)]:
+        app_state = {'bolt': [[0, 0, 1, 1, 0.9, 'bolt']]} if present else {}
+        predicate_obj.observe(app_state)
+        assert predicate_obj(app_state) == expected
+    predicate_obj.start_timer()
+    assert not predicate_obj({})
+
+
+def test_HasObjectForDuration():
+    present = {'bolt': [[0, 0, 1, 1, 0.9, 'bolt']]}
+    predicate_obj = predicate_zoo.HasObjectForDuration('bolt', duration=0.05)
+    absent_predicate_obj = predicate_zoo.HasNoObjectForDuration('bolt', duration=0.05)
+    for app_state in (present, present):
+        predicate_obj.observe(app_state)
+        absent_predicate_obj.observe(app_state)
+        time.sleep(0.03)
+    assert predicate_obj(present)
+    assert not absent_predicate_obj(present)
+    # a frame without the object restarts the time
+    predicate_obj.observe({})
+    absent_predicate_obj.observe({})
+    assert not predicate_obj({})
+    time.sleep(0.06)
+    absent_predicate_obj.observe({})
+    assert absent_predicate_obj({})
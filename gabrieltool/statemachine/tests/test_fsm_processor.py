@@ -5,6 +5,8 @@
 import os
 
 import cv2
+import numpy as np
+import pytest
 
 from gabrieltool.statemachine import processor_zoo
 
@@ -44,3 +46,167 @@ def test_FasterRCNNOpenCVProcessor():
                 drawPred(im, cls_name, confidence, left, top, right, bottom)
         cv2.imwrite('tested.jpg', im)
         assert("ham" in app_state)
+
+
+class _EmptyNet(object):
+    """Stands in for a Caffe model, which not every OpenCV build can load."""
+
+    def setPreferableBackend(self, backend_id):
+        pass
+
+    def setPreferableTarget(self, target_id):
+        pass
+
+    def getLayerNames(self):
+        return []
+
+    def getUnconnectedOutLayers(self):
+        return []
+
+
+def test_FasterRCNNOpenCVCallable_from_json(monkeypatch):
+    monkeypatch.setattr(cv2.dnn, 'readNetFromCaffe', lambda proto_path, model_path: _EmptyNet(), raising=False)
+    # default arguments of the editor
+    proc = processor_zoo.FasterRCNNOpenCVCallable.from_json({
+        'proto_path': '', 'model_path': '', 'labels': 'None', 'conf_threshold': '0.8',
+        'backend': 'default', 'target': 'cpu'})
+    assert proc._labels is None
+    assert proc._conf_threshold == 0.8
+    # num_threads of older versions is process-wide, and is ignored
+    proc = processor_zoo.FasterRCNNOpenCVCallable.from_json({
+        'proto_path': '', 'model_path': '', 'labels': ['ham'], 'conf_threshold': '0.5', 'num_threads': '2'})
+    assert proc._labels == ['ham']
+    assert 'num_threads' not in proc.kwargs
+    with pytest.raises(ValueError):
+        processor_zoo.FasterRCNNOpenCVCallable.from_json({
+            'proto_path': '', 'model_path': '', 'conf_threshold': 'high'})
+
+
+def _make_onnx_detector(model_path):
+    """Make an ONNX model that outputs two fixed detections for any input image."""
+    onnx = pytest.importorskip('onnx')
+    from onnx import helper, TensorProto
+    constants = {
+        'detection_boxes': (TensorProto.FLOAT, [1, 2, 4], [0.1, 0.2, 0.5, 0.6, 0., 0., 1., 1.]),
+        'detection_scores': (TensorProto.FLOAT, [1, 2], [0.9, 0.3]),
+        'detection_classes': (TensorProto.FLOAT, [1, 2], [1., 2.]),
+    }
+    nodes = [helper.make_node('Constant', [], [name], value=helper.make_tensor(name, *value))
+             for (name, value) in constants.items()]
+    graph = helper.make_graph(
+        nodes, 'detector',
+        [helper.make_tensor_value_info('input_tensor', TensorProto.UINT8, [1, None, None, 3])],
+        [helper.make_tensor_value_info(name, value[0], value[1]) for (name, value) in constants.items()])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    model.ir_version = 7
+    onnx.save(model, model_path)
+
+
+def test_ONNXRuntimeCallable(tmpdir):
+    pytest.importorskip('onnxruntime')
+    model_path = os.path.join(tmpdir.strpath, 'detector.onnx')
+    _make_onnx_detector(model_path)
+    proc = processor_zoo.ONNXRuntimeCallable(model_path=model_path, conf_threshold=0.5)
+    image = np.zeros((100, 200, 3), dtype=np.uint8)
+    app_state = proc(image)
+    assert list(app_state.keys()) == ['1']
+    (x1, y1, x2, y2, confidence, label), = app_state['1']
+    assert (x1, y1, x2, y2, label) == (40, 10, 120, 50, '1')
+    assert confidence == pytest.approx(0.9)
+
+
+def test_ONNXRuntimeCallable_from_minimal_json(tmpdir):
+    pytest.importorskip('onnxruntime')
+    model_path = os.path.join(tmpdir.strpath, 'detector.onnx')
+    _make_onnx_detector(model_path)
+    # json without the optional arguments, e.g. exported by older versions
+    proc = processor_zoo.ONNXRuntimeCallable.from_json({'model_path': model_path})
+    assert proc.conf_threshold == 0.5
+    assert proc.kwargs['intra_op_num_threads'] == 1 and proc.kwargs['inter_op_num_threads'] == 1
+
+
+def _make_saved_model(serving_dir):
+    """Make a TF 1.x SavedModel that outputs two fixed detections for any input image."""
+    tf = pytest.importorskip('tensorflow')
+    if tf.executing_eagerly():
+        pytest.skip('needs TensorFlow 1.x to build the test model')
+    with tf.Graph().as_default(), tf.compat.v1.Session() as sess:
+        inputs = tf.compat.v1.placeholder(tf.uint8, shape=[None, None, None, 3], name='inputs')
+        batch = tf.shape(inputs)[:1]
+        outputs = {
+            'detection_boxes': tf.tile(tf.constant([[[0.1, 0.2, 0.5, 0.6], [0., 0., 1., 1.]]]),
+                                       tf.concat([batch, [1, 1]], 0)),
+            'detection_scores': tf.tile(tf.constant([[0.9, 0.3]]), tf.concat([batch, [1]], 0)),
+            'detection_classes': tf.tile(tf.constant([[1., 2.]]), tf.concat([batch, [1]], 0)),
+        }
+        tf.compat.v1.saved_model.simple_save(
+            sess, os.path.join(serving_dir, '1'), inputs={'inputs': inputs}, outputs=outputs)
+
+
+def test_SavedModelCallable(tmpdir):
+    serving_dir = os.path.join(tmpdir.strpath, 'saved_model')
+    _make_saved_model(serving_dir)
+    proc = processor_zoo.SavedModelCallable(model_name='test', serving_dir=serving_dir, conf_threshold=0.5)
+    other_proc = processor_zoo.SavedModelCallable(model_name='test', serving_dir=serving_dir)
+    proc.prepare()
+    other_proc.prepare()
+    assert proc.model is other_proc.model
+    app_state = proc(np.zeros((100, 200, 3), dtype=np.uint8))
+    assert list(app_state.keys()) == ['1']
+    (x1, y1, x2, y2, confidence, label), = app_state['1']
+    assert (x1, y1, x2, y2, label) == (40, 10, 120, 50, '1')
+
+
+def test_decode_detections():
+    from gabrieltool.statemachine.callable_zoo.processor_zoo import containerized
+    expected = [['cat', [1, 2, 3, 4], 0.9]]
+    assert containerized.decode_detections('[["cat", [1, 2, 3, 4], 0.9]]') == expected
+    assert [list(det) for det in containerized.decode_detections("[('cat', [1, 2, 3, 4], 0.9)]")] == expected
+
+
+class FakeContainer(object):
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.status = None
+
+    def reload(self):
+        self.status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+
+    def logs(self, tail=None):
+        return b'fake logs'
+
+
+def test_wait_until_container_ready():
+    from gabrieltool.statemachine.callable_zoo.processor_zoo import containerized
+    manager = containerized.SingletonContainerManager('GABRIELTOOL-test')
+    probes = []
+
+    def ready_check(container):
+        probes.append(container.status)
+        if len(probes) < 3:
+            raise IOError('connection refused')
+        return True
+
+    manager.wait_until_ready(FakeContainer(['created', 'running']), ready_check=ready_check,
+                             initial_interval=0.01)
+    assert probes == ['running'] * 3
+
+    with pytest.raises(RuntimeError, match='fake logs'):
+        manager.wait_until_ready(FakeContainer(['running', 'exited']), ready_check=lambda _: False,
+                                 initial_interval=0.01)
+    with pytest.raises(RuntimeError, match='not ready'):
+        manager.wait_until_ready(FakeContainer(['running']), ready_check=lambda _: False,
+                                 timeout=0.1, initial_interval=0.01)
+
+
+def test_is_port_open():
+    import socket
+    from gabrieltool.statemachine.callable_zoo.processor_zoo import containerized
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    port = server.getsockname()[1]
+    assert containerized.is_port_open('127.0.0.1', port)
+    server.close()
+    assert not containerized.is_port_open('127.0.0.1', port)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `statemachine` logging utilities."""
+
+import logging
+
+from gabrieltool.statemachine import logutils
+
+
+def test_truncate():
+    assert logutils.truncate(b'\x00' * 1000) == '<1000 bytes>'
+    assert logutils.truncate('a' * 10, max_length=4) == 'aaaa...<6 more chars>'
+    assert logutils.truncate(['text', b'\x00\x01']) == '[text, <2 bytes>]'
+
+
+def test_FrameSampler():
+    sampler = logutils.FrameSampler(every_n_frames=3)
+    assert [sampler.sample() for _ in range(6)] == [False, False, True, False, False, True]
+    assert not logutils.FrameSampler(every_n_frames=0).sample()
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+
+def test_enable_async_logging():
+    test_logger = logging.getLogger('test_enable_async_logging')
+    test_logger.setLevel(logging.INFO)
+    handler = ListHandler()
+    test_logger.addHandler(handler)
+    listener = logutils.enable_async_logging(test_logger)
+    assert handler not in test_logger.handlers
+    test_logger.info('payload: %s', logutils.Truncated(b'\x00' * 10))
+    listener.stop()
+    assert handler.messages == ['payload: <10 bytes>']
+    assert handler in test_logger.handlers
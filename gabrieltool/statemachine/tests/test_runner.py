@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `statemachine` runners."""
+
+import time
+
+import cv2
+import numpy as np
+import pytest
+from gabriel_protocol import gabriel_pb2
+from gabriel_server import cognitive_engine
+from gabrieltool.statemachine import callable_zoo, fsm, instruction_pb2, predicate_zoo, runner
+
+
+@pytest.fixture
+def wait_fsm():
+    st_end = fsm.State(name='end')
+    st_start = fsm.State(
+        name='start',
+        transitions=[fsm.Transition(
+            name='tran_wait',
+            predicates=[fsm.TransitionPredicate(
+                callable_obj=predicate_zoo.Wait(wait_time=0.5))],
+            instruction=fsm.Instruction(audio='done waiting'),
+            next_state=st_end
+        )]
+    )
+    return st_start
+
+
+class CountingCallable(callable_zoo.CallableBase):
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def __call__(self, image):
+        self.count += 1
+        return {}
+
+
+def test_sessions_are_isolated(wait_fsm):
+    runner_a = runner.Runner(wait_fsm)
+    assert runner_a.feed(None).audio == ''
+    time.sleep(0.6)
+    # runner_b starts waiting when it is created
+    runner_b = runner.Runner(wait_fsm, prepare_to_run=False)
+    assert runner_b.feed(None).audio == ''
+    assert runner_a.feed(None).audio == 'done waiting'
+    assert runner_a.current_state.name == 'end'
+    assert runner_b.current_state.name == 'start'
+
+
+def test_timer_only_state_skips_processors(wait_fsm):
+    counting_callable = CountingCallable()
+    wait_fsm.processors = [fsm.Processor(callable_obj=counting_callable)]
+    fsm_runner = runner.Runner(wait_fsm)
+    assert fsm_runner.feed(None).audio == ''
+    assert counting_callable.count == 0
+
+
+def test_scheduler_takes_timer_transition_without_input(wait_fsm):
+    fsm_runner = runner.Runner(wait_fsm, scheduler=runner.TimerScheduler())
+    time.sleep(0.7)
+    assert fsm_runner.current_state.name == 'end'
+    assert fsm_runner.feed(None).audio == 'done waiting'
+    assert fsm_runner.feed(None).audio == ''
+
+
+def test_chained_timer_transitions_keep_every_instruction():
+    st_c = fsm.State(name='c')
+    st_b = fsm.State(name='b', transitions=[fsm.Transition(
+        predicates=[fsm.TransitionPredicate(callable_obj=predicate_zoo.Wait(wait_time=0.1))],
+        instruction=fsm.Instruction(audio='to c'), next_state=st_c)])
+    st_a = fsm.State(name='a', transitions=[fsm.Transition(
+        predicates=[fsm.TransitionPredicate(callable_obj=predicate_zoo.Wait(wait_time=0.1))],
+        instruction=fsm.Instruction(audio='to b'), next_state=st_b)])
+    for scheduler in (runner.TimerScheduler(), None):
+        fsm_runner = runner.Runner(st_a, scheduler=scheduler)
+        time.sleep(0.5)
+        assert fsm_runner.feed(None).audio == 'to b to c'
+        assert fsm_runner.current_state is st_c
+        assert fsm_runner.feed(None).audio == ''
+    # the timer of b starts at the deadline of a's timer, not when it is noticed
+    fsm_runner = runner.Runner(st_a)
+    fsm_runner._enter_state(st_a, start_time=time.time() - 0.25)
+    fsm_runner._take_due_timer_transitions()
+    assert fsm_runner.current_state is st_c
+
+
+def test_frame_is_processed_with_timer_instructions():
+    counting_callable = CountingCallable()
+    st_b = fsm.State(name='b', processors=[fsm.Processor(callable_obj=counting_callable)])
+    st_a = fsm.State(name='a', transitions=[fsm.Transition(
+        predicates=[fsm.TransitionPredicate(callable_obj=predicate_zoo.Wait(wait_time=0.1))],
+        instruction=fsm.Instruction(audio='to b'), next_state=st_b)])
+    fsm_runner = runner.Runner(st_a, scheduler=runner.TimerScheduler())
+    time.sleep(0.3)
+    assert fsm_runner.feed(np.zeros((4, 4, 3), dtype=np.uint8)).audio == 'to b'
+    assert counting_callable.count == 1
+
+
+def test_zero_duration_timer_loop_is_bounded():
+    st_x = fsm.State(name='x')
+    st_y = fsm.State(name='y', transitions=[fsm.Transition(
+        predicates=[fsm.TransitionPredicate(callable_obj=predicate_zoo.Wait(wait_time=0))],
+        instruction=fsm.Instruction(audio='to x'), next_state=st_x)])
+    st_x.transitions = [fsm.Transition(
+        predicates=[fsm.TransitionPredicate(callable_obj=predicate_zoo.Wait(wait_time=0))],
+        instruction=fsm.Instruction(audio='to y'), next_state=st_y)]
+    fsm_runner = runner.Runner(st_x, scheduler=runner.TimerScheduler())
+    time.sleep(0.2)
+    # the loop stops rescheduling itself once it hits the limit
+    assert len(fsm_runner._pending_instructions) == runner.Runner.MAX_TIMER_TRANSITIONS
+    assert fsm_runner._timer is None
+    assert len(fsm_runner.feed(None).audio.split()) == 2 * runner.Runner.MAX_TIMER_TRANSITIONS
+    assert not fsm_runner._pending_instructions
+
+
+def test_busy_runner_does_not_delay_other_timers(wait_fsm):
+    scheduler = runner.TimerScheduler()
+    busy_runner = runner.Runner(wait_fsm, scheduler=scheduler)
+    other_runner = runner.Runner(wait_fsm, prepare_to_run=False, scheduler=scheduler)
+    # as if busy_runner was processing an input
+    with busy_runner._lock:
+        time.sleep(0.7)
+        assert other_runner.current_state.name == 'end'
+        assert busy_runner.current_state.name == 'start'
+    time.sleep(0.1)
+    assert busy_runner.current_state.name == 'end'
+
+
+def test_closed_runner_does_not_take_timer_transition(wait_fsm):
+    fsm_runner = runner.Runner(wait_fsm, scheduler=runner.TimerScheduler())
+    fsm_runner.close()
+    time.sleep(0.7)
+    assert fsm_runner.current_state.name == 'start'
+
+
+def _from_client(image, update_count=0):
+    from_client = gabriel_pb2.FromClient()
+    from_client.frame_id = 1
+    from_client.payload_type = gabriel_pb2.PayloadType.Value('IMAGE')
+    from_client.payload = cv2.imencode('.jpg', image)[1].tobytes()
+    from_client.engine_fields.Pack(instruction_pb2.EngineFields(update_count=update_count))
+    return from_client
+
+
+def client_key(from_client):
+    return cognitive_engine.unpack_engine_fields(instruction_pb2.EngineFields, from_client).update_count
+
+
+def test_default_session_key_of_from_client():
+    # gabriel's FromClient does not identify the client
+    assert runner._default_session_key(_from_client(np.zeros((4, 4, 3), dtype=np.uint8))) is None
+
+
+def test_load_session_key_fn():
+    assert runner.load_session_key_fn('gabrieltool.statemachine.runner:load_session_key_fn') \
+        is runner.load_session_key_fn
+    with pytest.raises(ValueError):
+        runner.load_session_key_fn('gabrieltool.statemachine.runner')
+    with pytest.raises(ValueError):
+        runner.load_session_key_fn('gabrieltool.statemachine.runner:missing')
+
+
+def test_cognitive_engine_sessions(wait_fsm, monkeypatch):
+    warnings = []
+    monkeypatch.setattr(runner.logger, 'warning', lambda msg, *args: warnings.append(msg))
+    image = np.zeros((32, 32, 3), dtype=np.uint8)
+
+    # gabriel's FromClient does not identify the client, so all inputs share a session
+    engine = runner.BasicCognitiveEngineRunner('test', wait_fsm)
+    assert engine.handle(_from_client(image)).status == gabriel_pb2.ResultWrapper.Status.Value('SUCCESS')
+    engine.handle(_from_client(image, update_count=1))
+    assert len(engine._sessions) == 1
+    assert None in engine._sessions
+    assert len(warnings) == 1
+
+    warnings.clear()
+    engine = runner.BasicCognitiveEngineRunner('test', wait_fsm, session_key_fn=client_key)
+    engine.handle(_from_client(image))
+    engine.handle(_from_client(image, update_count=1))
+    assert len(engine._sessions) == 2
+    assert not warnings
+
+
+def test_cognitive_engine_sets_opencv_threads(wait_fsm):
+    num_threads = cv2.getNumThreads()
+    try:
+        runner.BasicCognitiveEngineRunner('test', wait_fsm, opencv_num_threads=2)
+        assert cv2.getNumThreads() == 2
+    finally:
+        cv2.setNumThreads(num_threads)
+
+
+def test_session_table_evicts_least_recently_used():
+    created = []
+    table = runner.SessionTable(lambda: created.append(1) or len(created), max_sessions=2)
+    assert table.get('a') == 1
+    assert table.get('b') == 2
+    assert table.get('a') == 1
+    assert table.get('c') == 3
+    assert len(table) == 2
+    assert 'b' not in table
+    assert 'a' in table
+
+
+def test_session_table_evicts_idle_sessions():
+    table = runner.SessionTable(object, max_sessions=10, idle_timeout=0.1)
+    session = table.get('a')
+    assert table.get('a') is session
+    time.sleep(0.2)
+    table.get('b')
+    assert 'a' not in table
+    assert len(table) == 1
+
+
+class SubmittingCallable(CountingCallable):
+
+    def __init__(self, events):
+        super().__init__()
+        self.events = events
+
+    def submit(self, image):
+        self.events.append('submit')
+        outer = self
+
+        class _Future(object):
+            def result(self, timeout=None):
+                outer.events.append('result')
+                return {'submitted': True}
+        return _Future()
+
+
+def test_processors_are_submitted_first():
+    events = []
+
+    class Recording(CountingCallable):
+        def __call__(self, image):
+            events.append('call')
+            return super().__call__(image)
+
+    st = fsm.State(name='start', processors=[
+        fsm.Processor(callable_obj=Recording()),
+        fsm.Processor(callable_obj=SubmittingCallable(events)),
+    ])
+    app_state = st._run_processors(None)
+    assert events == ['submit', 'call', 'result']
+    assert app_state['submitted']
+
+
+class SlowPreparingCallable(callable_zoo.CallableBase):
+
+    def __init__(self, seconds):
+        super().__init__()
+        self.seconds = seconds
+        self.num_prepared = 0
+
+    def prepare(self):
+        time.sleep(self.seconds)
+        self.num_prepared += 1
+
+    def __call__(self, image):
+        return {}
+
+
+def test_prepare_is_concurrent_and_deduplicated():
+    shared = SlowPreparingCallable(0.3)
+    other = SlowPreparingCallable(0.3)
+    st_end = fsm.State(name='end', processors=[fsm.Processor(callable_obj=shared)])
+    st_start = fsm.State(
+        name='start',
+        processors=[fsm.Processor(callable_obj=shared), fsm.Processor(callable_obj=other)],
+        transitions=[fsm.Transition(predicates=[fsm.TransitionPredicate()], next_state=st_end)])
+    start_time = time.monotonic()
+    runner.prepare(st_start)
+    assert time.monotonic() - start_time < 0.5
+    assert (shared.num_prepared, other.num_prepared) == (1, 1)
+
+
+def test_prepare_timeout():
+    st = fsm.State(name='start', processors=[fsm.Processor(callable_obj=SlowPreparingCallable(1))])
+    with pytest.raises(TimeoutError, match='SlowPreparingCallable'):
+        runner.prepare(st, timeout=0.1)
+
+
+class ShapeRecordingCallable(callable_zoo.CallableBase):
+    warmup_input_shape = (4, 5, 3)
+
+    def __init__(self):
+        super().__init__()
+        self.shapes = []
+
+    def __call__(self, image):
+        self.shapes.append(image.shape)
+        return {}
+
+
+def test_prepare_warms_up_processors():
+    counting = CountingCallable()
+    shaped = ShapeRecordingCallable()
+    st = fsm.State(name='start', processors=[fsm.Processor(callable_obj=counting),
+                                             fsm.Processor(callable_obj=shaped)])
+    runner.prepare(st, warmup_iterations=2, warmup_image_shape=(8, 8, 3))
+    assert counting.count == 2
+    assert shaped.shapes == [(4, 5, 3), (4, 5, 3)]
+
+
+def test_motion_gate_reuses_outputs_of_static_frames():
+    counting = CountingCallable()
+    st = fsm.State(name='start', processors=[fsm.Processor(callable_obj=counting)])
+    gate = runner.MotionGate(threshold=2.0, max_reuse=2)
+    fsm_runner = runner.Runner(st, motion_gate=gate)
+    image = np.full((48, 64, 3), 100, dtype=np.uint8)
+    for _ in range(4):
+        fsm_runner.feed(image.copy())
+    # the first frame is processed, two are reused, and outputs are then refreshed
+    assert counting.count == 2
+    fsm_runner.feed(np.full((48, 64, 3), 200, dtype=np.uint8))
+    assert counting.count == 3
+    assert (gate.num_processed, gate.num_reused) == (3, 2)
+
+
+class ScriptedCallable(callable_zoo.CallableBase):
+
+    def __init__(self, outputs):
+        super().__init__()
+        self.outputs = iter(outputs)
+
+    def __call__(self, image):
+        return next(self.outputs)
+
+
+def test_temporal_predicates_observe_every_frame():
+    bolt = {'bolt': [[0, 0, 1, 1, 0.9, 'bolt']]}
+    st_end = fsm.State(name='end')
+    st_start = fsm.State(
+        name='start',
+        processors=[fsm.Processor(callable_obj=ScriptedCallable([bolt, bolt, dict(bolt, nut=[])]))],
+        transitions=[fsm.Transition(
+            predicates=[fsm.TransitionPredicate(callable_obj=predicate_zoo.HasObjectClass('nut')),
+                        fsm.TransitionPredicate(callable_obj=predicate_zoo.HasObjectInRecentFrames(
+                            'bolt', min_frames=3, num_frames=3))],
+            next_state=st_end)])
+    fsm_runner = runner.Runner(st_start)
+    image = np.zeros((4, 4, 3), dtype=np.uint8)
+    fsm_runner.feed(image)
+    fsm_runner.feed(image)
+    assert fsm_runner.current_state is st_start
+    # the window was updated while 'nut' was missing
+    fsm_runner.feed(image)
+    assert fsm_runner.current_state is st_end
+
+    # a predicate shared by two transitions observes each frame once
+    recent_bolts = predicate_zoo.HasObjectInRecentFrames('bolt', min_frames=2, num_frames=2)
+    st_shared = fsm.State(
+        name='shared',
+        processors=[fsm.Processor(callable_obj=ScriptedCallable([bolt, bolt]))],
+        transitions=[fsm.Transition(predicates=[fsm.TransitionPredicate(callable_obj=recent_bolts)],
+                                    next_state=st_end) for _ in range(2)])
+    fsm_runner = runner.Runner(st_shared)
+    fsm_runner.feed(image)
+    assert fsm_runner.current_state is st_shared
+    fsm_runner.feed(image)
+    assert fsm_runner.current_state is st_end
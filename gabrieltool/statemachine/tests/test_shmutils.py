@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `statemachine` shared-memory frame transport."""
+
+import os
+
+import numpy as np
+import pytest
+
+from gabrieltool.statemachine.callable_zoo.processor_zoo import shmutils
+
+
+def test_SharedFrameRing(tmpdir):
+    ring = shmutils.SharedFrameRing(100, num_slots=2, directory=str(tmpdir))
+    image = np.arange(60, dtype=np.uint8).reshape((4, 5, 3))
+    slot = ring.write(image)
+    frame = shmutils.read_frame(slot.ref)
+    np.testing.assert_array_equal(frame, image)
+    assert not frame.flags.writeable
+    other = ring.write(image + 1)
+    assert other.ref['offset'] != slot.ref['offset']
+    # all slots are in use
+    with pytest.raises(TimeoutError):
+        ring.write(image, timeout=0.01)
+    slot.release()
+    assert ring.write(image, timeout=0.01).ref['offset'] == slot.ref['offset']
+    with pytest.raises(ValueError):
+        ring.write(np.zeros(ring.slot_size + 1, dtype=np.uint8))
+
+
+def test_SharedFrameWriter_grows_ring(tmpdir):
+    writer = shmutils.SharedFrameWriter(num_slots=1, directory=str(tmpdir))
+    small = writer.write(np.zeros((4, 4), dtype=np.uint8))
+    large = writer.write(np.ones((8192, 2), dtype=np.uint8))
+    assert large.ref['path'] != small.ref['path']
+    assert os.path.exists(small.ref['path'])
+    # the replaced ring is removed when its frame is released
+    small.release()
+    assert not os.path.exists(small.ref['path'])
+    np.testing.assert_array_equal(shmutils.read_frame(large.ref), 1)
+    large.release()
+    writer.close()
+    assert not os.path.exists(large.ref['path'])
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `statemachine` stand-in model servers."""
+
+import numpy as np
+import pytest
+
+from gabrieltool.statemachine.callable_zoo.processor_zoo import containerized, shmutils, standins, tfutils
+
+
+@pytest.fixture
+def local_containers(monkeypatch):
+    monkeypatch.setattr(containerized.FasterRCNNContainerCallable, 'CONTAINER_MANAGER_CLASS',
+                        standins.LocalContainerManager)
+    monkeypatch.setattr(standins.LocalContainerManager, 'script', [
+        [{'label': 'cat', 'box': [0, 0, 0.5, 0.5], 'confidence': 0.9}],
+        [{'label': 'cat', 'box': [0, 0, 0.5, 0.5], 'confidence': 0.3}],
+    ])
+    yield
+    containerized.FasterRCNNContainerCallable.CONTAINER_MANAGER_CLASS(
+        containerized.FasterRCNNContainerCallable.CONTAINER_NAME).clean()
+
+
+def test_FasterRCNNContainerCallable_with_standin(local_containers):
+    proc = containerized.FasterRCNNContainerCallable('standin-image', conf_threshold=0.5)
+    image = np.zeros((100, 200, 3), dtype=np.uint8)
+    assert proc(image) == {'cat': [[0, 0, 100, 50, 0.9, 'cat']]}
+    # the second scripted detection is below the threshold
+    assert proc(image) == {}
+    proc.clean()
+    assert proc.container_server_url is None
+
+
+def test_parse_form():
+    picture = bytes(range(256)) + b'\r\n\r\n--\r\n' + bytes(range(256))
+    body = (b'--boundary\r\nContent-Disposition: form-data; name="confidence"\r\n\r\n0.5\r\n'
+            b'--boundary\r\nContent-Disposition: form-data; name="picture"; filename="frame.jpg"\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n' + picture + b'\r\n--boundary--\r\n')
+    form = standins._parse_form('multipart/form-data; boundary=boundary', body)
+    assert form == {'confidence': b'0.5', 'picture': picture}
+    form = standins._parse_form('application/x-www-form-urlencoded', b'confidence=0.5&frame_ref=%7B%22a%22%3A+1%7D')
+    assert form == {'confidence': b'0.5', 'frame_ref': b'{"a": 1}'}
+
+
+def test_TFServingServer():
+    server = standins.TFServingServer(script=[
+        [{'label': '2', 'box': [0, 0, 0.5, 0.5], 'confidence': 0.9}],
+        [],
+    ]).start()
+    try:
+        assert tfutils.is_model_available('127.0.0.1', server.port, 'model')
+        predictor = tfutils.TFServingPredictor('127.0.0.1', server.port)
+        images = np.zeros((2, 10, 20, 3), dtype=np.uint8)
+        results = predictor.infer('model', images)
+        assert results == [{'2': [[0, 0, 10, 5, pytest.approx(0.9), '2']]}, {}]
+    finally:
+        server.stop()
+
+
+def test_FasterRCNNContainerCallable_with_shared_memory(local_containers):
+    proc = containerized.FasterRCNNContainerCallable('standin-image', conf_threshold=0.5, shared_memory=True)
+    image = np.zeros((100, 200, 3), dtype=np.uint8)
+    assert proc(image) == {'cat': [[0, 0, 100, 50, 0.9, 'cat']]}
+    proc.clean()
+
+
+def test_TFServingServer_with_shared_memory():
+    server = standins.TFServingServer(script=[[{'label': '2', 'box': [0, 0, 0.5, 0.5], 'confidence': 0.9}]]).start()
+    ring = shmutils.SharedFrameRing(10 * 20 * 3, num_slots=1)
+    try:
+        predictor = tfutils.TFServingPredictor('127.0.0.1', server.port)
+        slot = ring.write(np.zeros((10, 20, 3), dtype=np.uint8))
+        results = predictor.infer_shared_future('model', [slot.ref]).result()
+        assert results == [{'2': [[0, 0, 10, 5, pytest.approx(0.9), '2']]}]
+    finally:
+        ring.close()
+        slot.release()
+        server.stop()
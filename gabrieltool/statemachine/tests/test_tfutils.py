@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `statemachine` TF serving utilities."""
+
+import numpy as np
+import pytest
+from tensorflow.core.framework import tensor_pb2, types_pb2
+from tensorflow_serving.apis import predict_pb2
+
+from gabrieltool.statemachine.callable_zoo.processor_zoo import detutils, tfutils
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.float32, np.int64, np.float16])
+def test_tensor_proto_round_trip(dtype):
+    array = (np.arange(24) % 7).astype(dtype).reshape(1, 2, 4, 3)
+    tensor = tfutils.make_tensor_proto(array, tensor_pb2.TensorProto())
+    assert [dim.size for dim in tensor.tensor_shape.dim] == [1, 2, 4, 3]
+    np.testing.assert_array_equal(tfutils.make_ndarray(tensor), array)
+
+
+def test_make_tensor_proto_matches_tensorflow():
+    tf = pytest.importorskip('tensorflow')
+    image = np.random.randint(0, 255, (1, 4, 5, 3), dtype=np.uint8)
+    tensor = tfutils.make_tensor_proto(image, tensor_pb2.TensorProto())
+    assert tensor == tf.make_tensor_proto(image)
+
+
+def test_make_ndarray_typed_values():
+    tensor = tensor_pb2.TensorProto(dtype=types_pb2.DT_FLOAT, float_val=[0.5, 1.5])
+    tensor.tensor_shape.dim.add(size=2)
+    np.testing.assert_array_equal(tfutils.make_ndarray(tensor), np.array([0.5, 1.5], dtype=np.float32))
+    # a single value fills the tensor
+    tensor = tensor_pb2.TensorProto(dtype=types_pb2.DT_INT32, int_val=[3])
+    tensor.tensor_shape.dim.add(size=2)
+    tensor.tensor_shape.dim.add(size=2)
+    np.testing.assert_array_equal(tfutils.make_ndarray(tensor), np.full((2, 2), 3, dtype=np.int32))
+
+
+def test_parse_tf_detection_batch():
+    boxes = np.array([[[0.1, 0.2, 0.5, 0.6], [0., 0., 1., 1.]],
+                      [[0., 0., 0.5, 0.5], [0.5, 0.5, 1., 1.]]], dtype=np.float32)
+    scores = np.array([[0.9, 0.3], [0.6, 0.7]], dtype=np.float32)
+    classes = np.array([[1, 2], [3, 3]])
+    results = detutils.parse_tf_detection_batch(boxes, scores, classes, [(100, 200, 3), (10, 10, 3)])
+    assert list(results[0].keys()) == ['1']
+    assert results[0]['1'][0][:4] == [40, 10, 120, 50]
+    assert [det[:4] for det in results[1]['3']] == [[0, 0, 5, 5], [5, 5, 10, 10]]
+    assert detutils.parse_tf_detections(boxes, scores, classes, (10, 10, 3), image_idx=1) == results[1]
+
+
+def test_channels_are_shared_per_server():
+    assert tfutils.get_channel('localhost', 8500) is tfutils.get_channel('localhost', '8500')
+    assert tfutils.get_channel('localhost', 8500) is not tfutils.get_channel('localhost', 8501)
+
+
+class _DoneFuture(object):
+
+    def __init__(self, response):
+        self.response = response
+
+    def done(self):
+        return True
+
+    def result(self, timeout=None):
+        return self.response
+
+
+def test_detection_future():
+    response = predict_pb2.PredictResponse()
+    tfutils.make_tensor_proto(np.array([[[0., 0., 0.5, 0.5]]], dtype=np.float32),
+                              response.outputs['detection_boxes'])
+    tfutils.make_tensor_proto(np.array([[0.9]], dtype=np.float32), response.outputs['detection_scores'])
+    tfutils.make_tensor_proto(np.array([[2.]], dtype=np.float32), response.outputs['detection_classes'])
+    future = tfutils.DetectionFuture(_DoneFuture(response), [(10, 20, 3)], conf_threshold=0.5)
+    assert future.done()
+    assert future.result() == [{'2': [[0, 0, 10, 5, pytest.approx(0.9), '2']]}]
+
+
+def test_model_is_not_available_without_server():
+    assert not tfutils.is_model_available('127.0.0.1', 1, 'model', timeout=1.0)
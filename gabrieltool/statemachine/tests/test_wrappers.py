@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `statemachine` processor wrappers."""
+
+import json
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from gabrieltool.statemachine import callable_zoo, fsm, processor_zoo, runner
+
+
+class SquareDetector(callable_zoo.CallableBase):
+    """Detects the bounding box of non-zero pixels."""
+
+    def __init__(self, label='square'):
+        super().__init__()
+        self.label = label
+        self.count = 0
+
+    def __call__(self, image):
+        self.count += 1
+        ys, xs = np.nonzero(image[..., 0])
+        if len(xs) == 0:
+            return {}
+        return {self.label: [[int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1, 0.9, self.label]]}
+
+
+@pytest.fixture
+def square_detector(monkeypatch):
+    monkeypatch.setattr(processor_zoo, 'SquareDetector', SquareDetector, raising=False)
+
+
+def make_frame(x, y, texture):
+    image = np.zeros((240, 320, 3), dtype=np.uint8)
+    image[y:y + texture.shape[0], x:x + texture.shape[1]] = texture
+    return image
+
+
+def test_TrackingCallable(square_detector):
+    texture = np.random.RandomState(0).randint(50, 255, (60, 60, 3), dtype=np.uint8)
+    proc = processor_zoo.TrackingCallable('SquareDetector', {}, detect_every_n=4)
+    for i in range(6):
+        x, y = 50 + 3 * i, 40 + 2 * i
+        results = proc(make_frame(x, y, texture))
+        assert results['square'][0][:4] == [x, y, x + 60, y + 60]
+        assert results['square'][0][4:] == [0.9, 'square']
+    # detected on the first and the fifth frame
+    assert proc.detector.count == 2
+    # the detector runs again when boxes cannot be tracked
+    proc(np.zeros((240, 320, 3), dtype=np.uint8))
+    assert proc.detector.count == 3
+
+
+def test_TrackingCallable_serialization():
+    proc = processor_zoo.TrackingCallable('DummyCallable', {'dummy_input': 'value'}, detect_every_n=3)
+    st = fsm.State(name='start', processors=[fsm.Processor(callable_obj=proc)])
+    loaded = fsm.StateMachine.from_bytes(fsm.StateMachine.to_bytes(name='fsm', start_state=st))
+    loaded_proc = loaded.processors[0].callable_obj
+    assert loaded_proc == proc
+    assert loaded_proc.detector == processor_zoo.DummyCallable('value')
+
+
+class ConstantDetector(callable_zoo.CallableBase):
+
+    @callable_zoo.record_kwargs
+    def __init__(self, label, confidence):
+        super().__init__()
+        self.count = 0
+
+    def __call__(self, image):
+        self.count += 1
+        label, confidence = self.kwargs['label'], self.kwargs['confidence']
+        return {label: [[0, 0, 1, 1, confidence, label]]}
+
+
+def test_CascadeCallable(monkeypatch):
+    monkeypatch.setattr(processor_zoo, 'ConstantDetector', ConstantDetector, raising=False)
+    image = np.zeros((4, 4, 3), dtype=np.uint8)
+    cheap = {'callable_name': 'ConstantDetector', 'callable_args': {'label': 'bread', 'confidence': 0.6}}
+    expensive = {'callable_name': 'ConstantDetector', 'callable_args': {'label': 'ham', 'confidence': 0.9}}
+
+    proc = processor_zoo.CascadeCallable([dict(cheap, min_confidence=0.5), expensive])
+    assert list(proc(image)) == ['bread']
+    proc = processor_zoo.CascadeCallable([dict(cheap, min_confidence=0.7), expensive])
+    assert list(proc(image)) == ['ham']
+    proc = processor_zoo.CascadeCallable([dict(cheap, required_classes=['ham']), expensive])
+    assert list(proc(image)) == ['ham']
+    assert [stage.count for stage in proc.wrapped_callables] == [1, 1]
+    assert proc.stage_counts == [0, 1]
+
+    # stages can be given as JSON, e.g. from the editor
+    st = fsm.State(name='start', processors=[fsm.Processor(callable_obj=processor_zoo.CascadeCallable(
+        json.dumps([dict(cheap, min_confidence=0.7), expensive])))])
+    loaded = fsm.StateMachine.from_bytes(fsm.StateMachine.to_bytes(name='fsm', start_state=st))
+    assert list(loaded.processors[0].callable_obj(image)) == ['ham']
+
+
+def test_CachedCallable(square_detector):
+    texture = np.random.RandomState(0).randint(50, 255, (60, 60, 3), dtype=np.uint8)
+    proc = processor_zoo.CachedCallable('SquareDetector', {}, max_size=2, ttl=None)
+    image = make_frame(50, 40, texture)
+    results = proc(image)
+    # a near-identical frame (re-encoded as JPEG) is a hit
+    reencoded = cv2.imdecode(cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), 90])[1], cv2.IMREAD_COLOR)
+    assert proc(reencoded) is results
+    assert proc.callable_obj.count == 1
+    proc(make_frame(150, 100, texture))
+    assert proc.callable_obj.count == 2
+    assert (proc.cache.hits, proc.cache.misses) == (1, 2)
+    assert proc.cache.hit_rate == pytest.approx(1 / 3)
+    # callables with the same settings share the cache
+    assert processor_zoo.CachedCallable('SquareDetector', {}, max_size=2, ttl=None).cache is proc.cache
+
+
+def test_CachedCallable_verifies_hash_collisions(square_detector):
+    from gabrieltool.statemachine.callable_zoo.processor_zoo import wrappers
+    # both frames get brighter from left to right, so all bits of their hashes are set
+    dark = np.tile(np.linspace(1, 90, 320).astype(np.uint8)[np.newaxis, :, np.newaxis], (240, 1, 3))
+    bright = np.tile(np.linspace(120, 250, 320).astype(np.uint8)[np.newaxis, :, np.newaxis], (240, 1, 3))
+    assert (wrappers.dhash(callable_zoo.FrameContext(dark))
+            == wrappers.dhash(callable_zoo.FrameContext(bright)))
+    proc = processor_zoo.CachedCallable('SquareDetector', {'label': 'collision'}, ttl=None)
+    proc(dark)
+    proc(bright)
+    assert proc.callable_obj.count == 2
+    # without verification, a hash match is a hit. The cache above is shared
+    proc = processor_zoo.CachedCallable('SquareDetector', {'label': 'collision'}, ttl=None, max_pixel_diff=None)
+    assert proc(dark) is proc(bright)
+    assert proc.callable_obj.count == 0
+
+
+def test_LRUCache_eviction():
+    from gabrieltool.statemachine.callable_zoo.processor_zoo import wrappers
+    cache = wrappers.LRUCache(max_size=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert len(cache) == 2
+    cache = wrappers.LRUCache(ttl=0.01)
+    cache.put('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+
+
+def test_warm_up_skips_wrapper_state(square_detector):
+    stage = {'callable_name': 'SquareDetector', 'callable_args': {}}
+    cached = processor_zoo.CachedCallable('SquareDetector', {'label': 'warm'}, max_size=4, ttl=None)
+    cascade = processor_zoo.CascadeCallable([stage, stage])
+    tracking = processor_zoo.TrackingCallable('SquareDetector', {})
+    storage = {}
+    with callable_zoo.session_scope(storage):
+        for proc in (cached, cascade, tracking):
+            runner.warm_up(proc, num_iterations=2, image_shape=(8, 8, 3))
+    # the wrapped detectors are warmed up, but the wrappers keep no trace of it
+    assert cached.callable_obj.count == 2
+    assert [detector.count for detector in cascade.wrapped_callables] == [2, 2]
+    assert tracking.detector.count == 2
+    assert len(cached.cache) == 0
+    assert cascade.stage_counts == [0, 0]
+    assert not storage